@@ -0,0 +1,309 @@
+import numpy, threading, zlib, shlex
+from collections import OrderedDict
+from osgeo import gdal, ogr, gdal_array
+
+
+"""
+##########################################################
+A size limited cache of decoded source blocks, shared by every tiling task
+"""
+
+#Neighbouring tiles overlap by their buffers, so the blocks along each edge get asked for more than once
+#Keeping the decoded blocks means each one only gets decompressed once, as long as the cache is big enough to hold a row of tiles' edges
+def makeBlockCache(maxBytes):
+    return {'maxBytes':maxBytes, 'blocks':OrderedDict(), 'bytes':0, 'lock':threading.Lock()}
+
+def cacheGet(cache, key):
+    with cache['lock']:
+        block = cache['blocks'].get(key)
+        if block is not None:
+            cache['blocks'].move_to_end(key)
+        return block
+
+#Add a block, then drop the least recently used blocks until it's back under its size
+def cachePut(cache, key, block):
+    with cache['lock']:
+        if key in cache['blocks']:
+            return
+        cache['blocks'][key] = block
+        cache['bytes'] = cache['bytes'] + block.nbytes
+        while cache['bytes'] > cache['maxBytes'] and len(cache['blocks']) > 1:
+            droppedKey, droppedBlock = cache['blocks'].popitem(last = False)
+            cache['bytes'] = cache['bytes'] - droppedBlock.nbytes
+
+
+"""
+##########################################################
+Opening a source and reading windows of it one block at a time
+"""
+
+#Checksums of the blocks can be noted down as they're decoded, so a later run can tell which blocks have changed
+def openSource(sourcePath, recordChecksums = False):
+    dataset = gdal.Open(sourcePath)
+    firstBand = dataset.GetRasterBand(1)
+    blockWidth, blockHeight = firstBand.GetBlockSize()
+    source = {'path':sourcePath, 'width':dataset.RasterXSize, 'height':dataset.RasterYSize, 'bandCount':dataset.RasterCount,
+        'blockWidth':blockWidth, 'blockHeight':blockHeight, 'geoTransform':dataset.GetGeoTransform(), 'projection':dataset.GetProjection(),
+        'dataType':firstBand.DataType, 'noDataValue':firstBand.GetNoDataValue(),
+        'colourInterpretations':[dataset.GetRasterBand(bandNumber + 1).GetColorInterpretation() for bandNumber in range(dataset.RasterCount)],
+        'stats':{'hits':0, 'misses':0, 'reads':0, 'bytesDecoded':0, 'bytesServed':0}, 'statsLock':threading.Lock(), 'checksums':{} if recordChecksums else None,
+        'datasets':{}, 'datasetsLock':threading.Lock()}
+    dataset = None
+    return source
+
+#A gdal dataset can't be read from two threads at once, so each thread gets its own handle to the source
+#The handles are kept with the source rather than with the threads, so they can all be closed from wherever the reading finishes
+def sourceDataset(source):
+    threadId = threading.get_ident()
+    with source['datasetsLock']:
+        if threadId not in source['datasets']:
+            source['datasets'][threadId] = gdal.Open(source['path'])
+        return source['datasets'][threadId]
+
+#Close every thread's handle once the reading is done, otherwise the source stays open (and on Windows, locked) until QGIS closes
+#The source can still be read afterwards, it just opens new handles
+def closeSource(source):
+    with source['datasetsLock']:
+        source['datasets'] = {}
+
+def addStats(source, **amounts):
+    with source['statsLock']:
+        for statName in amounts:
+            source['stats'][statName] = source['stats'][statName] + amounts[statName]
+
+#Read a run of neighbouring blocks in one go, then split it back up into blocks for the cache
+def readBlockRun(source, cache, blockRow, firstColumn, lastColumn):
+    xStart = firstColumn * source['blockWidth']
+    xEnd = min((lastColumn + 1) * source['blockWidth'], source['width'])
+    yStart = blockRow * source['blockHeight']
+    yEnd = min(yStart + source['blockHeight'], source['height'])
+    values = sourceDataset(source).ReadAsArray(xStart, yStart, xEnd - xStart, yEnd - yStart)
+    if values.ndim == 2:
+        values = values[numpy.newaxis]
+    addStats(source, reads = 1, bytesDecoded = values.nbytes)
+    blocks = {}
+    for blockColumn in range(firstColumn, lastColumn + 1):
+        blockXStart = blockColumn * source['blockWidth'] - xStart
+        blockXEnd = min((blockColumn + 1) * source['blockWidth'], source['width']) - xStart
+        blocks[blockColumn] = values[:, :, blockXStart:blockXEnd].copy()
+        cachePut(cache, (source['path'], blockColumn, blockRow), blocks[blockColumn])
+        if source['checksums'] is not None:
+            source['checksums'][blockKey(blockColumn, blockRow)] = blockChecksum(blocks[blockColumn])
+    return blocks
+
+#Read a pixel window as (bands, rows, columns), anything hanging off the edge of the source is left as 0
+def readWindow(source, cache, xOffset, yOffset, xSize, ySize):
+    window = numpy.zeros((source['bandCount'], ySize, xSize), gdal_array.GDALTypeCodeToNumericTypeCode(source['dataType']))
+    readXStart = max(xOffset, 0)
+    readXEnd = min(xOffset + xSize, source['width'])
+    readYStart = max(yOffset, 0)
+    readYEnd = min(yOffset + ySize, source['height'])
+    if readXStart >= readXEnd or readYStart >= readYEnd:
+        return window
+
+    #The window is widened out to whole blocks, so every read lines up with how the source is stored
+    firstColumn = readXStart // source['blockWidth']
+    lastColumn = (readXEnd - 1) // source['blockWidth']
+    for blockRow in range(readYStart // source['blockHeight'], (readYEnd - 1) // source['blockHeight'] + 1):
+        blocks = {}
+        missingColumns = []
+        for blockColumn in range(firstColumn, lastColumn + 1):
+            block = cacheGet(cache, (source['path'], blockColumn, blockRow))
+            if block is None:
+                missingColumns.append(blockColumn)
+            else:
+                blocks[blockColumn] = block
+        addStats(source, hits = len(blocks), misses = len(missingColumns))
+
+        #Blocks that are missing side by side are read together
+        runStart = None
+        for missingNumber, blockColumn in enumerate(missingColumns):
+            if runStart is None:
+                runStart = blockColumn
+            if missingNumber == len(missingColumns) - 1 or missingColumns[missingNumber + 1] != blockColumn + 1:
+                blocks.update(readBlockRun(source, cache, blockRow, runStart, blockColumn))
+                runStart = None
+
+        #Copy the part of each block that falls within the window
+        blockYStart = blockRow * source['blockHeight']
+        for blockColumn, block in blocks.items():
+            blockXStart = blockColumn * source['blockWidth']
+            xStart = max(blockXStart, readXStart)
+            xEnd = min(blockXStart + block.shape[2], readXEnd)
+            yStart = max(blockYStart, readYStart)
+            yEnd = min(blockYStart + block.shape[1], readYEnd)
+            window[:, yStart - yOffset:yEnd - yOffset, xStart - xOffset:xEnd - xOffset] = block[:, yStart - blockYStart:yEnd - blockYStart, xStart - blockXStart:xEnd - blockXStart]
+        addStats(source, bytesServed = source['bandCount'] * (readXEnd - readXStart) * (min(blockYStart + source['blockHeight'], readYEnd) - max(blockYStart, readYStart)) * window.itemsize)
+    return window
+
+
+"""
+##########################################################
+Block checksums, for finding what has changed since the last run
+"""
+
+def blockKey(blockColumn, blockRow):
+    return str(blockColumn) + '_' + str(blockRow)
+
+def blockChecksum(block):
+    return zlib.crc32(numpy.ascontiguousarray(block).tobytes())
+
+#Decode every block of the source once, a row of blocks at a time, and return their checksums
+#Given a list of block keys, only those blocks are decoded, which is how a delta run avoids decompressing the whole image
+def scanChecksums(source, blockKeys = None):
+    if blockKeys is not None:
+        return {key:blockChecksum(readBlock(source, key)) for key in blockKeys}
+    checksums = {}
+    for blockRow in range((source['height'] + source['blockHeight'] - 1) // source['blockHeight']):
+        yStart = blockRow * source['blockHeight']
+        values = sourceDataset(source).ReadAsArray(0, yStart, source['width'], min(source['blockHeight'], source['height'] - yStart))
+        if values.ndim == 2:
+            values = values[numpy.newaxis]
+        addStats(source, reads = 1, bytesDecoded = values.nbytes)
+        for blockColumn in range((source['width'] + source['blockWidth'] - 1) // source['blockWidth']):
+            checksums[blockKey(blockColumn, blockRow)] = blockChecksum(values[:, :, blockColumn * source['blockWidth']:(blockColumn + 1) * source['blockWidth']])
+    return checksums
+
+def readBlock(source, key):
+    blockColumn, blockRow = [int(part) for part in key.split('_')]
+    xStart = blockColumn * source['blockWidth']
+    yStart = blockRow * source['blockHeight']
+    values = sourceDataset(source).ReadAsArray(xStart, yStart, min(source['blockWidth'], source['width'] - xStart), min(source['blockHeight'], source['height'] - yStart))
+    if values.ndim == 2:
+        values = values[numpy.newaxis]
+    addStats(source, reads = 1, bytesDecoded = values.nbytes)
+    return values
+
+#Where each block is stored in the file, as the offset and byte count of each band's copy of it, without decoding anything
+#A compressed block that's rewritten nearly always lands somewhere else or comes out a different size, so blocks that haven't moved can be skipped
+#Returns None unless the source is a compressed GeoTIFF, since uncompressed blocks are always rewritten in place at the same size
+def blockLayout(source):
+    dataset = sourceDataset(source)
+    if dataset.GetDriver().ShortName != 'GTiff' or dataset.GetMetadataItem('COMPRESSION', 'IMAGE_STRUCTURE') is None:
+        return None
+    bandNumbers = [1] if dataset.GetMetadataItem('INTERLEAVE', 'IMAGE_STRUCTURE') == 'PIXEL' else range(1, source['bandCount'] + 1)
+    bands = [dataset.GetRasterBand(bandNumber) for bandNumber in bandNumbers]
+    layout = {}
+    for blockRow in range((source['height'] + source['blockHeight'] - 1) // source['blockHeight']):
+        for blockColumn in range((source['width'] + source['blockWidth'] - 1) // source['blockWidth']):
+            blockName = str(blockColumn) + '_' + str(blockRow)
+            entry = []
+            for band in bands:
+                entry.append(band.GetMetadataItem('BLOCK_OFFSET_' + blockName, 'TIFF'))
+                entry.append(band.GetMetadataItem('BLOCK_SIZE_' + blockName, 'TIFF'))
+            if None in entry:
+                return None
+            layout[blockKey(blockColumn, blockRow)] = entry
+    return layout
+
+#The map extents (minX, minY, maxX, maxY) of the blocks whose checksums differ, side by side blocks are joined into one extent
+def changedBlockExtents(source, oldChecksums, newChecksums):
+    originX, pixelWidth, _, originY, _, pixelHeight = source['geoTransform']
+    changedExtents = []
+    for blockRow in range((source['height'] + source['blockHeight'] - 1) // source['blockHeight']):
+        runStart = None
+        blockColumnCount = (source['width'] + source['blockWidth'] - 1) // source['blockWidth']
+        for blockColumn in range(blockColumnCount + 1):
+            #Blocks that weren't noted down last time never went into a tile, so they can't change the output
+            key = blockKey(blockColumn, blockRow)
+            changed = blockColumn < blockColumnCount and key in oldChecksums and oldChecksums[key] != newChecksums.get(key)
+            if changed and runStart is None:
+                runStart = blockColumn
+            elif not changed and runStart is not None:
+                xStart = runStart * source['blockWidth']
+                xEnd = min(blockColumn * source['blockWidth'], source['width'])
+                yStart = blockRow * source['blockHeight']
+                yEnd = min(yStart + source['blockHeight'], source['height'])
+                xs = [originX + xStart * pixelWidth, originX + xEnd * pixelWidth]
+                ys = [originY + yStart * pixelHeight, originY + yEnd * pixelHeight]
+                changedExtents.append((min(xs), min(ys), max(xs), max(ys)))
+                runStart = None
+    return changedExtents
+
+#The keys of every block that an extent (minX, minY, maxX, maxY) touches, the other way round to the above
+def blocksInExtents(source, extents):
+    originX, pixelWidth, _, originY, _, pixelHeight = source['geoTransform']
+    blockKeys = set()
+    for extent in extents:
+        columnStart = max(int(numpy.floor((extent[0] - originX) / pixelWidth)), 0)
+        columnEnd = min(int(numpy.ceil((extent[2] - originX) / pixelWidth)), source['width'])
+        rowStart = max(int(numpy.floor((extent[3] - originY) / pixelHeight)), 0)
+        rowEnd = min(int(numpy.ceil((extent[1] - originY) / pixelHeight)), source['height'])
+        if columnStart >= columnEnd or rowStart >= rowEnd:
+            continue
+        for blockRow in range(rowStart // source['blockHeight'], (rowEnd - 1) // source['blockHeight'] + 1):
+            for blockColumn in range(columnStart // source['blockWidth'], (columnEnd - 1) // source['blockWidth'] + 1):
+                blockKeys.add(blockKey(blockColumn, blockRow))
+    return sorted(blockKeys)
+
+
+"""
+##########################################################
+Cutting a tile out of the source with a bound
+"""
+
+#Split the creation options ('|' separated, like the processing algorithms take) and the extra gdal options into what a driver's Create needs
+#Of the extra options, only the creation (-co) and config (--config) ones mean anything when no warp is being done
+def createOptions(options, extraOptions):
+    creationOptions = [o for o in options.split('|') if o != '']
+    configOptions = {}
+    extraParts = shlex.split(extraOptions)
+    for partNumber, part in enumerate(extraParts):
+        if part == '-co' and partNumber + 1 < len(extraParts):
+            creationOptions.append(extraParts[partNumber + 1])
+        elif part == '--config' and partNumber + 2 < len(extraParts):
+            configOptions[extraParts[partNumber + 1]] = extraParts[partNumber + 2]
+    return creationOptions, configOptions
+
+#Does the same job as clipping with the bound as a cutline, but stays on the source's pixel grid and reads through the cache
+#The options and extra options are the ones the clip was given, they're applied to the tile that's written
+def cutTile(source, cache, boundPath, outRasterPath, options, extraOptions = ''):
+    boundDataset = ogr.Open(boundPath)
+    boundLayer = boundDataset.GetLayer()
+    minX, maxX, minY, maxY = boundLayer.GetExtent()
+
+    #Snap the bound's extent out to whole source pixels
+    originX, pixelWidth, rotationX, originY, rotationY, pixelHeight = source['geoTransform']
+    xOffset = int(numpy.floor((minX - originX) / pixelWidth + 0.000001))
+    xEnd = int(numpy.ceil((maxX - originX) / pixelWidth - 0.000001))
+    yOffset = int(numpy.floor((maxY - originY) / pixelHeight + 0.000001))
+    yEnd = int(numpy.ceil((minY - originY) / pixelHeight - 0.000001))
+    tileGeoTransform = (originX + xOffset * pixelWidth, pixelWidth, rotationX, originY + yOffset * pixelHeight, rotationY, pixelHeight)
+    values = readWindow(source, cache, xOffset, yOffset, xEnd - xOffset, yEnd - yOffset)
+
+    #Anything outside the bound is set to 0, the same as the cutline would
+    maskDataset = gdal.GetDriverByName('MEM').Create('', xEnd - xOffset, yEnd - yOffset, 1, gdal.GDT_Byte)
+    maskDataset.SetGeoTransform(tileGeoTransform)
+    maskDataset.SetProjection(source['projection'])
+    gdal.RasterizeLayer(maskDataset, [1], boundLayer, burn_values = [1])
+    values[:, maskDataset.ReadAsArray() == 0] = 0
+    maskDataset = None
+    boundDataset = None
+
+    #Config options are set for this thread only, as the other tiling tasks are writing at the same time
+    creationOptions, configOptions = createOptions(options, extraOptions)
+    for configName in configOptions:
+        gdal.SetThreadLocalConfigOption(configName, configOptions[configName])
+    try:
+        outDataset = gdal.GetDriverByName('GTiff').Create(outRasterPath, xEnd - xOffset, yEnd - yOffset, source['bandCount'], source['dataType'], creationOptions)
+        outDataset.SetGeoTransform(tileGeoTransform)
+        outDataset.SetProjection(source['projection'])
+        for bandNumber in range(source['bandCount']):
+            outBand = outDataset.GetRasterBand(bandNumber + 1)
+            outBand.SetColorInterpretation(source['colourInterpretations'][bandNumber])
+            if source['noDataValue'] is not None:
+                outBand.SetNoDataValue(source['noDataValue'])
+            outBand.WriteArray(values[bandNumber])
+        outDataset.FlushCache()
+        outDataset = None
+    finally:
+        for configName in configOptions:
+            gdal.SetThreadLocalConfigOption(configName, None)
+
+#A line for the debug file on how well the cache did for a source
+def describeStats(source):
+    stats = source['stats']
+    blockRequests = stats['hits'] + stats['misses']
+    hitRate = 0 if blockRequests == 0 else stats['hits'] / blockRequests * 100
+    return ('Block cache hit rate was ' + str(round(hitRate, 1)) + '% (' + str(stats['hits']) + ' of ' + str(blockRequests) + ' blocks), '
+        + str(round(stats['bytesDecoded'] / 1000000, 1)) + 'mb decoded in ' + str(stats['reads']) + ' reads for ' + str(round(stats['bytesServed'] / 1000000, 1)) + 'mb of tiles')
@@ -0,0 +1,475 @@
+import numpy, sys, time, threading
+from osgeo import gdal
+
+#Numba is optional, without it every kernel runs as plain numpy
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+"""
+##########################################################
+Raster reading and writing for the numpy stages
+"""
+
+#Read a single band as float64, with nodata held as nan so it drops out of the min/max the same way grass ignores nulls
+def readBand(rasterPath, band = 1):
+    dataset = gdal.Open(rasterPath)
+    rasterBand = dataset.GetRasterBand(band)
+    values = rasterBand.ReadAsArray().astype(numpy.float64)
+    noDataValue = rasterBand.GetNoDataValue()
+    if noDataValue is not None:
+        values[values == noDataValue] = numpy.nan
+    dataset = None
+    return values
+
+#The grid of a raster, so the others can be lined up with it
+def readGrid(rasterPath):
+    dataset = gdal.Open(rasterPath)
+    grid = {'geoTransform':dataset.GetGeoTransform(), 'shape':(dataset.RasterYSize, dataset.RasterXSize)}
+    dataset = None
+    return grid
+
+#Read a band onto another grid by taking the nearest pixel centre, the same as the raster calculator does, with nan off the edges
+def readBandOnGrid(rasterPath, grid, band = 1):
+    values = readBand(rasterPath, band)
+    valuesGrid = readGrid(rasterPath)
+    if valuesGrid['geoTransform'] == grid['geoTransform'] and valuesGrid['shape'] == grid['shape']:
+        return values
+    originX, pixelWidth, _, originY, _, pixelHeight = grid['geoTransform']
+    valuesOriginX, valuesPixelWidth, _, valuesOriginY, _, valuesPixelHeight = valuesGrid['geoTransform']
+    columns = numpy.floor((originX + (numpy.arange(grid['shape'][1]) + 0.5) * pixelWidth - valuesOriginX) / valuesPixelWidth).astype(numpy.int64)
+    rows = numpy.floor((originY + (numpy.arange(grid['shape'][0]) + 0.5) * pixelHeight - valuesOriginY) / valuesPixelHeight).astype(numpy.int64)
+    columnsInside = (columns >= 0) & (columns < values.shape[1])
+    rowsInside = (rows >= 0) & (rows < values.shape[0])
+    aligned = values[numpy.clip(rows, 0, values.shape[0] - 1)][:, numpy.clip(columns, 0, values.shape[1] - 1)]
+    aligned[~rowsInside, :] = numpy.nan
+    aligned[:, ~columnsInside] = numpy.nan
+    return aligned
+
+#Write an array out with the same grid as another raster, the options are the same pipe separated string used for processing.run
+def writeBandLike(values, likeRasterPath, outRasterPath, options, dataType = gdal.GDT_Byte, noDataValue = 0):
+    likeDataset = gdal.Open(likeRasterPath)
+    outDataset = gdal.GetDriverByName('GTiff').Create(outRasterPath, likeDataset.RasterXSize, likeDataset.RasterYSize, 1, dataType, [o for o in options.split('|') if o != ''])
+    outDataset.SetGeoTransform(likeDataset.GetGeoTransform())
+    outDataset.SetProjection(likeDataset.GetProjection())
+    outBand = outDataset.GetRasterBand(1)
+    outBand.SetNoDataValue(noDataValue)
+    outBand.WriteArray(numpy.where(numpy.isnan(values), noDataValue, values))
+    outBand.FlushCache()
+    outDataset = None
+    likeDataset = None
+
+
+"""
+##########################################################
+A multi-radius min/max index, built once per tile and shared by every contrast scale
+"""
+
+#Level k of the index holds the max (or min) of each horizontal run of 2^k pixels (a sparse table)
+#Any run length can then be answered with two overlapping lookups, and a circular window is one run per row
+#The array is padded with nan by the largest radius so that windows at the edges just see fewer pixels
+#The levels are stacked into one array so that the jit kernels can read them too
+#They're kept as float32, half the memory of float64, which still holds the whole numbers of the combined bands exactly
+def buildMinMaxIndex(values, maxDiameter):
+    padding = maxDiameter // 2
+    padded = numpy.pad(values.astype(numpy.float32), padding, mode = 'constant', constant_values = numpy.nan)
+    levelCount = int(numpy.log2(maxDiameter)) + 1
+    maxLevels = numpy.full((levelCount,) + padded.shape, numpy.nan, numpy.float32)
+    minLevels = numpy.full((levelCount,) + padded.shape, numpy.nan, numpy.float32)
+    maxLevels[0] = padded
+    minLevels[0] = padded
+    for level in range(1, levelCount):
+        runLength = 2 ** (level - 1)
+        maxLevels[level][:, :-runLength] = numpy.fmax(maxLevels[level - 1][:, :-runLength], maxLevels[level - 1][:, runLength:])
+        minLevels[level][:, :-runLength] = numpy.fmin(minLevels[level - 1][:, :-runLength], minLevels[level - 1][:, runLength:])
+    return {'padding':padding, 'maxDiameter':maxDiameter, 'shape':values.shape, 'maxLevels':maxLevels, 'minLevels':minLevels}
+
+
+def checkedRadius(index, diameter):
+    if diameter > index['maxDiameter']:
+        raise ValueError('The index was built for a diameter of ' + str(index['maxDiameter']) + ', not ' + str(diameter))
+    return diameter // 2
+
+#Query the index for the max or min within a circular window, matching the neighbourhood of r.neighbors -c
+def circularWindowQuery(index, diameter, levelsKey, combine):
+    levels = index[levelsKey]
+    padding = index['padding']
+    height, width = index['shape']
+    radius = checkedRadius(index, diameter)
+    result = numpy.full(index['shape'], numpy.nan)
+    for rowOffset in range(-radius, radius + 1):
+        halfWidth = int(numpy.sqrt(radius * radius - rowOffset * rowOffset))
+        runLength = halfWidth * 2 + 1
+        level = int(numpy.log2(runLength))
+        levelValues = levels[level]
+        rowStart = padding + rowOffset
+        colStart = padding - halfWidth
+        colEnd = colStart + runLength - (2 ** level)
+        rowRuns = combine(levelValues[rowStart:rowStart + height, colStart:colStart + width], levelValues[rowStart:rowStart + height, colEnd:colEnd + width])
+        result = combine(result, rowRuns)
+    return result
+
+def circularMaximum(index, diameter, backend = 'numpy'):
+    if resolveBackend(backend) == 'jit':
+        return callJit(circularWindowJit, index['maxLevels'], index['padding'], index['shape'][0], index['shape'][1], checkedRadius(index, diameter), True)
+    return circularWindowQuery(index, diameter, 'maxLevels', numpy.fmax)
+
+def circularMinimum(index, diameter, backend = 'numpy'):
+    if resolveBackend(backend) == 'jit':
+        return callJit(circularWindowJit, index['minLevels'], index['padding'], index['shape'][0], index['shape'][1], checkedRadius(index, diameter), False)
+    return circularWindowQuery(index, diameter, 'minLevels', numpy.fmin)
+
+
+"""
+##########################################################
+The per pixel formulas, as numpy
+"""
+
+#These are the raster calculator formulas from the tile processing, with nan standing in for nodata
+#Each one has a jit twin below that does the whole formula in one pass per pixel, rather than making a temporary array for every step
+
+def combinedBandsNumpy(red, green, blue, alpha):
+    combined = numpy.where(alpha > 128, numpy.trunc((red + green + blue) / 3), -1.0)
+    combined[numpy.isnan(alpha)] = numpy.nan
+    return combined
+
+#The tone shift of the smoothed min and max, then their range and midrange, stacked as (range, midrange)
+def rangeMidrangeNumpy(minimumSmooth, maximumSmooth, toneShiftFactor):
+    minimumScaled = minimumSmooth ** toneShiftFactor
+    maximumScaled = 255 - numpy.abs(maximumSmooth - 255) ** toneShiftFactor
+    return numpy.stack([maximumScaled - minimumScaled, (maximumScaled + minimumScaled) / 2])
+
+#How far the brightest (direction 1) or darkest (direction -1) band would be pushed past the midrange, the white and black clip
+def clipAmountNumpy(extreme, midrange, rangeValues, direction):
+    return direction * (extreme - midrange) * (255 / (rangeValues + 1)) - 128
+
+def differenceToApplyNumpy(combined, midrange, rangeValues, scaleWeight):
+    return ((combined - midrange) * (255 / (rangeValues + 1)) + 128 - combined) * scaleWeight
+
+#The penalty for disagreeance blend of the scales, then the cap on extreme values
+def combineAndCapNumpy(differences, capDenominator, capMinusFactor, capSubtraction):
+    scaleSum = numpy.sum(differences, axis = 0)
+    scaleCount = differences.shape[0]
+    combined = (scaleSum / scaleCount) * numpy.abs(scaleSum) / numpy.maximum(scaleCount * numpy.max(numpy.abs(differences), axis = 0), 0.0001)
+    return capDenominator / (1 + (1 - capMinusFactor) ** combined) - capSubtraction
+
+def clipFactorNumpy(clipValues, clipScaling):
+    return 1.004 ** (numpy.sum(numpy.sqrt(clipValues), axis = 0) * clipScaling) - 1
+
+def applyDifferenceNumpy(band, difference, whiteClipFactor, blackClipFactor, shadowBoost):
+    return numpy.trunc((band + difference) * (1 - whiteClipFactor - blackClipFactor) + 255 * blackClipFactor + shadowBoost)
+
+
+"""
+##########################################################
+The same formulas jit compiled with numba, when it is installed
+"""
+
+if numba is not None:
+
+    @numba.njit(parallel = True, cache = True)
+    def combinedBandsJit(red, green, blue, alpha):
+        combined = numpy.empty(red.shape)
+        for row in numba.prange(red.shape[0]):
+            for column in range(red.shape[1]):
+                if numpy.isnan(alpha[row, column]):
+                    combined[row, column] = numpy.nan
+                elif alpha[row, column] > 128:
+                    combined[row, column] = numpy.trunc((red[row, column] + green[row, column] + blue[row, column]) / 3)
+                else:
+                    combined[row, column] = -1.0
+        return combined
+
+    @numba.njit(parallel = True, cache = True)
+    def rangeMidrangeJit(minimumSmooth, maximumSmooth, toneShiftFactor):
+        rangeMidrange = numpy.empty((2,) + minimumSmooth.shape)
+        for row in numba.prange(minimumSmooth.shape[0]):
+            for column in range(minimumSmooth.shape[1]):
+                minimumScaled = minimumSmooth[row, column] ** toneShiftFactor
+                maximumScaled = 255 - abs(maximumSmooth[row, column] - 255) ** toneShiftFactor
+                rangeMidrange[0, row, column] = maximumScaled - minimumScaled
+                rangeMidrange[1, row, column] = (maximumScaled + minimumScaled) / 2
+        return rangeMidrange
+
+    @numba.njit(parallel = True, cache = True)
+    def clipAmountJit(extreme, midrange, rangeValues, direction):
+        clipAmount = numpy.empty(extreme.shape)
+        for row in numba.prange(extreme.shape[0]):
+            for column in range(extreme.shape[1]):
+                clipAmount[row, column] = direction * (extreme[row, column] - midrange[row, column]) * (255 / (rangeValues[row, column] + 1)) - 128
+        return clipAmount
+
+    @numba.njit(parallel = True, cache = True)
+    def differenceToApplyJit(combined, midrange, rangeValues, scaleWeight):
+        difference = numpy.empty(combined.shape)
+        for row in numba.prange(combined.shape[0]):
+            for column in range(combined.shape[1]):
+                combinedValue = combined[row, column]
+                difference[row, column] = ((combinedValue - midrange[row, column]) * (255 / (rangeValues[row, column] + 1)) + 128 - combinedValue) * scaleWeight
+        return difference
+
+    @numba.njit(parallel = True, cache = True)
+    def combineAndCapJit(differences, capDenominator, capMinusFactor, capSubtraction):
+        scaleCount = differences.shape[0]
+        capped = numpy.empty(differences.shape[1:])
+        for row in numba.prange(differences.shape[1]):
+            for column in range(differences.shape[2]):
+                scaleSum = 0.0
+                largestAbs = 0.0
+                for scaleNumber in range(scaleCount):
+                    scaleSum = scaleSum + differences[scaleNumber, row, column]
+                    largestAbs = max(largestAbs, abs(differences[scaleNumber, row, column]))
+                if numpy.isnan(scaleSum):
+                    capped[row, column] = numpy.nan
+                    continue
+                combined = (scaleSum / scaleCount) * abs(scaleSum) / max(scaleCount * largestAbs, 0.0001)
+                capped[row, column] = capDenominator / (1 + (1 - capMinusFactor) ** combined) - capSubtraction
+        return capped
+
+    @numba.njit(parallel = True, cache = True)
+    def clipFactorJit(clipValues, clipScaling):
+        clipFactor = numpy.empty(clipValues.shape[1:])
+        for row in numba.prange(clipValues.shape[1]):
+            for column in range(clipValues.shape[2]):
+                clipSum = 0.0
+                for scaleNumber in range(clipValues.shape[0]):
+                    clipSum = clipSum + numpy.sqrt(clipValues[scaleNumber, row, column])
+                clipFactor[row, column] = 1.004 ** (clipSum * clipScaling) - 1
+        return clipFactor
+
+    @numba.njit(parallel = True, cache = True)
+    def applyDifferenceJit(band, difference, whiteClipFactor, blackClipFactor, shadowBoost):
+        applied = numpy.empty(band.shape)
+        for row in numba.prange(band.shape[0]):
+            for column in range(band.shape[1]):
+                blackClip = blackClipFactor[row, column]
+                applied[row, column] = numpy.trunc((band[row, column] + difference[row, column]) * (1 - whiteClipFactor[row, column] - blackClip) + 255 * blackClip + shadowBoost[row, column])
+        return applied
+
+    #The smallest parallel kernel, the first call to one is what makes numba load its threading layer
+    @numba.njit(parallel = True, cache = True)
+    def threadingProbeJit(values):
+        total = 0.0
+        for position in numba.prange(values.shape[0]):
+            total += values[position]
+        return total
+
+    #Each pixel looks up its row runs straight from the index, so no full size temporaries are made per row offset
+    @numba.njit(parallel = True, cache = True)
+    def circularWindowJit(levels, padding, height, width, radius, findMaximum):
+        result = numpy.full((height, width), numpy.nan)
+        for row in numba.prange(height):
+            for rowOffset in range(-radius, radius + 1):
+                halfWidth = int(numpy.sqrt(radius * radius - rowOffset * rowOffset))
+                runLength = halfWidth * 2 + 1
+                level = int(numpy.log2(runLength))
+                levelRow = padding + rowOffset + row
+                colStart = padding - halfWidth
+                colEnd = colStart + runLength - (2 ** level)
+                for column in range(width):
+                    current = result[row, column]
+                    for value in (levels[level, levelRow, colStart + column], levels[level, levelRow, colEnd + column]):
+                        if numpy.isnan(value):
+                            continue
+                        if numpy.isnan(current) or (findMaximum and value > current) or (not findMaximum and value < current):
+                            current = value
+                    result[row, column] = current
+        return result
+
+    jitKernels = {'combinedBands':combinedBandsJit, 'rangeMidrange':rangeMidrangeJit, 'clipAmount':clipAmountJit, 'differenceToApply':differenceToApplyJit, 'combineAndCap':combineAndCapJit, 'clipFactor':clipFactorJit, 'applyDifference':applyDifferenceJit}
+
+numpyKernels = {'combinedBands':combinedBandsNumpy, 'rangeMidrange':rangeMidrangeNumpy, 'clipAmount':clipAmountNumpy, 'differenceToApply':differenceToApplyNumpy, 'combineAndCap':combineAndCapNumpy, 'clipFactor':clipFactorNumpy, 'applyDifference':applyDifferenceNumpy}
+
+
+"""
+##########################################################
+Picking the backend, and keeping the jit kernels safe to call from several tasks at once
+"""
+
+#Several tiles apply their differences in their own tasks, so the jit kernels get called from more than one thread at a time
+#Only the tbb and omp threading layers allow that, numba's own workqueue layer aborts the whole process (and QGIS with it)
+#When neither can be loaded the jit calls take turns through a lock instead, each call still runs its rows in parallel
+jitLock = threading.Lock()
+jitThreadSafe = None
+
+def settleThreadingLayer():
+    global jitThreadSafe
+    with jitLock:
+        if jitThreadSafe is not None:
+            return
+        #'threadsafe' lets numba pick tbb or omp, whichever it can load, and it fails rather than falling back to workqueue
+        #The setting is put back afterwards, the layer that got loaded stays for the life of the process either way
+        previousLayer = numba.config.THREADING_LAYER
+        try:
+            numba.config.THREADING_LAYER = 'threadsafe'
+            threadingProbeJit(numpy.ones(2))
+        except ValueError:
+            numba.config.THREADING_LAYER = previousLayer
+            threadingProbeJit(numpy.ones(2))
+        finally:
+            numba.config.THREADING_LAYER = previousLayer
+        #Something else in the process may have started the threads already, so check what was actually loaded
+        jitThreadSafe = numba.threading_layer() in ['tbb', 'omp']
+        if not jitThreadSafe:
+            print("Numba is using its " + numba.threading_layer() + " threading layer, which isn't thread safe, so the jit kernels will run one at a time")
+
+def callJit(jitFunction, *arguments):
+    if jitThreadSafe:
+        return jitFunction(*arguments)
+    with jitLock:
+        return jitFunction(*arguments)
+
+#Work out which backend to actually use, 'auto' and 'jit' fall back to numpy when numba isn't there
+def resolveBackend(backend):
+    if backend in ['auto', 'jit']:
+        if numba is None:
+            return 'numpy'
+        settleThreadingLayer()
+        return 'jit'
+    if backend != 'numpy':
+        raise ValueError('The kernel backend must be auto, jit or numpy, not ' + str(backend))
+    return 'numpy'
+
+#The tone shift and the clip factor are mostly powers and square roots, which numpy runs faster than the jit loop, so auto leaves them as numpy
+numpyWhenAuto = ['rangeMidrange', 'clipFactor']
+
+def kernel(kernelName, backend):
+    if backend == 'auto' and kernelName in numpyWhenAuto:
+        return numpyKernels[kernelName]
+    if resolveBackend(backend) == 'jit':
+        return lambda *arguments: callJit(jitKernels[kernelName], *arguments)
+    return numpyKernels[kernelName]
+
+
+"""
+##########################################################
+The tile stages, reading the rasters in, running a kernel and writing the result out
+"""
+
+#Float outputs use the same nodata as each other, nan is swapped for it on the way out
+floatNoData = -9999
+
+def combinedBandsStage(inImageTile, outRasterPath, options, backend):
+    bands = [readBand(inImageTile, bandNumber) for bandNumber in [1, 2, 3, 4]]
+    writeBandLike(kernel('combinedBands', backend)(*bands), inImageTile, outRasterPath, options, gdal.GDT_Int16, -1)
+
+#Both come out on the grid of the smoothed minimum, the same as the calculator used
+def rangeMidrangeStage(minimumSmoothPath, maximumSmoothPath, toneShiftFactor, rangePath, midrangePath, options, backend):
+    grid = readGrid(minimumSmoothPath)
+    rangeMidrange = kernel('rangeMidrange', backend)(readBand(minimumSmoothPath), readBandOnGrid(maximumSmoothPath, grid), toneShiftFactor)
+    writeBandLike(rangeMidrange[0], minimumSmoothPath, rangePath, options, gdal.GDT_Float32, floatNoData)
+    writeBandLike(rangeMidrange[1], minimumSmoothPath, midrangePath, options, gdal.GDT_Float32, floatNoData)
+
+def clipAmountStage(extremePath, midrangePath, rangePath, direction, outRasterPath, options, backend):
+    grid = readGrid(extremePath)
+    clipAmount = kernel('clipAmount', backend)(readBand(extremePath), readBandOnGrid(midrangePath, grid), readBandOnGrid(rangePath, grid), direction)
+    writeBandLike(clipAmount, extremePath, outRasterPath, options, gdal.GDT_Float32, floatNoData)
+
+#Everything gets lined up with the combined bands, which is how the calculator's extent was set before
+def differenceToApplyStage(combinedPath, midrangePath, rangePath, scaleWeight, outRasterPath, options, backend):
+    grid = readGrid(combinedPath)
+    difference = kernel('differenceToApply', backend)(readBand(combinedPath), readBandOnGrid(midrangePath, grid), readBandOnGrid(rangePath, grid), scaleWeight)
+    writeBandLike(difference, combinedPath, outRasterPath, options, gdal.GDT_Float32, floatNoData)
+
+def combineAndCapStage(differencePaths, capDenominator, capMinusFactor, capSubtraction, outRasterPath, options, backend):
+    grid = readGrid(differencePaths[0])
+    differences = numpy.stack([readBandOnGrid(differencePath, grid) for differencePath in differencePaths])
+    writeBandLike(kernel('combineAndCap', backend)(differences, capDenominator, capMinusFactor, capSubtraction), differencePaths[0], outRasterPath, options, gdal.GDT_Float32, floatNoData)
+
+def clipFactorStage(clipPaths, outRasterPath, options, backend):
+    grid = readGrid(clipPaths[0])
+    clipValues = numpy.stack([readBandOnGrid(clipPath, grid) for clipPath in clipPaths])
+    writeBandLike(kernel('clipFactor', backend)(clipValues, 2 / len(clipPaths)), clipPaths[0], outRasterPath, options, gdal.GDT_Float32, floatNoData)
+
+def applyDifferenceStage(inImageTile, bandNumber, differencePath, whiteClipPath, blackClipPath, shadowBoostPath, outRasterPath, options, backend):
+    grid = readGrid(inImageTile)
+    applied = kernel('applyDifference', backend)(readBand(inImageTile, bandNumber), readBandOnGrid(differencePath, grid), readBandOnGrid(whiteClipPath, grid), readBandOnGrid(blackClipPath, grid), readBandOnGrid(shadowBoostPath, grid))
+    writeBandLike(applied, inImageTile, outRasterPath, options, gdal.GDT_Int16, -1)
+
+
+"""
+##########################################################
+Checking the backends against each other: python ContrastKernels.py check [tileSize]
+"""
+
+#Made up tiles with the kinds of values each stage sees, with some nodata scattered through
+def checkInputs(tileSize, scaleCount):
+    generator = numpy.random.default_rng(1)
+    def layer(low, high):
+        values = generator.uniform(low, high, (tileSize, tileSize))
+        values[generator.random((tileSize, tileSize)) < 0.01] = numpy.nan
+        return values
+    return {'combinedBands':(layer(0, 255), layer(0, 255), layer(0, 255), layer(0, 255)),
+        'rangeMidrange':(layer(0, 255), layer(0, 255), 0.9),
+        'clipAmount':(layer(0, 255), layer(20, 230), layer(0, 255), -1),
+        'differenceToApply':(layer(-1, 255), layer(20, 230), layer(0, 255), 1 / 0.80),
+        'combineAndCap':(numpy.stack([layer(-300, 300) for scaleNumber in range(scaleCount)]), 40.0, 0.1, 20.0),
+        'clipFactor':(numpy.stack([layer(0, 255) for scaleNumber in range(scaleCount)]), 2 / scaleCount),
+        'applyDifference':(layer(0, 255), layer(-20, 20), layer(0, 0.3), layer(0, 0.3), layer(0, 8))}
+
+def timeKernel(kernelFunction, arguments, repeats):
+    startTime = time.time()
+    for repeat in range(repeats):
+        result = kernelFunction(*arguments)
+    return result, (time.time() - startTime) / repeats
+
+#Call every jit kernel from several threads at once, the same as the tile tasks do, and check each thread still gets the right answer
+def checkConcurrentCalls(jitFunctions, inputs, expectedResults, threadCount = 4):
+    results = {}
+    errors = []
+    def callEveryKernel(threadNumber):
+        try:
+            for stageName in inputs:
+                results[(threadNumber, stageName)] = jitFunctions[stageName](*inputs[stageName])
+        except BaseException as e:
+            errors.append(e)
+    threads = [threading.Thread(target = callEveryKernel, args = (threadNumber,)) for threadNumber in range(threadCount)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for error in errors:
+        print(error)
+    matches = len(errors) == 0 and all(numpy.allclose(expectedResults[stageName], results[(threadNumber, stageName)], rtol = 0.000001, atol = 0.000001, equal_nan = True) for threadNumber in range(threadCount) for stageName in inputs)
+    print(str(threadCount) + ' threads calling the jit kernels at once through the ' + numba.threading_layer() + ' threading layer' + (' (taking turns)' if not jitThreadSafe else '') + ': ' + ('matches' if matches else 'DOES NOT MATCH'))
+    return matches
+
+#Compare every kernel between numpy and jit and report the speed up of each, returns False if any of them disagree
+def checkBackends(tileSize = 2000, scaleCount = 3, repeats = 3):
+    inputs = checkInputs(tileSize, scaleCount)
+    index = buildMinMaxIndex(inputs['combinedBands'][0], 41)
+    inputs['circularMaximum'] = (index, 41)
+    inputs['circularMinimum'] = (index, 41)
+    numpyFunctions = dict(numpyKernels, circularMaximum = circularMaximum, circularMinimum = circularMinimum)
+    if numba is None:
+        print("Numba isn't installed, so only the numpy backend can be timed")
+    else:
+        resolveBackend('jit')
+        jitFunctions = dict({kernelName:kernel(kernelName, 'jit') for kernelName in jitKernels}, circularMaximum = lambda index, diameter: circularMaximum(index, diameter, 'jit'), circularMinimum = lambda index, diameter: circularMinimum(index, diameter, 'jit'))
+    allMatch = True
+    numpyResults = {}
+    for stageName in inputs:
+        numpyResult, numpySeconds = timeKernel(numpyFunctions[stageName], inputs[stageName], repeats)
+        numpyResults[stageName] = numpyResult
+        if numba is None:
+            print(stageName + ': numpy ' + str(round(numpySeconds, 3)) + 's')
+            continue
+        #The first call compiles it, so that is left out of the timing
+        jitFunctions[stageName](*inputs[stageName])
+        jitResult, jitSeconds = timeKernel(jitFunctions[stageName], inputs[stageName], repeats)
+        matches = numpy.allclose(numpyResult, jitResult, rtol = 0.000001, atol = 0.000001, equal_nan = True)
+        allMatch = allMatch and matches
+        print(stageName + ': numpy ' + str(round(numpySeconds, 3)) + 's, jit ' + str(round(jitSeconds, 3)) + 's, speed up ' + str(round(numpySeconds / max(jitSeconds, 0.000001), 1)) + 'x, ' + ('matches' if matches else 'DOES NOT MATCH'))
+    if numba is not None:
+        allMatch = checkConcurrentCalls(jitFunctions, inputs, numpyResults) and allMatch
+    return allMatch
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        passed = checkBackends(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
+        print('Backend check ' + ('passed' if passed else 'failed'))
+        sys.exit(0 if passed else 1)
+    else:
+        print('Usage: python ContrastKernels.py check [tileSize]')
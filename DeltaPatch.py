@@ -0,0 +1,159 @@
+import numpy, json, os, glob
+from osgeo import gdal, ogr
+
+
+"""
+##########################################################
+Working out what a change to the original image affects
+"""
+
+#Extents are (minX, minY, maxX, maxY) in the units of the image's coordinate system
+
+def expandExtent(extent, distance):
+    return (extent[0] - distance, extent[1] - distance, extent[2] + distance, extent[3] + distance)
+
+def extentsOverlap(extentA, extentB):
+    return extentA[0] < extentB[2] and extentB[0] < extentA[2] and extentA[1] < extentB[3] and extentB[1] < extentA[3]
+
+def boundExtent(boundPath):
+    boundDataset = ogr.Open(boundPath)
+    minX, maxX, minY, maxY = boundDataset.GetLayer().GetExtent()
+    boundDataset = None
+    return (minX, minY, maxX, maxY)
+
+#Join any extents that overlap, so the same area isn't patched more than once
+def mergeExtents(extents):
+    mergedExtents = []
+    for extent in extents:
+        while True:
+            overlapping = [mergedExtent for mergedExtent in mergedExtents if extentsOverlap(mergedExtent, extent)]
+            if len(overlapping) == 0:
+                break
+            for mergedExtent in overlapping:
+                mergedExtents.remove(mergedExtent)
+                extent = (min(extent[0], mergedExtent[0]), min(extent[1], mergedExtent[1]), max(extent[2], mergedExtent[2]), max(extent[3], mergedExtent[3]))
+        mergedExtents.append(extent)
+    return mergedExtents
+
+#A tile has to be redone if a change, pushed out by how far a change can reach, lands anywhere on it
+def affectedBounds(boundPaths, changedExtents, influenceDistance):
+    influenceExtents = [expandExtent(changedExtent, influenceDistance) for changedExtent in changedExtents]
+    return [boundPath for boundPath in boundPaths if any(extentsOverlap(boundExtent(boundPath), influenceExtent) for influenceExtent in influenceExtents)]
+
+
+"""
+##########################################################
+The block checksums from the last run
+"""
+
+#Only the blocks that went into a tile get noted down, so those are the only ones compared next time
+#The layout of the blocks in the file goes with them (if there is one), so next time only the blocks that have moved need decoding
+def writeManifest(manifestPath, grid, checksums, layout = None):
+    with open(manifestPath, 'w') as manifestFile:
+        json.dump({'width':grid['width'], 'height':grid['height'], 'blockWidth':grid['blockWidth'], 'blockHeight':grid['blockHeight'], 'checksums':checksums, 'layout':layout}, manifestFile)
+
+def readManifest(manifestPath):
+    if not os.path.exists(manifestPath):
+        return None
+    with open(manifestPath, 'r') as manifestFile:
+        return json.load(manifestFile)
+
+#The checksums only line up if the image is laid out the same as last time
+def manifestMatches(manifest, grid):
+    return all(manifest[gridName] == grid[gridName] for gridName in ['width', 'height', 'blockWidth', 'blockHeight'])
+
+#The noted down blocks that need decoding to check them, either the ones that have moved in the file, or all of them if that can't be told
+def blocksToScan(manifest, layout):
+    if layout is None or manifest.get('layout') is None:
+        return list(manifest['checksums'])
+    return [key for key in manifest['checksums'] if layout.get(key) != manifest['layout'].get(key)]
+
+
+"""
+##########################################################
+Patching the final image and its overviews in place
+"""
+
+#The most recent merge of the scene, ignoring the thumbnail that sits next to it
+def latestFinalImage(finalImageDir, outImageName):
+    finalImages = [f for f in glob.glob(finalImageDir + outImageName + '*.tif') if not f.endswith('Thumbnail.tif')]
+    if len(finalImages) == 0:
+        return None
+    return max(finalImages, key = os.path.getmtime).replace('\\', '/')
+
+#The pixel window (column, row, width, height) of the final image covering an extent
+def extentWindow(dataset, extent):
+    originX, pixelWidth, _, originY, _, pixelHeight = dataset.GetGeoTransform()
+    columnStart = max(int(numpy.floor((extent[0] - originX) / pixelWidth)), 0)
+    columnEnd = min(int(numpy.ceil((extent[2] - originX) / pixelWidth)), dataset.RasterXSize)
+    rowStart = max(int(numpy.floor((extent[3] - originY) / pixelHeight)), 0)
+    rowEnd = min(int(numpy.ceil((extent[1] - originY) / pixelHeight)), dataset.RasterYSize)
+    if columnStart >= columnEnd or rowStart >= rowEnd:
+        return None
+    return (columnStart, rowStart, columnEnd - columnStart, rowEnd - rowStart)
+
+#Redo the merge for just one window, from every tile that overlaps it, then write it over the same pixels of the final image
+def patchWindow(finalDataset, window, outTilePaths, cutlinePath):
+    originX, pixelWidth, _, originY, _, pixelHeight = finalDataset.GetGeoTransform()
+    columnStart, rowStart, columnCount, rowCount = window
+    windowExtent = (originX + columnStart * pixelWidth, originY + (rowStart + rowCount) * pixelHeight, originX + (columnStart + columnCount) * pixelWidth, originY + rowStart * pixelHeight)
+    overlappingTiles = []
+    for outTilePath in outTilePaths:
+        tileDataset = gdal.Open(outTilePath)
+        tileOriginX, tilePixelWidth, _, tileOriginY, _, tilePixelHeight = tileDataset.GetGeoTransform()
+        tileExtent = (tileOriginX, tileOriginY + tileDataset.RasterYSize * tilePixelHeight, tileOriginX + tileDataset.RasterXSize * tilePixelWidth, tileOriginY)
+        tileDataset = None
+        if extentsOverlap(tileExtent, windowExtent):
+            overlappingTiles.append(outTilePath)
+
+    #The window starts out empty like a new merge would, then the tiles are warped on in the same order as the full merge
+    patchDataset = gdal.GetDriverByName('MEM').Create('', columnCount, rowCount, finalDataset.RasterCount, finalDataset.GetRasterBand(1).DataType)
+    patchDataset.SetGeoTransform((windowExtent[0], pixelWidth, 0, windowExtent[3], 0, pixelHeight))
+    patchDataset.SetProjection(finalDataset.GetProjection())
+    for bandNumber in range(finalDataset.RasterCount):
+        patchDataset.GetRasterBand(bandNumber + 1).SetColorInterpretation(finalDataset.GetRasterBand(bandNumber + 1).GetColorInterpretation())
+    if len(overlappingTiles) > 0:
+        hasAlpha = finalDataset.GetRasterBand(finalDataset.RasterCount).GetColorInterpretation() == gdal.GCI_AlphaBand
+        gdal.Warp(patchDataset, sorted(overlappingTiles), cutlineDSName = cutlinePath, dstAlpha = hasAlpha, multithread = True, warpOptions = ['NUM_THREADS=ALL_CPUS'])
+    for bandNumber in range(finalDataset.RasterCount):
+        finalDataset.GetRasterBand(bandNumber + 1).WriteArray(patchDataset.GetRasterBand(bandNumber + 1).ReadAsArray(), columnStart, rowStart)
+    patchDataset = None
+
+#Bring the overviews over the window back in line, by nearest neighbour the same as they were built
+#The overviews are JPEG, so the window is widened out to whole overview blocks and every band of them is rebuilt from the full resolution image
+#That way each block that's rewritten is one fresh JPEG encode, rather than the old lossy block being decoded and encoded again on every patch
+def patchOverviews(finalDataset, window):
+    columnStart, rowStart, columnCount, rowCount = window
+    for overviewNumber in range(finalDataset.GetRasterBand(1).GetOverviewCount()):
+        for bandNumber in range(finalDataset.RasterCount):
+            band = finalDataset.GetRasterBand(bandNumber + 1)
+            overview = band.GetOverview(overviewNumber)
+            blockWidth, blockHeight = overview.GetBlockSize()
+            xFactor = finalDataset.RasterXSize / overview.XSize
+            yFactor = finalDataset.RasterYSize / overview.YSize
+            overviewColumnStart = int(numpy.floor(columnStart / xFactor / blockWidth)) * blockWidth
+            overviewColumnEnd = min(int(numpy.ceil((columnStart + columnCount) / xFactor / blockWidth)) * blockWidth, overview.XSize)
+            overviewRowStart = int(numpy.floor(rowStart / yFactor / blockHeight)) * blockHeight
+            overviewRowEnd = min(int(numpy.ceil((rowStart + rowCount) / yFactor / blockHeight)) * blockHeight, overview.YSize)
+
+            #Each overview pixel takes the full resolution pixel under its centre
+            sourceColumns = numpy.minimum(((numpy.arange(overviewColumnStart, overviewColumnEnd) + 0.5) * xFactor).astype(numpy.int64), finalDataset.RasterXSize - 1)
+            sourceRows = numpy.minimum(((numpy.arange(overviewRowStart, overviewRowEnd) + 0.5) * yFactor).astype(numpy.int64), finalDataset.RasterYSize - 1)
+            sourceValues = band.ReadAsArray(int(sourceColumns[0]), int(sourceRows[0]), int(sourceColumns[-1] - sourceColumns[0] + 1), int(sourceRows[-1] - sourceRows[0] + 1))
+            overview.WriteArray(sourceValues[sourceRows - sourceRows[0]][:, sourceColumns - sourceColumns[0]], overviewColumnStart, overviewRowStart)
+    finalDataset.FlushCache()
+
+#Patch every changed area into the final image, returns the number of pixels rewritten
+def patchFinalImage(finalImagePath, outTilePaths, cutlinePath, changedExtents, influenceDistance):
+    finalDataset = gdal.Open(finalImagePath, gdal.GA_Update)
+    pixelsPatched = 0
+    for patchExtent in mergeExtents([expandExtent(changedExtent, influenceDistance) for changedExtent in changedExtents]):
+        window = extentWindow(finalDataset, patchExtent)
+        if window is None:
+            continue
+        patchWindow(finalDataset, window, outTilePaths, cutlinePath)
+        patchOverviews(finalDataset, window)
+        pixelsPatched = pixelsPatched + window[2] * window[3]
+    finalDataset.FlushCache()
+    finalDataset = None
+    return pixelsPatched
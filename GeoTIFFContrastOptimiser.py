@@ -1,4 +1,4 @@
-import numpy, psutil, os, glob, time, signal
+import numpy, psutil, os, glob, time, signal, sys, queue
 from qgis.PyQt.QtWidgets import QMessageBox
 from qgis.core import QgsRasterLayer
 from datetime import datetime
@@ -15,10 +15,45 @@ User options for the tiling section
 inImage                 = 'C:/Temp/YourImage.tif' #E.g 'C:/Temp/BigImage.tif'
 approxPixelsPerTile     = 8000 #E.g 12000, this should be adjusted based on your ram
 
+#To process several scenes in one go, list them here (a path or a glob), each optionally with its own parameter overrides
+#E.g ['C:/Temp/Scenes/*.tif', ('C:/Temp/Hilly.tif', {'radiusMetres':50, 'toneShiftFactor':0.9})]
+#All the tiles of all the scenes go through one queue, and each scene is merged as soon as its own tiles are done
+#Leave this empty to just process inImage
+batchInImages           = []
+
 #Options for compressing the images, ZSTD gives the best speed but LZW allows you to view the thumbnail in windows explorer
 compressOptions =       'COMPRESS=ZSTD|NUM_THREADS=ALL_CPUS|PREDICTOR=1|ZSTD_LEVEL=1|BIGTIFF=IF_SAFER|TILED=YES'
 finalCompressOptions =  'COMPRESS=LZW|PREDICTOR=2|NUM_THREADS=ALL_CPUS|BIGTIFF=IF_SAFER|TILED=YES'
 gdalOptions =           ''
+blockCacheMegabytes =   1024 #Memory for the decoded blocks of the original image while tiling, enough to hold the edges of a row of tiles avoids decoding them twice
+kernelBackend =         'auto' #'auto' uses numba for the per pixel formulas when it's installed (except the ones numpy does faster) and numpy otherwise, or 'jit', 'numpy', or 'calculator' for the raster calculator
+
+#The folder holding the helper modules (e.g TileQueue.py and TilePipeline.py), leave blank if this script is being run from that folder
+helperDirectory =       ''
+
+#To share the tiles out across several computers, run this script on each of them with the same sharedQueueDirectory
+#One computer runs as the 'coordinator', which does the tiling, hands out the tiles and does the merging
+#The others run as a 'worker' (start them once the coordinator is running), and they stop once every tile is done
+#The images and process folders need to be at the same path on every computer, e.g '//Server/Share/Images/'
+nodeRole =              'single' #'single', 'coordinator' or 'worker'
+sharedQueueDirectory =  '' #E.g '//Server/Share/ContrastQueue/', a folder every computer can write to
+leaseSeconds =          900 #If a computer stops checking in on its tile for this long, the tile is handed to another computer
+maxTileAttempts =       3 #How many times a tile is handed out before it's given up on
+
+#To skip the startup cost of every processing call, tiles can be handed to warm workers started with WarmWorker.py (see the top of that file)
+#Each worker keeps QGIS, processing and its algorithms loaded, and the dispatch overhead of each tile is written to the debug file
+warmWorkerPorts =       [] #E.g [6001, 6002, 6003], leave empty to process the tiles within QGIS
+warmWorkerAuthKey =     '' #Leave empty to use the random key the workers keep in your home folder, otherwise it must match the key the workers were started with
+warmWorkerTimeoutSeconds = 3600 #A worker that takes longer than this over a tile is dropped and the tile is done within QGIS, so set it well above your slowest tile
+
+#To redo just part of a scene after its original image has been edited (e.g a new flight strip), rerun it with the same settings and deltaMode on
+#Only the tiles that the change can reach are redone, then they are patched into the scene's last final image along with its overviews
+#The changes are either the extents listed below, or if that's empty, the blocks that have changed since the checksums noted down during the last tiling
+deltaMode =             False
+deltaChangedExtents =   [] #E.g [(500100, 7000200, 500900, 7001500)] as minX, minY, maxX, maxY in the image's coordinate system
+#For a compressed GeoTIFF only the blocks that have moved or changed size in the file get decoded to check them, anything else means decoding the whole image
+#An edit that rewrites a compressed block at exactly the same size in the same place would be missed that way, this decodes every block to be sure
+deltaFullChecksumScan = False
 
 
 """
@@ -58,6 +93,11 @@ shadowBoostWidthMetres      = 30.0 #Must be larger than approximately 3 times th
 
 shadowBoostFactor           = 0.3 #Between 0 and 1, recommended is 0.3
 
+contrastScaleDivisors       = [1, 3] #E.g [1, 3] or [1, 3, 9], between 2 and 6 scales and the first must be 1
+#Each scale stretches contrast based on the minimum and maximum within radiusMetres divided by its divisor
+#[1, 3] is the original blend of the full radius and a third of the radius
+#Adding a finer scale like 9 gives better local contrast on mixed-resolution mosaics, without costing a full extra pass
+
 
 #Keep in mind this script only adjusts brightnesses. A tinted image will affect results.
 #If you have an image with a significant coloured tint then it is best to first render out a new version
@@ -69,90 +109,206 @@ shadowBoostFactor           = 0.3 #Between 0 and 1, recommended is 0.3
 #######################################################################
 """
 
-#Set up the layer name for the raster calculations
-inImageName = inImage.split("/")
-inImageName = inImageName[-1]
-inImageName = inImageName[:len(inImageName)-4]
-outImageName = inImageName
-
-#Making a folder for processing
-rootProcessDirectory = str(Path(inImage).parent.absolute()).replace('\\','/') + '/'
-processDirectoryInstance = rootProcessDirectory + inImageName + 'Process' + '/'
-
-#Creating all the subfolder variables
-processDirectory                = processDirectoryInstance + '1Main/'
-otherDirectory                  = processDirectoryInstance + '2Other/'
-processBoundsDirectory          = processDirectoryInstance + '3TileBounds/'
-processTileDirectory            = processDirectoryInstance + '4Tiles/'
-outImageDir                     = processDirectoryInstance + '5OutTiles/'
-finalImageDir                   = processDirectoryInstance + '6Final/'
-inImageTileDir = processTileDirectory
-
-#Creating all the subfolders
-if not os.path.exists(processDirectoryInstance):                os.mkdir(processDirectoryInstance) 
-if not os.path.exists(processDirectory):                        os.mkdir(processDirectory)
-if not os.path.exists(otherDirectory):                          os.mkdir(otherDirectory)
-if not os.path.exists(otherDirectory + 'ConfirmationFiles/'):   os.mkdir(otherDirectory + 'ConfirmationFiles/')
-if not os.path.exists(processBoundsDirectory):                  os.mkdir(processBoundsDirectory)
-if not os.path.exists(processTileDirectory):                    os.mkdir(processTileDirectory)
-if not os.path.exists(outImageDir):                             os.mkdir(outImageDir)
-if not os.path.exists(finalImageDir):                           os.mkdir(finalImageDir)
-
-
-#Make a debug text file
-debugText = open(otherDirectory + inImageName + "Debug.txt","w+")
-debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": Ok let's go\n")
-debugText.close()
-
-#Clear out the confirmation files if the process has been run before
-confirmationFiles = glob.glob((otherDirectory + 'ConfirmationFiles/') + '*')
-for f in confirmationFiles:
-        os.remove(f)
+#Make the helper modules importable
+if helperDirectory == '':
+    try:
+        helperDirectory = str(Path(__file__).parent.absolute())
+    except NameError:
+        helperDirectory = os.getcwd()
+if helperDirectory not in sys.path: sys.path.append(helperDirectory)
+import ContrastKernels, TileQueue, TilePipeline, WarmWorker, BlockReader, DeltaPatch
+
+#Check the sharing setup
+if (nodeRole not in ['single', 'coordinator', 'worker'] or (nodeRole != 'single' and sharedQueueDirectory == '')):
+    print("The node role must be single, coordinator or worker, and the others need a shared queue directory")
+    getToItOldBoy
+nodeName = TileQueue.defaultWorkerName()
+
+#The coordinator starts its run straight away, so that workers don't pick up anything left over from an earlier run while this one is tiled
+if nodeRole == 'coordinator':
+    queueRunId, stopQueueRun = TileQueue.startRun(sharedQueueDirectory, leaseSeconds)
+
+#The warm workers run whatever they're sent, so they need a key that isn't public
+if len(warmWorkerPorts) > 0:
+    try:
+        warmWorkerAuthKey = WarmWorker.resolveAuthKey(warmWorkerAuthKey)
+    except (ValueError, PermissionError) as e:
+        print(e)
+        getToItOldBoy
+
+#Let the user know which kernels the per pixel formulas are going through
+if kernelBackend not in ['auto', 'jit', 'numpy', 'calculator']:
+    print("The kernel backend must be auto, jit, numpy or calculator")
+    getToItOldBoy
+if kernelBackend != 'calculator':
+    print("The per pixel formulas are running through " + ContrastKernels.resolveBackend(kernelBackend))
+
 
 """
 ####################################################################################
-Gather information about the initial image
+Set up each scene, starting from the user options and applying any per-scene overrides
 """
 
-#Get the pixel size and coordinate system of the raster
-ras = QgsRasterLayer(inImage)
-pixelSizeX = ras.rasterUnitsPerPixelX()
-pixelSizeY = ras.rasterUnitsPerPixelY()
-pixelSizeAve = (pixelSizeX + pixelSizeY) / 2
-coordinateSystem = ras.crs().authid()
-
-#Now set up some internal variables
-pixelSizeBig = pixelSizeAve * speedUpFactor
-radiusSize = radiusMetres/pixelSizeBig
-
-#Make sure the radius numbers slide nicely into the grass tools
-if ras.crs().toProj4()[6:13] == 'longlat':
-    shadowDiameter = int(numpy.ceil((shadowBoostWidthMetres*1.4/(pixelSizeBig*111139))) // 2 * 2 + 1)
-    diameterSize = int(numpy.ceil((radiusSize*2)/111139) // 2 * 2 + 1)
-else:
-    shadowDiameter = int(numpy.ceil((shadowBoostWidthMetres*1.4/pixelSizeBig)) // 2 * 2 + 1)
-    diameterSize = int(numpy.ceil((radiusSize*2)) // 2 * 2 + 1)
-diameterSizeThird = int(numpy.ceil(diameterSize/3) // 2 * 2 + 1)
+defaultSceneOptions = {'approxPixelsPerTile':approxPixelsPerTile,'speedUpFactor':speedUpFactor,'radiusMetres':radiusMetres,'toneShiftFactor':toneShiftFactor,'maxPixelChangeFactor':maxPixelChangeFactor,
+    'clippingPreventionFactor':clippingPreventionFactor,'shadowBoostWidthMetres':shadowBoostWidthMetres,'shadowBoostFactor':shadowBoostFactor,'contrastScaleDivisors':contrastScaleDivisors}
 
-#If the radius size is less than a pixel then there's a problem
-if ((radiusMetres/3) <= pixelSizeAve):
-    print("You must increase your radius size")
-    getToItOldBoy
+def prepareScene(sceneInImage, sceneOverrides):
+    
+    sceneOptions = dict(defaultSceneOptions)
+    for optionName in sceneOverrides:
+        if optionName not in sceneOptions:
+            print("The override " + optionName + " for " + sceneInImage + " isn't one of the sharpening options")
+            getToItOldBoy
+    sceneOptions.update(sceneOverrides)
+    
+    inImage = sceneInImage
+    approxPixelsPerTile = sceneOptions['approxPixelsPerTile']
+    speedUpFactor = sceneOptions['speedUpFactor']
+    radiusMetres = sceneOptions['radiusMetres']
+    toneShiftFactor = sceneOptions['toneShiftFactor']
+    maxPixelChangeFactor = sceneOptions['maxPixelChangeFactor']
+    clippingPreventionFactor = sceneOptions['clippingPreventionFactor']
+    shadowBoostWidthMetres = sceneOptions['shadowBoostWidthMetres']
+    shadowBoostFactor = sceneOptions['shadowBoostFactor']
+    contrastScaleDivisors = sceneOptions['contrastScaleDivisors']
+
+    #Set up the layer name for the raster calculations
+    inImageName = inImage.split("/")
+    inImageName = inImageName[-1]
+    inImageName = inImageName[:len(inImageName)-4]
+    outImageName = inImageName
+
+    #Making a folder for processing
+    rootProcessDirectory = str(Path(inImage).parent.absolute()).replace('\\','/') + '/'
+    processDirectoryInstance = rootProcessDirectory + inImageName + 'Process' + '/'
+
+    #Creating all the subfolder variables
+    processDirectory                = processDirectoryInstance + '1Main/'
+    otherDirectory                  = processDirectoryInstance + '2Other/'
+    processBoundsDirectory          = processDirectoryInstance + '3TileBounds/'
+    processTileDirectory            = processDirectoryInstance + '4Tiles/'
+    outImageDir                     = processDirectoryInstance + '5OutTiles/'
+    finalImageDir                   = processDirectoryInstance + '6Final/'
+    inImageTileDir = processTileDirectory
+
+    #Creating all the subfolders
+    if not os.path.exists(processDirectoryInstance):                os.mkdir(processDirectoryInstance) 
+    if not os.path.exists(processDirectory):                        os.mkdir(processDirectory)
+    if not os.path.exists(otherDirectory):                          os.mkdir(otherDirectory)
+    if not os.path.exists(otherDirectory + 'ConfirmationFiles/'):   os.mkdir(otherDirectory + 'ConfirmationFiles/')
+    if not os.path.exists(processBoundsDirectory):                  os.mkdir(processBoundsDirectory)
+    if not os.path.exists(processTileDirectory):                    os.mkdir(processTileDirectory)
+    if not os.path.exists(outImageDir):                             os.mkdir(outImageDir)
+    if not os.path.exists(finalImageDir):                           os.mkdir(finalImageDir)
+
+
+    #Make a debug text file
+    debugText = open(otherDirectory + inImageName + "Debug.txt","w+")
+    debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": Ok let's go\n")
+    debugText.close()
 
-if ((radiusMetres/3) <= pixelSizeBig):
-    print("You must decrease your speed up factor or increase your radius")
-    getToItOldBoy
+    #Clear out the confirmation files if the process has been run before
+    confirmationFiles = glob.glob((otherDirectory + 'ConfirmationFiles/') + '*')
+    for f in confirmationFiles:
+            os.remove(f)
 
-if (shadowDiameter < 5):
-    print("You must increase your shadow boost width or decrease your speed up factor")
-    getToItOldBoy
+    """
+    ####################################################################################
+    Gather information about the initial image
+    """
 
-if (speedUpFactor < 1 or toneShiftFactor <= 0 or maxPixelChangeFactor <= 0 or clippingPreventionFactor < 0 or clippingPreventionFactor >= 1):
-    print("The parameters are invalid, please review")
-    getToItOldBoy
+    #Get the pixel size of the raster
+    ras = QgsRasterLayer(inImage)
+    pixelSizeX = ras.rasterUnitsPerPixelX()
+    pixelSizeY = ras.rasterUnitsPerPixelY()
+    pixelSizeAve = (pixelSizeX + pixelSizeY) / 2
+
+    #Now set up some internal variables
+    pixelSizeBig = pixelSizeAve * speedUpFactor
+    radiusSize = radiusMetres/pixelSizeBig
+
+    #Make sure the radius numbers slide nicely into the grass tools
+    if ras.crs().toProj4()[6:13] == 'longlat':
+        shadowDiameter = int(numpy.ceil((shadowBoostWidthMetres*1.4/(pixelSizeBig*111139))) // 2 * 2 + 1)
+        diameterSize = int(numpy.ceil((radiusSize*2)/111139) // 2 * 2 + 1)
+    else:
+        shadowDiameter = int(numpy.ceil((shadowBoostWidthMetres*1.4/pixelSizeBig)) // 2 * 2 + 1)
+        diameterSize = int(numpy.ceil((radiusSize*2)) // 2 * 2 + 1)
+
+    #Each contrast scale gets its own diameter, plus a suffix for the files it produces
+    scaleDiameters = [int(numpy.ceil(diameterSize/divisor) // 2 * 2 + 1) for divisor in contrastScaleDivisors]
+    scaleSuffixes = ['' if divisor == 1 else 'Div' + str(divisor) for divisor in contrastScaleDivisors]
+
+    #How far a changed pixel can reach into the output, the min/max and its smoothing each reach a radius
+    #The shadows go through three neighbourhoods one after another, plus a few big pixels are added for the resampling
+    contrastReach = (max(scaleDiameters) // 2) * 2
+    shadowReach = (shadowDiameter - 2) // 2 + shadowDiameter // 2 + (shadowDiameter + 2) // 2
+    influenceDistance = (max(contrastReach, shadowReach) + 8) * pixelSizeBig
+
+    #If the radius size is less than a pixel then there's a problem
+    if ((radiusMetres/3) <= pixelSizeAve):
+        print("You must increase your radius size")
+        getToItOldBoy
+
+    if ((radiusMetres/max(3, max(contrastScaleDivisors))) <= pixelSizeBig):
+        print("You must decrease your speed up factor or increase your radius")
+        getToItOldBoy
+
+    if (len(contrastScaleDivisors) < 2 or len(contrastScaleDivisors) > 6 or contrastScaleDivisors[0] != 1 or sorted(set(contrastScaleDivisors)) != contrastScaleDivisors):
+        print("The contrast scale divisors must be 2 to 6 increasing numbers, starting with 1")
+        getToItOldBoy
+
+    if (shadowDiameter < 5):
+        print("You must increase your shadow boost width or decrease your speed up factor")
+        getToItOldBoy
+
+    if (speedUpFactor < 1 or toneShiftFactor <= 0 or maxPixelChangeFactor <= 0 or clippingPreventionFactor < 0 or clippingPreventionFactor >= 1):
+        print("The parameters are invalid, please review")
+        getToItOldBoy
     
-if (speedUpFactor == 1 or toneShiftFactor > 1 or maxPixelChangeFactor > 1 or clippingPreventionFactor >= 0.3 or radiusMetres < (3 * pixelSizeBig)):
-    print("The current parameters aren't recommended... but good luck")
+    if (speedUpFactor == 1 or toneShiftFactor > 1 or maxPixelChangeFactor > 1 or clippingPreventionFactor >= 0.3 or radiusMetres < (3 * pixelSizeBig)):
+        print("The current parameters aren't recommended... but good luck")
+
+    #A suffix for the file output
+    settingsSuffix = str(speedUpFactor) + '_' + str(radiusMetres) + '_' + str(toneShiftFactor) + '_' + str(maxPixelChangeFactor) + '_' + str(clippingPreventionFactor) + '_' + '-'.join([str(divisor) for divisor in contrastScaleDivisors])
+
+    #y=(640/(1+(1-0.00625)^{x}))-320
+    #Following the above formula style to cap the shifting of pixel values as the shift approaches 255
+    #A max pixel change factor of 0.25 will cap the pixel shift at about 20
+    maxPixelChangeFactor = maxPixelChangeFactor * maxPixelChangeFactor
+    capDenominator = maxPixelChangeFactor * 640
+    capMinusFactor = 0.00625 / (maxPixelChangeFactor**0.9)
+    capSubtraction = maxPixelChangeFactor * 320
+
+    return {'inImage':inImage,'inImageName':inImageName,'outImageName':outImageName,'approxPixelsPerTile':approxPixelsPerTile,
+        'processDirectory':processDirectory,'otherDirectory':otherDirectory,'processBoundsDirectory':processBoundsDirectory,'processTileDirectory':processTileDirectory,
+        'outImageDir':outImageDir,'finalImageDir':finalImageDir,'inImageTileDir':inImageTileDir,
+        'pixelSizeX':pixelSizeX,'pixelSizeY':pixelSizeY,'pixelSizeAve':pixelSizeAve,'pixelSizeBig':pixelSizeBig,
+        'shadowDiameter':shadowDiameter,'shadowBoostFactor':shadowBoostFactor,'scaleDiameters':scaleDiameters,'scaleSuffixes':scaleSuffixes,'toneShiftFactor':toneShiftFactor,
+        'settingsSuffix':settingsSuffix,'capDenominator':capDenominator,'capMinusFactor':capMinusFactor,'capSubtraction':capSubtraction,
+        'compressOptions':compressOptions,'finalCompressOptions':finalCompressOptions,'gdalOptions':gdalOptions,'kernelBackend':kernelBackend,
+        'influenceDistance':influenceDistance,'tileCount':0,'mergeStarted':False,'mergeDone':False,'mergeFailed':False}
+
+
+#Work out which scenes are being processed, workers get theirs along with each tile from the shared queue
+batchEntries = batchInImages if len(batchInImages) > 0 else [inImage]
+if nodeRole == 'worker':
+    batchEntries = []
+scenes = []
+for batchEntry in batchEntries:
+    if isinstance(batchEntry, str):
+        batchPattern, batchOverrides = batchEntry, {}
+    else:
+        batchPattern, batchOverrides = batchEntry
+    batchMatches = sorted(glob.glob(batchPattern))
+    if len(batchMatches) == 0:
+        print("Nothing was found for " + batchPattern)
+    for batchMatch in batchMatches:
+        scenes.append(prepareScene(batchMatch.replace('\\','/'), batchOverrides))
+
+if len(scenes) == 0 and nodeRole != 'worker':
+    print("There are no scenes to process")
+    getToItOldBoy
 
 
 
@@ -164,170 +320,194 @@ First check to make sure there isn't a significant tint, then prep for tiling
 
 #Let's see if tiling needs to be done 
 #You won't need to do tiling if the tif is less than about 10000x10000 or if the tiling has been done previously
-promptReply = QMessageBox.question(iface.mainWindow(), 'Does the raster need splitting up?', "If tiling has not yet been completed you will need to do tiling.\n\nDo you need to perform tiling?\n\nIf you don't, make sure that all the tifs are ready to go in " + processTileDirectory + " before you click no\n\nIf you do need to perform tiling, tiling will be performed on " + inImage + " when you click yes", QMessageBox.Yes, QMessageBox.No)
+if nodeRole == 'worker' or deltaMode:
+    promptReply = QMessageBox.No
+else:
+    sceneListText = "\n".join([scene['inImage'] for scene in scenes])
+    promptReply = QMessageBox.question(iface.mainWindow(), 'Does the raster need splitting up?', "If tiling has not yet been completed you will need to do tiling.\n\nDo you need to perform tiling?\n\nIf you don't, make sure that all the tifs are ready to go in " + "each scene's 4Tiles folder" + " before you click no\n\nIf you do need to perform tiling, tiling will be performed on " + sceneListText + " when you click yes", QMessageBox.Yes, QMessageBox.No)
 if promptReply == QMessageBox.Yes:
     
     
     
-    #Get some stats about the raster
-    processing.run("gdal:warpreproject", {'INPUT':inImage,'SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve * 250,'OPTIONS':finalCompressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':'','OUTPUT':processDirectory + 'LowResCopy.tif'})
-    processing.run("native:rasterlayerstatistics", {'INPUT':processDirectory + 'LowResCopy.tif','BAND':1,'OUTPUT_HTML_FILE':processDirectory + inImageName + 'RedStats.html'})
-    processing.run("native:rasterlayerstatistics", {'INPUT':processDirectory + 'LowResCopy.tif','BAND':2,'OUTPUT_HTML_FILE':processDirectory + inImageName + 'GreenStats.html'})
-    processing.run("native:rasterlayerstatistics", {'INPUT':processDirectory + 'LowResCopy.tif','BAND':3,'OUTPUT_HTML_FILE':processDirectory + inImageName + 'BlueStats.html'})
-
-    #Make a function for getting values from the statistics file
-    def getStats (statsFile):
-        HtmlFile = open(statsFile, 'r', encoding='utf-8')
-        fullHtml = HtmlFile.read()
-        minValList = fullHtml.split("Minimum value: ")
-        minValList = minValList[1].split("<")
-        minVal = int(minValList[0])
-        meanList = fullHtml.split("Mean value: ")
-        meanList = meanList[1].split("<")
-        mean = int(float(meanList[0]))
-        HtmlFile.close()
-        return mean, minVal
-
-    #Grab the rgb stats
-    redMean = getStats(processDirectory + inImageName + 'RedStats.html')[0]
-    redMin = getStats(processDirectory + inImageName + 'RedStats.html')[1]
-    greenMean = getStats(processDirectory + inImageName + 'GreenStats.html')[0]
-    greenMin = getStats(processDirectory + inImageName + 'GreenStats.html')[1]
-    blueMean = getStats(processDirectory + inImageName + 'BlueStats.html')[0]
-    blueMin = getStats(processDirectory + inImageName + 'BlueStats.html')[1]
-
-    #Check to see if anything is a bit sus
-    if abs(redMean - greenMean) + abs(redMean - blueMean) + abs(blueMean - greenMean) > 30 or abs(redMin - greenMin) + abs(redMin - blueMin) + abs(blueMin - greenMin) > 40:
-        promptReply = QMessageBox.question(iface.mainWindow(), 'Check the RGB values',"Your image may have a significant tint.\nRGB mean is " + str(redMean) + ', ' + str(greenMean) + ', ' + str(blueMean) + '.\nRGB min is ' + str(redMin) + ', ' + str(greenMin) + ', ' + str(blueMin) + '.\nDo you wish to continue?', QMessageBox.Yes, QMessageBox.No)
-        if promptReply == QMessageBox.No:
-            alrightLetsNotContinueThen
+    #The tiling of each scene is prepared one by one, and the clipping of every scene then goes into one set of tasks
+    def tileScene(scene):
+        
+        inImage = scene['inImage']
+        inImageName = scene['inImageName']
+        approxPixelsPerTile = scene['approxPixelsPerTile']
+        processDirectory = scene['processDirectory']
+        processBoundsDirectory = scene['processBoundsDirectory']
+        processTileDirectory = scene['processTileDirectory']
+        pixelSizeX = scene['pixelSizeX']
+        pixelSizeY = scene['pixelSizeY']
+        pixelSizeAve = scene['pixelSizeAve']
+        
+
+        #Get some stats about the raster
+        processing.run("gdal:warpreproject", {'INPUT':inImage,'SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve * 250,'OPTIONS':finalCompressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':'','OUTPUT':processDirectory + 'LowResCopy.tif'})
+        processing.run("native:rasterlayerstatistics", {'INPUT':processDirectory + 'LowResCopy.tif','BAND':1,'OUTPUT_HTML_FILE':processDirectory + inImageName + 'RedStats.html'})
+        processing.run("native:rasterlayerstatistics", {'INPUT':processDirectory + 'LowResCopy.tif','BAND':2,'OUTPUT_HTML_FILE':processDirectory + inImageName + 'GreenStats.html'})
+        processing.run("native:rasterlayerstatistics", {'INPUT':processDirectory + 'LowResCopy.tif','BAND':3,'OUTPUT_HTML_FILE':processDirectory + inImageName + 'BlueStats.html'})
+
+        #Make a function for getting values from the statistics file
+        def getStats (statsFile):
+            HtmlFile = open(statsFile, 'r', encoding='utf-8')
+            fullHtml = HtmlFile.read()
+            minValList = fullHtml.split("Minimum value: ")
+            minValList = minValList[1].split("<")
+            minVal = int(minValList[0])
+            meanList = fullHtml.split("Mean value: ")
+            meanList = meanList[1].split("<")
+            mean = int(float(meanList[0]))
+            HtmlFile.close()
+            return mean, minVal
+
+        #Grab the rgb stats
+        redMean = getStats(processDirectory + inImageName + 'RedStats.html')[0]
+        redMin = getStats(processDirectory + inImageName + 'RedStats.html')[1]
+        greenMean = getStats(processDirectory + inImageName + 'GreenStats.html')[0]
+        greenMin = getStats(processDirectory + inImageName + 'GreenStats.html')[1]
+        blueMean = getStats(processDirectory + inImageName + 'BlueStats.html')[0]
+        blueMin = getStats(processDirectory + inImageName + 'BlueStats.html')[1]
+
+        #Check to see if anything is a bit sus
+        if abs(redMean - greenMean) + abs(redMean - blueMean) + abs(blueMean - greenMean) > 30 or abs(redMin - greenMin) + abs(redMin - blueMin) + abs(blueMin - greenMin) > 40:
+            promptReply = QMessageBox.question(iface.mainWindow(), 'Check the RGB values',"Your image may have a significant tint.\nRGB mean is " + str(redMean) + ', ' + str(greenMean) + ', ' + str(blueMean) + '.\nRGB min is ' + str(redMin) + ', ' + str(greenMin) + ', ' + str(blueMin) + '.\nDo you wish to continue?', QMessageBox.Yes, QMessageBox.No)
+            if promptReply == QMessageBox.No:
+                alrightLetsNotContinueThen
     
     
-    print("Ok let's do some tiling")
+        print("Ok let's do some tiling")
 
-    #Clear out the folders
-    files = glob.glob(processDirectory + '*')
-    for f in files:
-        os.remove(f)
+        #Clear out the folders
+        files = glob.glob(processDirectory + '*')
+        for f in files:
+            os.remove(f)
         
-    boundsFiles = glob.glob(processBoundsDirectory + '*')
-    for f in boundsFiles:
-        os.remove(f)   
+        boundsFiles = glob.glob(processBoundsDirectory + '*')
+        for f in boundsFiles:
+            os.remove(f)   
         
-    tileFiles = glob.glob(processTileDirectory + '*')
-    for f in tileFiles:
-        try:
-            os.remove(f) 
-        except:
-            print("...")
+        tileFiles = glob.glob(processTileDirectory + '*')
+        for f in tileFiles:
+            try:
+                os.remove(f) 
+            except:
+                print("...")
 
-    """
-    ###############################################################################################
-    Creating a grid which can be used to slice up the original image into tiles
-    """
-
-    #Get the extent of the image where there is alpha
-    processing.run("gdal:translate", {'INPUT':inImage,'TARGET_CRS':None,'NODATA':None,'COPY_SUBDATASETS':False,'OPTIONS':compressOptions,'EXTRA':'-b 4 -scale_1 128 255 -1000 1255','DATA_TYPE':0,'OUTPUT':processDirectory + inImageName + 'AlphaClean.tif'})
-    processing.run("gdal:polygonize", {'INPUT':processDirectory + inImageName + 'AlphaClean.tif','BAND':1,'FIELD':'DN','EIGHT_CONNECTEDNESS':False,'EXTRA':'','OUTPUT':processDirectory + inImageName + 'Extent.gpkg'})
-    processing.run("native:fixgeometries", {'INPUT':processDirectory + inImageName + 'Extent.gpkg','OUTPUT':processDirectory + inImageName + 'ExtentFix.gpkg'})
-    processing.run("native:extractbyexpression", {'INPUT':processDirectory + inImageName + 'ExtentFix.gpkg','EXPRESSION':' \"DN\" > 245','OUTPUT':processDirectory + inImageName + 'ExtentFixFilt.gpkg'})
+        """
+        ###############################################################################################
+        Creating a grid which can be used to slice up the original image into tiles
+        """
 
-    #Determine the extent and coordinate system of the extent
-    fullExtentForCutline = processDirectory + inImageName + 'ExtentFixFilt.gpkg'
-    extentVector = QgsVectorLayer(processDirectory + inImageName + 'ExtentFixFilt.gpkg')
-    extentRectangle = extentVector.extent()
-    extentCrs = extentVector.sourceCrs()
-    #Then close the layer object so that QGIS doesn't unnecessarily hold on to it
-    QgsProject.instance().addMapLayer(extentVector, False)
-    QgsProject.instance().removeMapLayer(extentVector.id())
-
-    #Create a grid for dividing the image up into tiles
-    processing.run("native:creategrid", {'TYPE':2,'EXTENT':extentRectangle,'HSPACING':pixelSizeX * approxPixelsPerTile,'VSPACING':pixelSizeY * approxPixelsPerTile,'HOVERLAY':0,'VOVERLAY':0,'CRS':extentCrs,'OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGrid.gpkg'})
+        #Get the extent of the image where there is alpha
+        processing.run("gdal:translate", {'INPUT':inImage,'TARGET_CRS':None,'NODATA':None,'COPY_SUBDATASETS':False,'OPTIONS':compressOptions,'EXTRA':'-b 4 -scale_1 128 255 -1000 1255','DATA_TYPE':0,'OUTPUT':processDirectory + inImageName + 'AlphaClean.tif'})
+        processing.run("gdal:polygonize", {'INPUT':processDirectory + inImageName + 'AlphaClean.tif','BAND':1,'FIELD':'DN','EIGHT_CONNECTEDNESS':False,'EXTRA':'','OUTPUT':processDirectory + inImageName + 'Extent.gpkg'})
+        processing.run("native:fixgeometries", {'INPUT':processDirectory + inImageName + 'Extent.gpkg','OUTPUT':processDirectory + inImageName + 'ExtentFix.gpkg'})
+        processing.run("native:extractbyexpression", {'INPUT':processDirectory + inImageName + 'ExtentFix.gpkg','EXPRESSION':' \"DN\" > 245','OUTPUT':processDirectory + inImageName + 'ExtentFixFilt.gpkg'})
+
+        #Determine the extent and coordinate system of the extent
+        extentVector = QgsVectorLayer(processDirectory + inImageName + 'ExtentFixFilt.gpkg')
+        extentRectangle = extentVector.extent()
+        extentCrs = extentVector.sourceCrs()
+        #Then close the layer object so that QGIS doesn't unnecessarily hold on to it
+        QgsProject.instance().addMapLayer(extentVector, False)
+        QgsProject.instance().removeMapLayer(extentVector.id())
+
+        #Create a grid for dividing the image up into tiles
+        processing.run("native:creategrid", {'TYPE':2,'EXTENT':extentRectangle,'HSPACING':pixelSizeX * approxPixelsPerTile,'VSPACING':pixelSizeY * approxPixelsPerTile,'HOVERLAY':0,'VOVERLAY':0,'CRS':extentCrs,'OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGrid.gpkg'})
     
-    #Buffer it out so that we have space for clipping 
-    processing.run("native:buffer", {'INPUT':processDirectory + inImageName + 'ExtentFixFiltGrid.gpkg','DISTANCE':pixelSizeAve * 100,'SEGMENTS':5,'END_CAP_STYLE':0,'JOIN_STYLE':1,'MITER_LIMIT':2,'DISSOLVE':False,'OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGridBuffer.gpkg'})
-    processing.run("native:buffer", {'INPUT':processDirectory + inImageName + 'ExtentFixFilt.gpkg','DISTANCE':pixelSizeAve * 100,'SEGMENTS':5,'END_CAP_STYLE':0,'JOIN_STYLE':1,'MITER_LIMIT':2,'DISSOLVE':False,'OUTPUT':processDirectory + inImageName + 'ExtentFixFiltBuffer.gpkg'})
-
-
-    #Determine the extent and coordinate system of the buffered extent
-    bufferedExtentVector = QgsVectorLayer(processDirectory + inImageName + 'ExtentFixFiltBuffer.gpkg')
-    bufferedExtentRectangle = bufferedExtentVector.extent()
-    bufferedExtentCrs = bufferedExtentVector.sourceCrs()
-    #Then close the layer object so that QGIS doesn't unnecessarily hold on to it
-    QgsProject.instance().addMapLayer(bufferedExtentVector, False)
-    QgsProject.instance().removeMapLayer(bufferedExtentVector.id())
+        #Buffer it out so that we have space for clipping 
+        processing.run("native:buffer", {'INPUT':processDirectory + inImageName + 'ExtentFixFiltGrid.gpkg','DISTANCE':pixelSizeAve * 100,'SEGMENTS':5,'END_CAP_STYLE':0,'JOIN_STYLE':1,'MITER_LIMIT':2,'DISSOLVE':False,'OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGridBuffer.gpkg'})
+        processing.run("native:buffer", {'INPUT':processDirectory + inImageName + 'ExtentFixFilt.gpkg','DISTANCE':pixelSizeAve * 100,'SEGMENTS':5,'END_CAP_STYLE':0,'JOIN_STYLE':1,'MITER_LIMIT':2,'DISSOLVE':False,'OUTPUT':processDirectory + inImageName + 'ExtentFixFiltBuffer.gpkg'})
+
+
+        #Determine the extent and coordinate system of the buffered extent
+        bufferedExtentVector = QgsVectorLayer(processDirectory + inImageName + 'ExtentFixFiltBuffer.gpkg')
+        bufferedExtentRectangle = bufferedExtentVector.extent()
+        bufferedExtentCrs = bufferedExtentVector.sourceCrs()
+        #Then close the layer object so that QGIS doesn't unnecessarily hold on to it
+        QgsProject.instance().addMapLayer(bufferedExtentVector, False)
+        QgsProject.instance().removeMapLayer(bufferedExtentVector.id())
     
     
-    #Use minis in a grid so that excess areas aren't rendered
-    processing.run("native:creategrid", {'TYPE':2,'EXTENT':bufferedExtentRectangle,'HSPACING':pixelSizeX * 100,'VSPACING':pixelSizeY * 100,'HOVERLAY':0,'VOVERLAY':0,'CRS':bufferedExtentCrs,'OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinis.gpkg'})
+        #Use minis in a grid so that excess areas aren't rendered
+        processing.run("native:creategrid", {'TYPE':2,'EXTENT':bufferedExtentRectangle,'HSPACING':pixelSizeX * 100,'VSPACING':pixelSizeY * 100,'HOVERLAY':0,'VOVERLAY':0,'CRS':bufferedExtentCrs,'OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinis.gpkg'})
 
-    processing.run("native:joinattributesbylocation", {'INPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinis.gpkg','JOIN':processDirectory + inImageName + 'ExtentFixFiltGridBuffer.gpkg',
-    'PREDICATE':[0],'JOIN_FIELDS':[],'METHOD':0,'DISCARD_NONMATCHING':False,'PREFIX':'tile','OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelected.gpkg'})
+        processing.run("native:joinattributesbylocation", {'INPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinis.gpkg','JOIN':processDirectory + inImageName + 'ExtentFixFiltGridBuffer.gpkg',
+        'PREDICATE':[0],'JOIN_FIELDS':[],'METHOD':0,'DISCARD_NONMATCHING':False,'PREFIX':'tile','OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelected.gpkg'})
     
-    processing.run("native:dissolve", {'INPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelected.gpkg','FIELD':['tileid'],'OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelectedDissolve.gpkg'})
+        processing.run("native:dissolve", {'INPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelected.gpkg','FIELD':['tileid'],'OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelectedDissolve.gpkg'})
 
 
-    processing.run("native:extractbylocation", {'INPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelectedDissolve.gpkg','PREDICATE':[0,4,5],'INTERSECT':processDirectory + inImageName + 'ExtentFixFilt.gpkg','OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelectedDissolveGrabbed.gpkg'})
+        processing.run("native:extractbylocation", {'INPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelectedDissolve.gpkg','PREDICATE':[0,4,5],'INTERSECT':processDirectory + inImageName + 'ExtentFixFilt.gpkg','OUTPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelectedDissolveGrabbed.gpkg'})
 
-    #Split it out so there is a different extent to work from for each instance of the raster clipping
-    processing.run("native:splitvectorlayer", {'INPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelectedDissolveGrabbed.gpkg','FIELD':'tileid','FILE_TYPE':0,'OUTPUT':processBoundsDirectory})
+        #Split it out so there is a different extent to work from for each instance of the raster clipping
+        processing.run("native:splitvectorlayer", {'INPUT':processDirectory + inImageName + 'ExtentFixFiltGridMinisSelectedDissolveGrabbed.gpkg','FIELD':'tileid','FILE_TYPE':0,'OUTPUT':processBoundsDirectory})
+        
+        #Get all of the sections of the grid
+        boundsFiles = glob.glob(processBoundsDirectory + '/*.gpkg')
+        return [i.replace("\\", "/") for i in boundsFiles]
     
+    clipJobs = []
+    for scene in scenes:
+        clipJobs = clipJobs + [(scene, indivBound) for indivBound in tileScene(scene)]
     
 
-    
     """
     #################################################################################################
     Running the tile clipping as separate tasks so that you can get more done at once
     """
 
-    #Get all of the sections of the grid
-    boundsFiles = glob.glob(processBoundsDirectory + '/*.gpkg')
-    boundsFiles = [i.replace("\\", "/") for i in boundsFiles]
     countOfTiles1 = 0
     countOfTiles2 = 0
     countOfTiles3 = 0
     countOfTiles4 = 0
 
+    #The four tasks read each scene through one shared cache of decoded blocks, so the overlapping tile buffers are only decoded once
+    blockCache = BlockReader.makeBlockCache(blockCacheMegabytes * 1000000)
+    blockSources = {scene['inImage']:BlockReader.openSource(scene['inImage'], True) for scene in scenes}
+
     #Split the list of grid sections into quarters, ready for multiprocessing
-    boundsNo1 = boundsFiles[0::4]
-    boundsNo2 = boundsFiles[1::4]
-    boundsNo3 = boundsFiles[2::4]
-    boundsNo4 = boundsFiles[3::4]
+    boundsNo1 = clipJobs[0::4]
+    boundsNo2 = clipJobs[1::4]
+    boundsNo3 = clipJobs[2::4]
+    boundsNo4 = clipJobs[3::4]
  
     #Define the multiprocessing tasks
     def one(task):
         try:
-            for indivBound1 in boundsNo1:
+            for clipScene1, indivBound1 in boundsNo1:
                 boundName1 = indivBound1.split('/')[-1]
                 boundName1 = boundName1.split('.')[0]
-                processing.run("gdal:cliprasterbymasklayer", {'INPUT':inImage,'MASK':indivBound1,'SOURCE_CRS':None,'TARGET_CRS':None,'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,'KEEP_RESOLUTION':False,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':True,'OPTIONS':finalCompressOptions,'DATA_TYPE':0,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory  + boundName1 + 'Tile.tif'})
+                BlockReader.cutTile(blockSources[clipScene1['inImage']], blockCache, indivBound1, clipScene1['processTileDirectory'] + boundName1 + 'Tile.tif', finalCompressOptions, gdalOptions)
             print("Done pt.1")
         except BaseException as e:
             print(e)
     def two(task):
         try:
-            for indivBound2 in boundsNo2:
+            for clipScene2, indivBound2 in boundsNo2:
                 boundName2 = indivBound2.split('/')[-1]
                 boundName2 = boundName2.split('.')[0]
-                processing.run("gdal:cliprasterbymasklayer", {'INPUT':inImage,'MASK':indivBound2,'SOURCE_CRS':None,'TARGET_CRS':None,'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,'KEEP_RESOLUTION':False,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':True,'OPTIONS':finalCompressOptions,'DATA_TYPE':0,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory  + boundName2 + 'Tile.tif'})
+                BlockReader.cutTile(blockSources[clipScene2['inImage']], blockCache, indivBound2, clipScene2['processTileDirectory'] + boundName2 + 'Tile.tif', finalCompressOptions, gdalOptions)
             print("Done pt.2")
         except BaseException as e:
             print(e)
     def three(task):
         try:
-            for indivBound3 in boundsNo3:
+            for clipScene3, indivBound3 in boundsNo3:
                 boundName3 = indivBound3.split('/')[-1]
                 boundName3 = boundName3.split('.')[0]
-                processing.run("gdal:cliprasterbymasklayer", {'INPUT':inImage,'MASK':indivBound3,'SOURCE_CRS':None,'TARGET_CRS':None,'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,'KEEP_RESOLUTION':False,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':True,'OPTIONS':finalCompressOptions,'DATA_TYPE':0,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory  + boundName3 + 'Tile.tif'})
+                BlockReader.cutTile(blockSources[clipScene3['inImage']], blockCache, indivBound3, clipScene3['processTileDirectory'] + boundName3 + 'Tile.tif', finalCompressOptions, gdalOptions)
             print("Done pt.3")
         except BaseException as e:
             print(e)
     def four(task):
         try:
-            for indivBound4 in boundsNo4:
+            for clipScene4, indivBound4 in boundsNo4:
                 boundName4 = indivBound4.split('/')[-1]
                 boundName4 = boundName4.split('.')[0]
-                processing.run("gdal:cliprasterbymasklayer", {'INPUT':inImage,'MASK':indivBound4,'SOURCE_CRS':None,'TARGET_CRS':None,'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,'KEEP_RESOLUTION':False,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':True,'OPTIONS':finalCompressOptions,'DATA_TYPE':0,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory  + boundName4 + 'Tile.tif'})
+                BlockReader.cutTile(blockSources[clipScene4['inImage']], blockCache, indivBound4, clipScene4['processTileDirectory'] + boundName4 + 'Tile.tif', finalCompressOptions, gdalOptions)
             print("Done pt.4")
         except BaseException as e:
             print(e)
@@ -369,340 +549,358 @@ if promptReply == QMessageBox.Yes:
     except BaseException as e:
         print(e)
 
-
-else:
-    print("Alright let's get straight into sharpening what is already in " + processTileDirectory)
-
-
-"""
-#############################################################################################
-#############################################################################################
-Set up for the batch processing
-"""
-
-#A suffix for the file output
-settingsSuffix = str(speedUpFactor) + '_' + str(radiusMetres) + '_' + str(toneShiftFactor) + '_' + str(maxPixelChangeFactor) + '_' + str(clippingPreventionFactor)
-
-#y=(640/(1+(1-0.00625)^{x}))-320
-#Following the above formula style to cap the shifting of pixel values as the shift approaches 255
-#A max pixel change factor of 0.25 will cap the pixel shift at about 20
-maxPixelChangeFactor = maxPixelChangeFactor * maxPixelChangeFactor
-capDenominator = maxPixelChangeFactor * 640
-capMinusFactor = 0.00625 / (maxPixelChangeFactor**0.9)
-capSubtraction = maxPixelChangeFactor * 320
-
-#List the input images
-inImageTileFiles = glob.glob(inImageTileDir + '*.tif')
-
-#Make sure the parent process folder exists
-processTileDirectoryWOutNumber = inImageTileDir + 'Processing/' 
-if not os.path.exists(processTileDirectoryWOutNumber): os.mkdir(processTileDirectoryWOutNumber)
-
-
-"""
-####################################################################
-Starting up the for-loop...
-"""
-
-#Let's process each of the images one by one
-runNumber = 0
-for inImageTile in inImageTileFiles:
-    try:
+    #Note down how much reading the cache saved
+    for scene in scenes:
+        print(scene['inImageName'] + ": " + BlockReader.describeStats(blockSources[scene['inImage']]))
+        debugText = open(scene['otherDirectory'] + scene['inImageName'] + "Debug.txt","a+")
+        debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": Tiling done. " + BlockReader.describeStats(blockSources[scene['inImage']]) + '. \n')
+        debugText.close()
         
-        runNumber = runNumber + 1
-        inImageTile = inImageTile.replace('\\','/')
-        #Set up the layer name for the raster calculations
-        inImageTileName = inImageTile.split("/")[-1]
-        inImageTileName = inImageTileName.split(".")[0]
+        #Keep the checksums of the blocks that went into the tiles, so a later delta run can tell what has changed
+        DeltaPatch.writeManifest(scene['otherDirectory'] + scene['inImageName'] + 'BlockChecksums.json', blockSources[scene['inImage']], blockSources[scene['inImage']]['checksums'], BlockReader.blockLayout(blockSources[scene['inImage']]))
         
-        rasTile = QgsRasterLayer(inImageTile)
-        rasTileExtent = rasTile.extent()
+        #Let go of the source so it isn't held open (and locked on Windows) for the rest of the run
+        BlockReader.closeSource(blockSources[scene['inImage']])
 
-        #Make sure that the processing folder exists
-        processTileDirectory = processTileDirectoryWOutNumber + inImageTileName + '/'
-        try:
-            os.mkdir(processTileDirectory)
-        except:
-            boundsFiles = glob.glob(processTileDirectory + '*')
-            for f in boundsFiles:
-                os.remove(f)
-
-        #Clear out the folder
-        files = glob.glob(processTileDirectory + '*')
-        try:
-            for f in files:
-                os.remove(f)
-        except BaseException as e:
-            print("Bro we couldn't clear the files " + inImageTileName)
-            print(e)
 
-        """
-        ###########################################################################
-        Setting it up for the bigger processing
-        """
+elif deltaMode and nodeRole != 'worker':
+    print("Delta mode, only the tiles that the changes reach will be redone")
 
-        print("Initial processing")
-
-        #Combine the bands to determine a total brightness
-        processing.run("gdal:rastercalculator", {'INPUT_A': inImageTile ,'BAND_A':1,'INPUT_B':inImageTile,'BAND_B':2,'INPUT_C':inImageTile,'BAND_C':3,'INPUT_D':inImageTile,'BAND_D':4,'FORMULA':'(D>128)*(((A.astype(numpy.float64))+(B.astype(numpy.float64))+(C.astype(numpy.float64)))/3)+((D < 129)*(-1))','RTYPE':1,'NO_DATA':-1,'OPTIONS':compressOptions,'EXTRA':'','OUTPUT':processTileDirectory + 'CombinedBands.tif'})
-        
-        #Reduce res for quicker processing
-        processing.run("gdal:translate", {'INPUT':inImageTile,'TARGET_CRS':None,'NODATA':None,'COPY_SUBDATASETS':False,'OPTIONS':compressOptions,'EXTRA':'-r cubic -tr ' + str(pixelSizeBig) + ' ' + str(pixelSizeBig) + ' -b 1','DATA_TYPE':0,'OUTPUT':processTileDirectory + 'ReducedResRed.tif'})
-        processing.run("gdal:translate", {'INPUT':inImageTile,'TARGET_CRS':None,'NODATA':None,'COPY_SUBDATASETS':False,'OPTIONS':compressOptions,'EXTRA':'-r cubic -tr ' + str(pixelSizeBig) + ' ' + str(pixelSizeBig) + ' -b 2','DATA_TYPE':0,'OUTPUT':processTileDirectory + 'ReducedResGreen.tif'})
-        processing.run("gdal:translate", {'INPUT':inImageTile,'TARGET_CRS':None,'NODATA':None,'COPY_SUBDATASETS':False,'OPTIONS':compressOptions,'EXTRA':'-r cubic -tr ' + str(pixelSizeBig) + ' ' + str(pixelSizeBig) + ' -b 3','DATA_TYPE':0,'OUTPUT':processTileDirectory + 'ReducedResBlue.tif'})
+elif nodeRole != 'worker':
+    print("Alright let's get straight into sharpening what is already in each scene's " + '4Tiles' + " folder")
 
-        #Calculate the minimum and maximum among all bands
-        processing.run("grass7:r.series", {'input':[processTileDirectory + 'ReducedResBlue.tif',processTileDirectory + 'ReducedResGreen.tif',processTileDirectory + 'ReducedResRed.tif'],'-n':True,'method':[4],'quantile':'','weights':'','output':processTileDirectory + 'TrueMinimum.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-        processing.run("grass7:r.series", {'input':[processTileDirectory + 'ReducedResBlue.tif',processTileDirectory + 'ReducedResGreen.tif',processTileDirectory + 'ReducedResRed.tif'],'-n':True,'method':[6],'quantile':'','weights':'','output':processTileDirectory + 'TrueMaximum.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-
-        #Reduce the resolution for the combined bands, bilinear and the scale parameters are used to prevent values from being 0, which causes glitches in grass tools
-        processing.run("gdal:translate", {'INPUT':processTileDirectory + 'CombinedBands.tif','TARGET_CRS':None,'NODATA':None,'COPY_SUBDATASETS':False,'OPTIONS':compressOptions,'EXTRA':'-r bilinear -tr ' + str(pixelSizeBig) + ' ' + str(pixelSizeBig) + ' -b 1 -scale 0 255 1 255','DATA_TYPE':0,'OUTPUT':processTileDirectory + 'ReducedResCombined.tif'})
 
+"""
+#############################################################################################
+In delta mode, recut only the tiles that the changes reach, using the tile bounds from the last tiling
+"""
 
-        """
-        ##########################################################################
-        Find the shadowed areas for later correction
-        """
+#The checksums of the edited images are only written over the old ones once the patch is done, in case it fails part way
+deltaChecksums = {}
+deltaGrids = {}
+deltaLayouts = {}
+if deltaMode and nodeRole != 'worker':
+    deltaCache = BlockReader.makeBlockCache(blockCacheMegabytes * 1000000)
+    for scene in scenes:
+        deltaSource = BlockReader.openSource(scene['inImage'])
+        deltaGrids[scene['inImageName']] = {gridName:deltaSource[gridName] for gridName in ['width', 'height', 'blockWidth', 'blockHeight']}
         
-        #Shadow area A
-        #Grab pixels that are very dark
-        processing.run("qgis:rastercalculator", {'EXPRESSION':'8/(1+1.15^(\"ReducedResCombined@1\"-30))','LAYERS':[processTileDirectory + 'ReducedResCombined.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceA.tif'})
-        #Determine where the bigger areas are
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'ShadowChanceA.tif','selection':processTileDirectory + 'ShadowChanceA.tif','method':15,'size':shadowDiameter - 2,'gauss':None,'quantile':'0.10','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'ShadowChanceASmooth.tif','nprocs':8,'GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-        #Confirming the bigger shadow parts
-        processing.run("qgis:rastercalculator", {'EXPRESSION':'(\"ShadowChanceA@1\"^0.2)  *  (\"ShadowChanceASmooth@1\" ^ 0.7)','LAYERS':[processTileDirectory + 'ShadowChanceASmooth.tif',processTileDirectory + 'ShadowChanceA.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceAMultiply.tif'})
-        #Give approval for the shadow area B to spread 
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'ShadowChanceAMultiply.tif','selection':processTileDirectory + 'ShadowChanceAMultiply.tif','method':0,'size':shadowDiameter,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'ShadowChanceAMultiplyApproval.tif','nprocs':8,'GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-
-        #Shadow area B
-        #Grab pixels that are fairly dark
-        processing.run("qgis:rastercalculator", {'EXPRESSION':'8/(1+1.15^(\"ReducedResCombined@1\"-52))','LAYERS':[processTileDirectory + 'ReducedResCombined.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceB.tif'})
-        #Determine where the bigger areas are
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'ShadowChanceB.tif','selection':processTileDirectory + 'ShadowChanceB.tif','method':15,'size':shadowDiameter,'gauss':None,'quantile':'0.28','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'ShadowChanceBSmooth.tif','nprocs':8,'GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-        #Confirming the bigger shadow parts as approved by shadow area A
-        processing.run("qgis:rastercalculator",{'EXPRESSION':'(\"ShadowChanceB@1\"^0.2)  *  (\"ShadowChanceBSmooth@1\" ^ 0.6) * ((\"ShadowChanceAMultiplyApproval@1\" ^ 0.5) + 0.1)','LAYERS':[processTileDirectory + 'ShadowChanceBSmooth.tif',processTileDirectory + 'ShadowChanceB.tif',processTileDirectory + 'ShadowChanceAMultiplyApproval.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceBMultiply.tif'})
-        #Give approval for the shadow area C to spread 
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'ShadowChanceBMultiply.tif','selection':processTileDirectory + 'ShadowChanceBMultiply.tif','method':15,'size':shadowDiameter + 2,'gauss':None,'quantile':'0.92','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'ShadowChanceBMultiplyApproval.tif','nprocs':8,'GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-        
-        #Shadow area C
-        #Grab pixels that are somewhat dark
-        processing.run("qgis:rastercalculator", {'EXPRESSION':'8/(1+1.15^(\"ReducedResCombined@1\"-85))','LAYERS':[processTileDirectory + 'ReducedResCombined.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceC.tif'})
-        #Determine where the bigger areas are
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'ShadowChanceC.tif','selection':processTileDirectory + 'ShadowChanceC.tif','method':15,'size':shadowDiameter,'gauss':None,'quantile':'0.4','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'ShadowChanceCSmooth.tif','nprocs':8,'GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-        #Confirming the bigger shadow parts as approved by shadow area B
-        processing.run("qgis:rastercalculator",{'EXPRESSION':'(\"ShadowChanceC@1\"^0.2)  *  (\"ShadowChanceCSmooth@1\" ^ 0.6) * ((\"ShadowChanceBMultiplyApproval@1\" ^ 0.6)) * ' + str(shadowBoostFactor),'LAYERS':[processTileDirectory + 'ShadowChanceCSmooth.tif',processTileDirectory + 'ShadowChanceC.tif',processTileDirectory + 'ShadowChanceBMultiplyApproval.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceCMultiply.tif'})
-        #Bring out to full res
-        processing.run("gdal:warpreproject", {'INPUT':processTileDirectory + 'ShadowChanceCMultiply.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':rasTileExtent,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory + 'ShadowBoostFinal.tif'})
+        #Either the changes have been given, or they're found by comparing the blocks against the last tiling
+        deltaScanText = ''
+        if len(deltaChangedExtents) > 0:
+            scene['deltaChangedExtents'] = [tuple(changedExtent) for changedExtent in deltaChangedExtents]
+            
+            #The noted checksums of the blocks under the listed extents are brought up to date as well, so the next run doesn't see them as changed
+            deltaManifest = DeltaPatch.readManifest(scene['otherDirectory'] + scene['inImageName'] + 'BlockChecksums.json')
+            if deltaManifest is not None and DeltaPatch.manifestMatches(deltaManifest, deltaSource):
+                scanKeys = [key for key in BlockReader.blocksInExtents(deltaSource, scene['deltaChangedExtents']) if key in deltaManifest['checksums']]
+                scannedChecksums = BlockReader.scanChecksums(deltaSource, scanKeys)
+                deltaChecksums[scene['inImageName']] = {key:scannedChecksums.get(key, deltaManifest['checksums'][key]) for key in deltaManifest['checksums']}
+                deltaLayouts[scene['inImageName']] = BlockReader.blockLayout(deltaSource)
+        else:
+            deltaManifest = DeltaPatch.readManifest(scene['otherDirectory'] + scene['inImageName'] + 'BlockChecksums.json')
+            if deltaManifest is None or not DeltaPatch.manifestMatches(deltaManifest, deltaSource):
+                print("There are no block checksums from a tiling of " + scene['inImageName'] + " with the same layout, so the changed extents need listing in deltaChangedExtents")
+                getToItOldBoy
+            print("Looking for changed blocks in " + scene['inImageName'])
+            scanStart = time.time()
+            deltaLayouts[scene['inImageName']] = BlockReader.blockLayout(deltaSource)
+            layoutUsable = not deltaFullChecksumScan and deltaLayouts[scene['inImageName']] is not None and deltaManifest.get('layout') is not None
+            
+            #Without a layout to go by, every block has to be decoded, which on a big mosaic takes as long as reading the whole image
+            scanKeys = DeltaPatch.blocksToScan(deltaManifest, deltaLayouts[scene['inImageName']]) if layoutUsable else None
+            scannedChecksums = BlockReader.scanChecksums(deltaSource, scanKeys)
+            deltaChecksums[scene['inImageName']] = {key:scannedChecksums.get(key, deltaManifest['checksums'][key]) for key in deltaManifest['checksums']}
+            scene['deltaChangedExtents'] = BlockReader.changedBlockExtents(deltaSource, deltaManifest['checksums'], deltaChecksums[scene['inImageName']])
+            deltaScanText = ('Decoded ' + (str(len(scanKeys)) + ' of the ' + str(len(deltaManifest['checksums'])) + ' noted blocks (the ones that moved in the file)' if layoutUsable else 'every block (a full decode)')
+                + ' to look for changes in ' + str(round(time.time() - scanStart, 1)) + ' seconds. ')
+            print(deltaScanText)
         
+        #Redo the tiles the changes can reach, the rest of the tiles and their outputs are left as they were
+        deltaBounds = DeltaPatch.affectedBounds(glob.glob(scene['processBoundsDirectory'] + '*.gpkg'), scene['deltaChangedExtents'], scene['influenceDistance'])
+        scene['deltaTiles'] = []
+        for deltaBound in deltaBounds:
+            deltaBound = deltaBound.replace('\\','/')
+            deltaTile = scene['processTileDirectory'] + deltaBound.split('/')[-1].split('.')[0] + 'Tile.tif'
+            BlockReader.cutTile(deltaSource, deltaCache, deltaBound, deltaTile, finalCompressOptions, gdalOptions)
+            scene['deltaTiles'].append(deltaTile)
         
-        """
-        ##########################################################################
-        Determining the difference to apply based on the larger radius
-        """
-
-        print("Speed up factor engaged")
-        print("(Increase the speed up factor if this part takes too long)")
-
-
-        #Calculate the minimum and maximum of the combined bands within the radius
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'ReducedResCombined.tif','selection':processTileDirectory + 'ReducedResCombined.tif','method':4,'size':diameterSize,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'MaximumCombined.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'ReducedResCombined.tif','selection':processTileDirectory + 'ReducedResCombined.tif','method':3,'size':diameterSize,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'MinimumCombined.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+        print(scene['inImageName'] + " has " + str(len(scene['deltaChangedExtents'])) + " changed areas reaching " + str(len(scene['deltaTiles'])) + " tiles")
+        debugText = open(scene['otherDirectory'] + scene['inImageName'] + "Debug.txt","a+")
+        debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": Delta mode. " + deltaScanText + str(len(scene['deltaChangedExtents'])) + " changed areas reach " + str(len(scene['deltaTiles'])) + " tiles. " + BlockReader.describeStats(deltaSource) + '. \n')
+        debugText.close()
+        BlockReader.closeSource(deltaSource)
 
 
-        #Smooth off those hard edges
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'MaximumCombined.tif','selection':processTileDirectory + 'MinimumCombined.tif','method':0,'size':diameterSize,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'MaximumSmooth.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'MinimumCombined.tif','selection':processTileDirectory + 'MinimumCombined.tif','method':0,'size':diameterSize,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'MinimumSmooth.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+"""
+#############################################################################################
+#############################################################################################
+Set up for the batch processing
+"""
 
+#Put the tiles of every scene into one queue, so the tail end of one scene overlaps with the start of the next
+tileQueue = []
+for scene in scenes:
+    
+    #List the input images
+    inImageTileFiles = scene['deltaTiles'] if deltaMode else glob.glob(scene['inImageTileDir'] + '*.tif')
+    scene['tileCount'] = len(inImageTileFiles)
+    tileQueue = tileQueue + [(scene, inImageTile) for inImageTile in inImageTileFiles]
 
-        #Scale the amount that the midtone is allowed to be moved
-        processing.run("qgis:rastercalculator", {'EXPRESSION':' \"MinimumSmooth@1\" ^ ' + str(toneShiftFactor),'LAYERS':[processTileDirectory + 'MinimumSmooth.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'MinimumSmoothScaled.tif'})
-        processing.run("qgis:rastercalculator", {'EXPRESSION':' (((abs(\"MaximumSmooth@1\"-255))^ '+ str(toneShiftFactor)+ ')*-1)+255 ' ,'LAYERS':[processTileDirectory + 'MaximumSmooth.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'MaximumSmoothScaled.tif'})
+    #Make sure the parent process folder exists
+    if not os.path.exists(scene['inImageTileDir'] + 'Processing/'): os.mkdir(scene['inImageTileDir'] + 'Processing/')
 
+#Hand the tiles out through the shared queue so that the other computers can pick them up too
+if nodeRole == 'coordinator':
+    tileJobs = []
+    for tileNumber, (scene, inImageTile) in enumerate(tileQueue):
+        tileJobName = inImageTile.replace('\\','/').split('/')[-1].split('.')[0]
+        tileJobs.append({'jobId':str(tileNumber) + '_' + scene['inImageName'] + '_' + tileJobName, 'scene':scene, 'inImageTile':inImageTile.replace('\\','/')})
+    TileQueue.publishJobs(sharedQueueDirectory, tileJobs, queueRunId)
+    print(str(len(tileJobs)) + " tiles are ready to be picked up from " + sharedQueueDirectory)
 
-        #Use the min and max to calculate range and midrange
-        processing.run("qgis:rastercalculator", {'EXPRESSION':'\"MaximumSmoothScaled@1\" - \"MinimumSmoothScaled@1\"','LAYERS':[processTileDirectory + 'MaximumSmoothScaled.tif',processTileDirectory + 'MinimumSmoothScaled.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'Range.tif'})
-        processing.run("qgis:rastercalculator", {'EXPRESSION':'(\"MaximumSmoothScaled@1\" + \"MinimumSmoothScaled@1\")/2','LAYERS':[processTileDirectory + 'MaximumSmoothScaled.tif',processTileDirectory + 'MinimumSmoothScaled.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'Midrange.tif'})
 
+"""
+#######################################################################
+Once all of a scene's tiles are processed, they can be brought together
+"""
 
-        #Bring the res back out to full
-        processing.run("gdal:warpreproject", {'INPUT':processTileDirectory + 'Range.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':0,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory + 'RangeResamp.tif'})
-        processing.run("gdal:warpreproject", {'INPUT':processTileDirectory + 'Midrange.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':0,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory + 'MidrangeResamp.tif'})
+#This is run as a task so that the tiles of the other scenes can keep going while it merges
+def mergeScene(task, scene):
+    
+    inImageName = scene['inImageName']
+    outImageName = scene['outImageName']
+    processDirectory = scene['processDirectory']
+    otherDirectory = scene['otherDirectory']
+    pixelSizeAve = scene['pixelSizeAve']
+    outImageDir = scene['outImageDir']
+    finalImageDir = scene['finalImageDir']
+    
 
+    #Prepare to make a final mosaic where the alpha bands are respected, with the paths as cmd expects them
+    outImageDir = outImageDir.replace("/", "\\")
 
+    #Make the final image directory
+    finalImageDir = finalImageDir.replace("/", "\\")
+    if not os.path.exists(finalImageDir):os.mkdir(finalImageDir)
 
-        #Look for potential clipping
-        processing.run("qgis:rastercalculator", {'EXPRESSION':'(\"TrueMaximum@1\" - \"Midrange@1\")*((255/(\"Range@1\"+1)))-128','LAYERS':[processTileDirectory + 'TrueMaximum.tif',processTileDirectory + 'Midrange.tif',processTileDirectory + 'Range.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'WhiteClip.tif','OPTIONS': compressOptions})
-        processing.run("qgis:rastercalculator", {'EXPRESSION':'-(\"TrueMinimum@1\" - \"Midrange@1\")*((255/(\"Range@1\"+1)))-128','LAYERS':[processTileDirectory + 'TrueMinimum.tif',processTileDirectory + 'Midrange.tif',processTileDirectory + 'Range.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'BlackClip.tif','OPTIONS': compressOptions})
-        processing.run("gdal:warpreproject", {'INPUT':processTileDirectory + 'WhiteClip.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':None,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory + 'WhiteClipByte.tif'})
-        processing.run("gdal:warpreproject", {'INPUT':processTileDirectory + 'BlackClip.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':None,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory + 'BlackClipByte.tif'})
-        processing.run("gdal:warpreproject", {'INPUT':processTileDirectory + 'WhiteClipByte.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':7,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig * 4,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory + 'WhiteClipByteExpand.tif'})
-        processing.run("gdal:warpreproject", {'INPUT':processTileDirectory + 'BlackClipByte.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':7,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig * 4,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory + 'BlackClipByteExpand.tif'})
-        processing.run("gdal:warpreproject", {'INPUT':processTileDirectory + 'WhiteClipByteExpand.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory + 'WhiteClipByteExpandSmooth.tif'})
-        processing.run("gdal:warpreproject", {'INPUT':processTileDirectory + 'BlackClipByteExpand.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory + 'BlackClipByteExpandSmooth.tif'})
-        
+    #Prepare variables for the final merging in GDAL
+    fullExtentForCutline = processDirectory + inImageName + 'ExtentFixFilt.gpkg'
+    fullExtentForCutline = fullExtentForCutline.replace("/", "\\")
+    finalOutputImageName = outImageName + datetime.now().strftime("%Y%m%d%H%M") 
+    finalOutputImage = finalImageDir + finalOutputImageName + '.tif'
+
+    #Run gdal through cmd using syntax that it likes (the gdal exe is in cd C:\Program Files\QGIS 3.16\bin)
+    gdalOptionsFinal = '-co COMPRESS=LZW -co PREDICTOR=2 -co NUM_THREADS=ALL_CPUS -co BIGTIFF=IF_SAFER -co TILED=YES -multi --config GDAL_NUM_THREADS ALL_CPUS -wo NUM_THREADS=ALL_CPUS -overwrite'
+    cmd = 'gdalwarp -of GTiff ' + gdalOptionsFinal + ' -crop_to_cutline -cutline "' + fullExtentForCutline + '" "' + outImageDir + '**.tif" "' + finalOutputImage + '" & timeout 3'
+    print("Watch the cmd window")
+    os.system(cmd)
+    
+    #The exit code is lost behind the timeout, so check gdalwarp actually made something
+    if not os.path.exists(finalOutputImage):
+        raise RuntimeError('gdalwarp did not make ' + finalOutputImage)
+    
+    #The histograms, thumbnail and pyramids are left to carry on after the wait for the merges
+    scene['mergeDone'] = True
+    
+    debugText = open(otherDirectory + inImageName + "Debug.txt","a+")
+    debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": The merge of " + finalOutputImage + ' is done. \n')
+    debugText.close()
+    
+    
+    """
+    ##########################################################################
+    Histograms can be used to inform on how much value clipping is going on
+    """
+    
+    #This is an optional extra amount of information to the final tif
+    try:
+        #Histogram calculations by reducing resolution then analysing each band
+        processing.run("gdal:warpreproject", {'INPUT':finalOutputImage,'SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':-1,'TARGET_RESOLUTION':pixelSizeAve * 100,'OPTIONS':compressOptions,'DATA_TYPE':2,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':'','OUTPUT':processDirectory + 'ReducedResForHisto.tif'})
 
-        #Use the determined formula to figure out what difference needs to be applied to the pixels to stretch them to 0-255
-        #0.80 is a factor to increase the effect of the larger radius
-        processing.run("qgis:rastercalculator", {'EXPRESSION':'((\"CombinedBands@1\" - \"MidrangeResamp@1\")*((255/(\"RangeResamp@1\"+1)))+128 - \"CombinedBands@1\") / 0.80','LAYERS':[processTileDirectory + 'CombinedBands.tif',processTileDirectory + 'MidrangeResamp.tif',processTileDirectory + 'RangeResamp.tif'],'CELLSIZE':0,'EXTENT':rasTileExtent,'CRS':None,'OUTPUT':processTileDirectory + 'DifferenceToApply.tif','OPTIONS': compressOptions})
+        processing.run("qgis:rasterlayerhistogram", {'INPUT':processDirectory + 'ReducedResForHisto.tif','BAND':1,'BINS':256,'OUTPUT':finalImageDir + finalOutputImageName + 'FinalHistoRed.html'})
+        processing.run("qgis:rasterlayerhistogram", {'INPUT':processDirectory + 'ReducedResForHisto.tif','BAND':2,'BINS':256,'OUTPUT':finalImageDir + finalOutputImageName + 'FinalHistoGreen.html'})
+        processing.run("qgis:rasterlayerhistogram", {'INPUT':processDirectory + 'ReducedResForHisto.tif','BAND':3,'BINS':256,'OUTPUT':finalImageDir + finalOutputImageName + 'FinalHistoBlue.html'})
         
+        #Creating a small thumbnail so that you know the extent from windows explorer
+        processing.run("gdal:warpreproject", {'INPUT':processDirectory + 'ReducedResForHisto.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve * 100,'OPTIONS':finalCompressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':'','OUTPUT':finalImageDir + finalOutputImageName + 'Thumbnail.tif'})
         
-        """
-        ###########################################################################
-        Determining the difference to apply based on the smaller radius
-        """
+        #Building pyramid layers so that you can browse easily
+        processing.run("gdal:overviews", {'INPUT':finalOutputImage,'CLEAN':False,'LEVELS':'','RESAMPLING':0,'FORMAT':1,'EXTRA':'--config COMPRESS_OVERVIEW JPEG'})
+    except BaseException as e:
+        print (e)
 
-        #Calculate the minimum and maximum of the combined bands within the radius
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'ReducedResCombined.tif','selection':processTileDirectory + 'ReducedResCombined.tif','method':4,'size':diameterSizeThird,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'MaximumCombinedThird.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'ReducedResCombined.tif','selection':processTileDirectory + 'ReducedResCombined.tif','method':3,'size':diameterSizeThird,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'MinimumCombinedThird.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+#Once the edits are in the final image, its block checksums replace the ones from before the edit
+#There's nothing to write if there were no checksums from the last tiling to bring up to date
+def writeDeltaManifest(scene):
+    if scene['inImageName'] in deltaChecksums:
+        DeltaPatch.writeManifest(scene['otherDirectory'] + scene['inImageName'] + 'BlockChecksums.json', deltaGrids[scene['inImageName']], deltaChecksums[scene['inImageName']], deltaLayouts[scene['inImageName']])
 
-        #Smooth off those hard edges
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'MaximumCombinedThird.tif','selection':processTileDirectory + 'MaximumCombinedThird.tif','method':0,'size':diameterSizeThird,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'MaximumSmoothThird.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
-        processing.run("grass7:r.neighbors", {'input':processTileDirectory + 'MinimumCombinedThird.tif','selection':processTileDirectory + 'MinimumCombinedThird.tif','method':0,'size':diameterSizeThird,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'MinimumSmoothThird.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+#In delta mode the redone tiles are patched into the last final image, rather than merging everything again
+def patchScene(task, scene):
+    
+    finalImage = DeltaPatch.latestFinalImage(scene['finalImageDir'], scene['outImageName'])
+    if finalImage is None:
+        print("There's no final image of " + scene['inImageName'] + " to patch, so it'll be merged in full")
+        mergeScene(task, scene)
+        writeDeltaManifest(scene)
+        return
+    
+    patchStart = time.time()
+    pixelsPatched = DeltaPatch.patchFinalImage(finalImage, glob.glob(scene['outImageDir'] + '*.tif'), scene['processDirectory'] + scene['inImageName'] + 'ExtentFixFilt.gpkg', scene['deltaChangedExtents'], scene['influenceDistance'])
+    writeDeltaManifest(scene)
+    
+    debugText = open(scene['otherDirectory'] + scene['inImageName'] + "Debug.txt","a+")
+    debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": " + str(pixelsPatched) + ' pixels of ' + finalImage + ' and its overviews were patched in ' + str(round(time.time() - patchStart, 1)) + ' seconds. The histograms and thumbnail are left as they were. \n')
+    debugText.close()
 
-        """
-        ###########################################################################
-        Start up the non-grass task
-        """
+#Run a scene's merge (or patch), the wait for the merges always hears back even if it fails
+def mergeSceneTask(task, scene, mergeFunction):
+    try:
+        mergeFunction(task, scene)
+    except BaseException as e:
+        print(e)
+        scene['mergeFailed'] = True
+        debugText = open(scene['otherDirectory'] + scene['inImageName'] + "Debug.txt","a+")
+        debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": So the merge of " + scene['inImageName'] + ' failed on ' + nodeName + '. Error message is ' + str(e) + '. \n')
+        debugText.close()
+    finally:
+        scene['mergeDone'] = True
+
+#Start the merge for any scene whose tiles have all confirmed
+def startFinishedMerges():
+    for scene in scenes:
+        if scene['mergeStarted']:
+            continue
+        numberOfTilesDone = len(glob.glob(scene['otherDirectory'] + 'ConfirmationFiles/' + '*.txt'))
+        if numberOfTilesDone >= scene['tileCount']:
+            print("All the tiles of " + scene['inImageName'] + " are done, starting its merge")
+            scene['mergeStarted'] = True
+            scene['mergeTask'] = QgsTask.fromFunction(scene['inImageName'] + 'Merge', mergeSceneTask, scene, patchScene if deltaMode else mergeScene)
+            QgsApplication.taskManager().addTask(scene['mergeTask'])
+
+#Run a tile's task, and let the shared queue know how it went
+def processTileTask(task, taskFunction, taskTileLease, taskScene, *taskArguments):
+    try:
+        taskFunction(task, taskScene, *taskArguments)
+    except BaseException as e:
+        print(e)
+        taskInImageTileName = taskArguments[1]
+        debugText = open(taskScene['otherDirectory'] + taskScene['inImageName'] + "Debug.txt","a+")
+        debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": So the task for " + taskInImageTileName + ' failed on ' + nodeName + '. Error message is ' + str(e) + '. \n')
+        debugText.close()
         
-        def processEachList(task, taskProcessTileDirectory, taskInImageTileName, taskInImageTile, taskRasTileExtent):
-                
-            print("Applying the differences for" + taskInImageTile)
-            print("Process dir" + taskProcessTileDirectory)
-            
-            
-            #Scale the amount that the midtone is allowed to be moved
-            processing.run("qgis:rastercalculator", {'EXPRESSION':' \"MinimumSmoothThird@1\" ^ ' + str(toneShiftFactor),'LAYERS':[taskProcessTileDirectory + 'MinimumSmoothThird.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'MinimumSmoothScaledThird.tif'})
-            processing.run("qgis:rastercalculator", {'EXPRESSION':' (((abs(\"MaximumSmoothThird@1\"-255))^ '+ str(toneShiftFactor)+ ')*-1)+255 ' ,'LAYERS':[taskProcessTileDirectory + 'MaximumSmoothThird.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'MaximumSmoothScaledThird.tif'})
-
-            #Use the min and max to calculate range and midrange
-            processing.run("qgis:rastercalculator", {'EXPRESSION':'\"MaximumSmoothScaledThird@1\" - \"MinimumSmoothScaledThird@1\"','LAYERS':[taskProcessTileDirectory + 'MaximumSmoothScaledThird.tif',taskProcessTileDirectory + 'MinimumSmoothScaledThird.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'RangeThird.tif'})
-            processing.run("qgis:rastercalculator", {'EXPRESSION':'(\"MaximumSmoothScaledThird@1\" + \"MinimumSmoothScaledThird@1\")/2','LAYERS':[taskProcessTileDirectory + 'MaximumSmoothScaledThird.tif',taskProcessTileDirectory + 'MinimumSmoothScaledThird.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'MidrangeThird.tif'})
-
-            print("Speed up factor disengaging")
-
-            #Bring the res back out to full
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'RangeThird.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':0,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'RangeResampThird.tif'})
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'MidrangeThird.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':0,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'MidrangeResampThird.tif'})
-
-
-            #Look for potential clipping
-            processing.run("qgis:rastercalculator", {'EXPRESSION':'(\"TrueMaximum@1\" - \"MidrangeThird@1\")*((255/(\"RangeThird@1\"+1)))-128','LAYERS':[taskProcessTileDirectory + 'TrueMaximum.tif',taskProcessTileDirectory + 'MidrangeThird.tif',taskProcessTileDirectory + 'RangeThird.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'WhiteClipThird.tif','OPTIONS':compressOptions})
-            processing.run("qgis:rastercalculator", {'EXPRESSION':'-(\"TrueMinimum@1\" - \"MidrangeThird@1\")*((255/(\"RangeThird@1\"+1)))-128','LAYERS':[taskProcessTileDirectory + 'TrueMinimum.tif',taskProcessTileDirectory + 'MidrangeThird.tif',taskProcessTileDirectory + 'RangeThird.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'BlackClipThird.tif','OPTIONS':compressOptions})
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'WhiteClipThird.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':None,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'WhiteClipByteThird.tif'})
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'BlackClipThird.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':None,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'BlackClipByteThird.tif'})
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'WhiteClipByteThird.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':7,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig * 2,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'WhiteClipByteExpandThird.tif'})
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'BlackClipByteThird.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':7,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig * 2,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'BlackClipByteExpandThird.tif'})
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'WhiteClipByteExpandThird.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'WhiteClipByteExpandSmoothThird.tif'})
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'BlackClipByteExpandThird.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'BlackClipByteExpandSmoothThird.tif'})
-            
-
-            #Use the determined formula to figure out what difference needs to be applied to the pixels to stretch them to 0-255
-            #0.80 is a factor to decrease the effect of the smaller radius
-            processing.run("qgis:rastercalculator", {'EXPRESSION':'((\"CombinedBands@1\" - \"MidrangeResampThird@1\")*((255/(\"RangeResampThird@1\"+1)))+128 - \"CombinedBands@1\") * 0.80 ','LAYERS':[taskProcessTileDirectory + 'CombinedBands.tif',taskProcessTileDirectory + 'MidrangeResampThird.tif',taskProcessTileDirectory + 'RangeResampThird.tif'],'CELLSIZE':0,'EXTENT':taskRasTileExtent,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'DifferenceToApplyThird.tif','OPTIONS': compressOptions})
-
-            
-            """
-            ###########################################################################
-            Bring together the pixel shift amounts for each of the radii and apply them to the original bands
-            """
-            
-            #z=(x+y)*((1)/(abs(x-y)+abs(x+y))) abs(x+y)
-            #The above formula is a three dimensional function that combines values such that there is a penalty for disagreeance 
-            processing.run("qgis:rastercalculator", {'EXPRESSION':'0.5*(\"DifferenceToApply@1\"+\"DifferenceToApplyThird@1\")*((1)/(abs(\"DifferenceToApply@1\"-\"DifferenceToApplyThird@1\")+abs(\"DifferenceToApply@1\"+\"DifferenceToApplyThird@1\"))) * abs(\"DifferenceToApply@1\"+\"DifferenceToApplyThird@1\")','LAYERS':[taskInImageTile,taskProcessTileDirectory + 'DifferenceToApply.tif',taskProcessTileDirectory + 'DifferenceToApplyThird.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'CombinedDifference.tif','OPTIONS': compressOptions})
-
-            #Scale the differencing amounts back as per the formula to cap extreme values
-            processing.run("qgis:rastercalculator", {'EXPRESSION':'(' + str(capDenominator) + '/ ( 1 + (1 - ' + str(capMinusFactor) + ' ) ^ ( \"CombinedDifference@1\" ) ) ) - ' + str(capSubtraction),'LAYERS':[taskInImageTile,taskProcessTileDirectory + 'CombinedDifference.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'ScaledBackDifference.tif','OPTIONS': compressOptions})
-
-            
-
-            #Calculate how much to pull back the pixels from clipping
-            processing.run("qgis:rastercalculator", {'EXPRESSION':' ( 1.004 ^(( (\"WhiteClipByteExpandSmooth@1\" ^ 0.5) + (\"WhiteClipByteExpandSmoothThird@1\" ^ 0.5) ) * 1)) - 1','LAYERS':[taskProcessTileDirectory + 'WhiteClipByteExpandSmoothThird.tif',taskProcessTileDirectory + 'WhiteClipByteExpandSmooth.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'WhiteClipFactor.tif','OPTIONS':compressOptions})
-            processing.run("qgis:rastercalculator", {'EXPRESSION':' ( 1.004 ^(( (\"BlackClipByteExpandSmooth@1\" ^ 0.5) + (\"BlackClipByteExpandSmoothThird@1\" ^ 0.5) ) * 1)) - 1','LAYERS':[taskProcessTileDirectory + 'BlackClipByteExpandSmoothThird.tif',taskProcessTileDirectory + 'BlackClipByteExpandSmooth.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'BlackClipFactor.tif','OPTIONS':compressOptions})
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'WhiteClipFactor.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':6,'TARGET_EXTENT':taskRasTileExtent,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'WhiteClipFactorResamp.tif'})
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'BlackClipFactor.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':6,'TARGET_EXTENT':taskRasTileExtent,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'BlackClipFactorResamp.tif'})
-
-            
-            #Apply the difference to the bands, potentially with clipping prevention
-            processing.run("gdal:rastercalculator", {'INPUT_A':taskInImageTile,'BAND_A':1,'INPUT_B':taskProcessTileDirectory + 'ScaledBackDifference.tif','BAND_B':1,'INPUT_C':taskProcessTileDirectory + 'WhiteClipFactorResamp.tif','BAND_C':1,'INPUT_D':taskProcessTileDirectory + 'BlackClipFactorResamp.tif','BAND_D':1,'INPUT_E':taskProcessTileDirectory + 'ShadowBoostFinal.tif','BAND_E':1,
-                'FORMULA':'((A.astype(numpy.float64) + B.astype(numpy.float64))*(1- C.astype(numpy.float64) - D.astype(numpy.float64)))+ (255 * (D.astype(numpy.float64))) + (E.astype(numpy.float64))','RTYPE':1,'NO_DATA':-1,'OPTIONS':compressOptions,'EXTRA':'','OUTPUT':taskProcessTileDirectory + 'Band1Diffed.tif'})
-            processing.run("gdal:rastercalculator", {'INPUT_A':taskInImageTile,'BAND_A':2,'INPUT_B':taskProcessTileDirectory + 'ScaledBackDifference.tif','BAND_B':1,'INPUT_C':taskProcessTileDirectory + 'WhiteClipFactorResamp.tif','BAND_C':1,'INPUT_D':taskProcessTileDirectory + 'BlackClipFactorResamp.tif','BAND_D':1,'INPUT_E':taskProcessTileDirectory + 'ShadowBoostFinal.tif','BAND_E':1,
-                'FORMULA':'((A.astype(numpy.float64) + B.astype(numpy.float64))*(1- C.astype(numpy.float64) - D.astype(numpy.float64)))+ (255 * (D.astype(numpy.float64))) + (E.astype(numpy.float64))','RTYPE':1,'NO_DATA':-1,'OPTIONS':compressOptions,'EXTRA':'','OUTPUT':taskProcessTileDirectory + 'Band2Diffed.tif'})
-            processing.run("gdal:rastercalculator", {'INPUT_A':taskInImageTile,'BAND_A':3,'INPUT_B':taskProcessTileDirectory + 'ScaledBackDifference.tif','BAND_B':1,'INPUT_C':taskProcessTileDirectory + 'WhiteClipFactorResamp.tif','BAND_C':1,'INPUT_D':taskProcessTileDirectory + 'BlackClipFactorResamp.tif','BAND_D':1,'INPUT_E':taskProcessTileDirectory + 'ShadowBoostFinal.tif','BAND_E':1,
-                'FORMULA':'((A.astype(numpy.float64) + B.astype(numpy.float64))*(1- C.astype(numpy.float64) - D.astype(numpy.float64)))+ (255 * (D.astype(numpy.float64))) + (E.astype(numpy.float64))','RTYPE':1,'NO_DATA':-1,'OPTIONS':compressOptions,'EXTRA':'','OUTPUT':taskProcessTileDirectory + 'Band3Diffed.tif'})
-            
-            """
-            ###########################################################################
-            The tiles need a fading alpha band so they sit together nicely
-            """
+        #On a shared queue the tile is handed back out until it has used up its attempts
+        if taskTileLease is not None and TileQueue.failJob(sharedQueueDirectory, taskTileLease, e, maxTileAttempts):
+            return
+        confirmationText = open(taskScene['otherDirectory'] + 'ConfirmationFiles/' + taskInImageTileName + "Confirmation.txt","w+")
+        confirmationText.write(taskInImageTileName + ' failed. See debug.')
+        confirmationText.close()
+        return
+    finally:
+        if taskTileLease is not None:
+            taskTileLease['heartbeat'].set()
+    #If this computer lost the lease (e.g it stalled), the tile is left to the computer that took it over, whose output replaces this one
+    if taskTileLease is not None and not TileQueue.completeJob(sharedQueueDirectory, taskTileLease, leaseSeconds):
+        debugText = open(taskScene['otherDirectory'] + taskScene['inImageName'] + "Debug.txt","a+")
+        debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": " + nodeName + ' lost the lease on ' + taskArguments[1] + ' before finishing it, so it was not marked done from here. \n')
+        debugText.close()
 
-            
-            #Get the full extent of the tile
-            processing.run("native:polygonfromlayerextent", {'INPUT':taskInImageTile,'ROUND_TO':0,'OUTPUT':taskProcessTileDirectory + 'FullExtent.gpkg'})
-            
-            #Bring this in so that any border issues are taken away
-            processing.run("native:buffer", {'INPUT':taskProcessTileDirectory + 'FullExtent.gpkg','DISTANCE':pixelSizeAve * (-2),'SEGMENTS':5,'END_CAP_STYLE':0,'JOIN_STYLE':0,'MITER_LIMIT':2,'DISSOLVE':False,'OUTPUT':taskProcessTileDirectory + 'FullExtentIn.gpkg'})
-           
-            #Then convert to lines so that
-            processing.run("native:polygonstolines", {'INPUT':taskProcessTileDirectory + 'FullExtentIn.gpkg','OUTPUT':taskProcessTileDirectory + 'FullExtentInLines.gpkg'})
-            
-            #A raster is buffered off the lines so that has its values at 255 across most of the raster, but fades down to 0 at the edges
-            processing.run("gdal:rasterize", {'INPUT':taskProcessTileDirectory + 'FullExtentInLines.gpkg','FIELD':'','BURN':1,'UNITS':1,'WIDTH':pixelSizeX,'HEIGHT':pixelSizeY,'EXTENT':taskRasTileExtent,'NODATA':None,'OPTIONS':compressOptions,'DATA_TYPE':0,'INIT':None,'INVERT':False,'EXTRA':'','OUTPUT':taskProcessTileDirectory + 'FullExtentLinesRasterize.tif'})
-            processing.run("gdal:proximity", {'INPUT':taskProcessTileDirectory + 'FullExtentLinesRasterize.tif','BAND':1,'VALUES':'1','UNITS':1,'MAX_DISTANCE':64,'REPLACE':None,'NODATA':64,'OPTIONS':compressOptions,'EXTRA':'','DATA_TYPE':0,'OUTPUT':taskProcessTileDirectory + 'FullExtentLinesRasterizeDistance.tif'})
-            processing.run("qgis:rastercalculator", {'EXPRESSION':'\"FullExtentLinesRasterizeDistance@1\" * 4','LAYERS':[taskProcessTileDirectory + 'FullExtentLinesRasterizeDistance.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'AlphaBand.tif','OPTIONS': compressOptions})
-            
-            fullExtentVector = QgsVectorLayer(taskProcessTileDirectory + 'FullExtent.gpkg')
-            QgsProject.instance().addMapLayer(fullExtentVector, False)
-            QgsProject.instance().removeMapLayer(fullExtentVector.id())
-            fullExtentInVector = QgsVectorLayer(taskProcessTileDirectory + 'FullExtentIn.gpkg')
-            QgsProject.instance().addMapLayer(fullExtentInVector, False)
-            QgsProject.instance().removeMapLayer(fullExtentInVector.id())
-
-            """
-            ###########################################################################
-            Bring all the bands together
-            """
-            
-            print("Final value clipping and exporting...")
+#A single computer goes straight through the tile queue, otherwise tiles are claimed from the shared queue one at a time
+#While the other computers hold all that's left of the shared queue, an empty tile comes through now and then so the merges can be started
+def tileSource():
+    if nodeRole == 'single':
+        for scene, inImageTile in tileQueue:
+            yield scene, inImageTile, None
+    else:
+        for tileLease in TileQueue.claimJobs(sharedQueueDirectory, nodeName, leaseSeconds, maxTileAttempts):
+            if tileLease is None:
+                yield None, None, None
+                continue
+            if tileLease['failed']:
+                #The tile's lease kept running out (e.g it takes down the computer doing it), so it's confirmed as failed rather than handed out again
+                failedScene = tileLease['job']['scene']
+                failedTileName = TilePipeline.tileName(tileLease['job']['inImageTile'].replace('\\','/'))
+                confirmationText = open(failedScene['otherDirectory'] + 'ConfirmationFiles/' + failedTileName + "Confirmation.txt","w+")
+                confirmationText.write(failedTileName + ' failed. See debug.')
+                confirmationText.close()
+                debugText = open(failedScene['otherDirectory'] + failedScene['inImageName'] + "Debug.txt","a+")
+                debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": " + failedTileName + ' was given up on after its lease ran out on the last of its ' + str(maxTileAttempts) + ' attempts. \n')
+                debugText.close()
+                continue
+            tileLease['heartbeat'] = TileQueue.startHeartbeat(sharedQueueDirectory, tileLease, leaseSeconds)
+            yield tileLease['job']['scene'], tileLease['job']['inImageTile'], tileLease
+
+#The warm workers that aren't busy with a tile, each tile task hands its worker back once it's done
+freeWarmWorkers = queue.Queue()
+for warmWorkerPort in warmWorkerPorts:
+    freeWarmWorkers.put(warmWorkerPort)
+
+#Workers that have died or refused a connection aren't handed any more tiles
+deadWarmWorkers = set()
+
+#Send a whole tile to a warm worker, and note down how much of its time was overhead rather than processing
+def sendToWarmWorker(task, taskScene, taskInImageTile, taskInImageTileName, taskWarmWorkerPort):
+    try:
+        tileTimings = WarmWorker.sendTile(taskWarmWorkerPort, taskScene, taskInImageTile, warmWorkerAuthKey, warmWorkerTimeoutSeconds)
+    except WarmWorker.connectionErrors as e:
+        #The worker is gone, so drop it (None wakes the loop up in case it's waiting on the last worker) and do the tile here instead
+        deadWarmWorkers.add(taskWarmWorkerPort)
+        freeWarmWorkers.put(None)
+        print("The warm worker on port " + str(taskWarmWorkerPort) + " isn't answering, so " + taskInImageTileName + " will be done within QGIS")
+        debugText = open(taskScene['otherDirectory'] + taskScene['inImageName'] + "Debug.txt","a+")
+        debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": The warm worker on port " + str(taskWarmWorkerPort) + ' was dropped after ' + str(e) + ', ' + taskInImageTileName + ' was done within QGIS instead. \n')
+        debugText.close()
+        TilePipeline.processWholeTile(taskScene, taskInImageTile)
+        return
+    except BaseException:
+        #The tile failed on the worker but the worker itself is fine
+        freeWarmWorkers.put(taskWarmWorkerPort)
+        raise
+    freeWarmWorkers.put(taskWarmWorkerPort)
+    debugText = open(taskScene['otherDirectory'] + taskScene['inImageName'] + "Debug.txt","a+")
+    debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": " + taskInImageTileName + ' was done by the warm worker on port ' + str(taskWarmWorkerPort) + '. ' + WarmWorker.describeTimings(tileTimings) + '. \n')
+    debugText.close()
 
-            #Clip values to within 0 and 255
-            processing.run("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'AlphaBand.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':None,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':taskRasTileExtent,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'AlphaBandByte.tif'})
 
-            #Bring the bands together
-            processing.run("gdal:buildvirtualraster", {'INPUT':[taskProcessTileDirectory + 'Band1Diffed.tif',taskProcessTileDirectory + 'Band2Diffed.tif',taskProcessTileDirectory + 'Band3Diffed.tif',taskProcessTileDirectory + 'AlphaBandByte.tif'],'RESOLUTION':2,'SEPARATE':True,'PROJ_DIFFERENCE':True,'ADD_ALPHA':False,'ASSIGN_CRS':None,'RESAMPLING':0,'SRC_NODATA':'','EXTRA':'','OUTPUT':taskProcessTileDirectory + 'Band123A.vrt'})
+"""
+####################################################################
+Starting up the for-loop...
+"""
 
-            #Determine where must be clipped to, given the bigger pixels won't line up with the smaller pixels
-            processing.run("native:polygonfromlayerextent", {'INPUT':taskProcessTileDirectory + 'ReducedResRed.tif','ROUND_TO':0,'OUTPUT':taskProcessTileDirectory + 'ReducedResExtent.gpkg'})
-            processing.run("native:buffer", {'INPUT':taskProcessTileDirectory + 'ReducedResExtent.gpkg','DISTANCE':(pixelSizeBig + (pixelSizeAve * 0.8)) * -1,'SEGMENTS':5,'END_CAP_STYLE':0,'JOIN_STYLE':0,'MITER_LIMIT':2,'DISSOLVE':False,'OUTPUT':taskProcessTileDirectory + 'ReducedResExtentIn.gpkg'})
-         
-            
-            #Clip to vrt to export a final tif
-            processing.run("gdal:cliprasterbymasklayer", {'INPUT':taskProcessTileDirectory + 'Band123A.vrt','MASK':taskProcessTileDirectory + 'FullExtentIn.gpkg','SOURCE_CRS':None,'TARGET_CRS':None,'NODATA':None,
-            'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,'KEEP_RESOLUTION':False,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':True,'OPTIONS':finalCompressOptions,'DATA_TYPE':1,
-            'EXTRA':'-co \"PHOTOMETRIC=RGB\" -srcalpha -dstalpha ' + gdalOptions,'OUTPUT':outImageDir + taskInImageTileName + 'ClippedFinalTile' + settingsSuffix + '.tif'})
-            print("Final tile export done")
-            
-            """
-            ###########################################################################
-            Debug writing and temp file clean up
-            """
-            
-            #Make sure that there aren't too many processes piling up
-            debugText = open(otherDirectory + inImageName + "Debug.txt","a+")
-            debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": Ok " + taskInImageTileName + ' is done. Currently there are ' + str(QgsApplication.taskManager().countActiveTasks()) + ' tasks running. Free memory is ' + str(round(psutil.virtual_memory().free / 1000000000,1)) + 'gb. \n')
-            debugText.close()
-            
-            #Clean up the files so we don't run out of hard drive space
-            time.sleep(0.1)
-            processFiles = glob.glob(taskProcessTileDirectory + '*')
-            for f in processFiles:
-                try:
-                    os.remove(f)
-                except BaseException as e:
-                    e = e
-                    
-            confirmationText = open(otherDirectory + 'ConfirmationFiles/' + taskInImageTileName + "Confirmation.txt","w+")
-            confirmationText.write(inImageTileName + ' confirmed complete')
-            confirmationText.close()    
+#Let's process each of the images one by one
+runNumber = 0
+for scene, inImageTile, tileLease in tileSource():
+    #Nothing to claim right now, so just check on the merges
+    if scene is None:
+        startFinishedMerges()
+        continue
+    try:
+        
+        #Pick up the settings for the scene this tile belongs to
+        inImageName = scene['inImageName']
+        otherDirectory = scene['otherDirectory']
+        
+        runNumber = runNumber + 1
+        inImageTile = inImageTile.replace('\\','/')
+        #Set up the layer name for the raster calculations
+        inImageTileName = TilePipeline.tileName(inImageTile)
+        
+        #A warm worker takes the whole tile, so wait for one to be free and hand it over, unless they've all been dropped
+        warmWorkerPort = None
+        while warmWorkerPort is None and len(deadWarmWorkers) < len(warmWorkerPorts):
+            warmWorkerPort = freeWarmWorkers.get()
+        if warmWorkerPort is not None:
+            print("Sending " + inImageTileName + " to the warm worker on port " + str(warmWorkerPort))
+            warmWorkerTask = QgsTask.fromFunction(inImageTile + 'WarmWorker', processTileTask, sendToWarmWorker, tileLease, scene, inImageTile, inImageTileName, warmWorkerPort)
+            QgsApplication.taskManager().addTask(warmWorkerTask)
+            startFinishedMerges()
+            continue
+        
+        processTileDirectory, rasTileExtent = TilePipeline.prepareTile(scene, inImageTile)
+        
+        #The grass part runs here, then the rest of the tile is handed to a task
+        TilePipeline.sharpenTile(scene, processTileDirectory, inImageTile, rasTileExtent)
         
         """
         #######################################################################
@@ -711,7 +909,7 @@ for inImageTile in inImageTileFiles:
 
         print("About to run the task for " + inImageTileName)
         #Assign the functions to a Qgs task and run
-        beyondGrassTask = QgsTask.fromFunction(inImageTile + 'FirstOne', processEachList, processTileDirectory, inImageTileName, inImageTile, rasTileExtent)
+        beyondGrassTask = QgsTask.fromFunction(inImageTile + 'FirstOne', processTileTask, TilePipeline.applyDifferences, tileLease, scene, processTileDirectory, inImageTileName, inImageTile, rasTileExtent)
         
         #Make sure that it is not until the final run through of the loop that next part of the process runs
         QgsApplication.taskManager().addTask(beyondGrassTask)
@@ -720,84 +918,50 @@ for inImageTile in inImageTileFiles:
         print("Bro it failed " + inImageTileName)
         print(e)
         
-        confirmationText = open(otherDirectory + 'ConfirmationFiles/' + inImageTileName + "Confirmation.txt","w+")
-        confirmationText.write(inImageTileName + ' failed. See debug.')
-        confirmationText.close()
+        #On a shared queue the tile is handed back out until it has used up its attempts
+        if tileLease is not None:
+            tileLease['heartbeat'].set()
+        if tileLease is None or not TileQueue.failJob(sharedQueueDirectory, tileLease, e, maxTileAttempts):
+            confirmationText = open(otherDirectory + 'ConfirmationFiles/' + inImageTileName + "Confirmation.txt","w+")
+            confirmationText.write(inImageTileName + ' failed. See debug.')
+            confirmationText.close()
         
         debugText = open(otherDirectory + inImageName + "Debug.txt","a+")
         debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": So " + inImageTileName + ' failed to process. Error message is ' + str(e) + '. Currently there are ' + str(QgsApplication.taskManager().countActiveTasks()) + ' tasks running. Free memory is ' + str(round(psutil.virtual_memory().free / 1000000000,1)) + 'gb. \n')
         debugText.close()
 
-    
+    #Merge any scenes that have finished while the queue keeps going
+    startFinishedMerges()
+
+
 """
 #######################################################################
-Once all tiles are processed, they can be brought together
+Wait for every scene to be merged
 """
 
-#This makes sure that the cmd process doesn't take off before the tiles are ready    
-print("Ok lets make sure the tasks (" + str(QgsApplication.taskManager().countActiveTasks()) + ") have finished before doing the final merge")
+#This makes sure the script doesn't finish up before the merges don't take off before the tiles are ready    
+print("Ok lets make sure the tasks (" + str(QgsApplication.taskManager().countActiveTasks()) + ") have finished before doing the final merges")
 
-numberOfTilesDone = 0
-while numberOfTilesDone < len(inImageTileFiles):
-    confirmationFiles = glob.glob(otherDirectory + 'ConfirmationFiles/' + '*.txt')
-    numberOfTilesDone = len(confirmationFiles)
-    debugText = open(otherDirectory + inImageName + "Debug.txt","a+")
-    debugText.write(str(numberOfTilesDone) + ' tiles done. ' + str(len(inImageTileFiles)) + ' total tiles. The time is ' + datetime.now().strftime("%Y%m%d %H%M%S") + '. ')
-    debugText.close()
+while not all([scene['mergeDone'] for scene in scenes]):
+    startFinishedMerges()
+    for scene in scenes:
+        if not scene['mergeStarted']:
+            numberOfTilesDone = len(glob.glob(scene['otherDirectory'] + 'ConfirmationFiles/' + '*.txt'))
+            debugText = open(scene['otherDirectory'] + scene['inImageName'] + "Debug.txt","a+")
+            debugText.write(str(numberOfTilesDone) + ' tiles done. ' + str(scene['tileCount']) + ' total tiles. The time is ' + datetime.now().strftime("%Y%m%d %H%M%S") + '. ')
+            debugText.close()
     
     time.sleep(5)
-    
-    
-
-print("Ok so there are still " + str(QgsApplication.taskManager().countActiveTasks()) + " tasks running before the merge")
-
-
-#Prepare to make a final mosaic where the alpha bands are respected, this is a string being prepped for cmd
-mosaicInString = ''
-outImageDir = outImageDir.replace("/", "\\")
-
-#Make the final image directory
-finalImageDir = finalImageDir.replace("/", "\\")
-if not os.path.exists(finalImageDir):os.mkdir(finalImageDir)
-
-#Prepare variables for the final merging in GDAL
-fullExtentForCutline = processDirectory + inImageName + 'ExtentFixFilt.gpkg'
-fullExtentForCutline = fullExtentForCutline.replace("/", "\\")
-finalOutputImageName = outImageName + datetime.now().strftime("%Y%m%d%H%M") 
-finalOutputImage = finalImageDir + finalOutputImageName + '.tif'
 
-#Run gdal through cmd using syntax that it likes (the gdal exe is in cd C:\Program Files\QGIS 3.16\bin)
-gdalOptionsFinal = '-co COMPRESS=LZW -co PREDICTOR=2 -co NUM_THREADS=ALL_CPUS -co BIGTIFF=IF_SAFER -co TILED=YES -multi --config GDAL_NUM_THREADS ALL_CPUS -wo NUM_THREADS=ALL_CPUS -overwrite'
-cmd = 'gdalwarp -of GTiff ' + gdalOptionsFinal + ' -crop_to_cutline -cutline "' + fullExtentForCutline + '" "' + outImageDir + '**.tif" "' + finalOutputImage + '" & timeout 3'
-print("Watch the cmd window")
-os.system(cmd)
-
-
-"""
-##########################################################################
-Histograms can be used to inform on how much value clipping is going on
-"""
-
-#This is run and left as a separate process as it's an optional extra amount of information to the final tif
-def finalWork(task, taskFinalOutputImage):
-    try:
-        #Histogram calculations by reducing resolution then analysing each band
-        processing.run("gdal:warpreproject", {'INPUT':taskFinalOutputImage,'SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':-1,'TARGET_RESOLUTION':pixelSizeAve * 100,'OPTIONS':compressOptions,'DATA_TYPE':2,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':'','OUTPUT':processDirectory + 'ReducedResForHisto.tif'})
+#Let the user know about any scene that didn't make it through its merge
+failedMerges = [scene['inImageName'] for scene in scenes if scene['mergeFailed']]
+if len(failedMerges) > 0:
+    print("The merges of " + ', '.join(failedMerges) + " failed, see their debug files")
 
-        processing.run("qgis:rasterlayerhistogram", {'INPUT':processDirectory + 'ReducedResForHisto.tif','BAND':1,'BINS':256,'OUTPUT':finalImageDir + finalOutputImageName + 'FinalHistoRed.html'})
-        processing.run("qgis:rasterlayerhistogram", {'INPUT':processDirectory + 'ReducedResForHisto.tif','BAND':2,'BINS':256,'OUTPUT':finalImageDir + finalOutputImageName + 'FinalHistoGreen.html'})
-        processing.run("qgis:rasterlayerhistogram", {'INPUT':processDirectory + 'ReducedResForHisto.tif','BAND':3,'BINS':256,'OUTPUT':finalImageDir + finalOutputImageName + 'FinalHistoBlue.html'})
-        
-        #Creating a small thumbnail so that you know the extent from windows explorer
-        processing.run("gdal:warpreproject", {'INPUT':processDirectory + 'ReducedResForHisto.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve * 100,'OPTIONS':finalCompressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':'','OUTPUT':finalImageDir + finalOutputImageName + 'Thumbnail.tif'})
-        
-        #Building pyramid layers so that you can browse easily
-        processing.run("gdal:overviews", {'INPUT':taskFinalOutputImage,'CLEAN':False,'LEVELS':'','RESAMPLING':0,'FORMAT':1,'EXTRA':'--config COMPRESS_OVERVIEW JPEG'})
-    except BaseException as e:
-        print (e)
+#Let the run lapse, so any worker started from here on waits for the next one
+if nodeRole == 'coordinator':
+    stopQueueRun.set()
 
-finalTask = QgsTask.fromFunction('FinalWork', finalWork, finalOutputImage)
-QgsApplication.taskManager().addTask(finalTask)
 
 """
 #########################################################################
@@ -811,5 +975,4 @@ print("The final tasks (making a thumbnail, histogram and pyramids) will continu
 
 """
 #######################################################################
-"""
-
+"""
\ No newline at end of file
@@ -0,0 +1,392 @@
+import numpy, psutil, os, glob, time
+from qgis.core import QgsApplication, QgsRasterLayer, QgsVectorLayer, QgsProject
+from datetime import datetime
+import processing
+import ContrastKernels
+
+
+"""
+##########################################################
+Running the algorithms, either straight through processing or through a warm worker's cached runner
+"""
+
+#WarmWorker.py swaps these for its own, which keep the algorithms and processing context alive between calls
+algorithmRunner = None
+layerReleaser = None
+
+def runAlgorithm(algorithmId, parameters):
+    if algorithmRunner is not None:
+        return algorithmRunner(algorithmId, parameters)
+    return processing.run(algorithmId, parameters)
+
+def releaseLayers():
+    if layerReleaser is not None:
+        layerReleaser()
+
+
+"""
+##########################################################
+Setting up a tile
+"""
+
+def tileName(inImageTile):
+    return inImageTile.replace('\\','/').split("/")[-1].split(".")[0]
+
+#Make an empty processing folder for the tile, and grab its extent
+def prepareTile(scene, inImageTile):
+    inImageTileName = tileName(inImageTile)
+    
+    rasTile = QgsRasterLayer(inImageTile)
+    rasTileExtent = rasTile.extent()
+
+    #Make sure that the processing folder exists
+    processTileDirectory = scene['inImageTileDir'] + 'Processing/' + inImageTileName + '/'
+    try:
+        os.mkdir(processTileDirectory)
+    except:
+        boundsFiles = glob.glob(processTileDirectory + '*')
+        for f in boundsFiles:
+            os.remove(f)
+
+    #Clear out the folder
+    files = glob.glob(processTileDirectory + '*')
+    try:
+        for f in files:
+            os.remove(f)
+    except BaseException as e:
+        print("Bro we couldn't clear the files " + inImageTileName)
+        print(e)
+    
+    return processTileDirectory, rasTileExtent
+
+
+"""
+##########################################################
+The grass heavy part of a tile, run on the main thread when inside QGIS
+"""
+
+def sharpenTile(scene, processTileDirectory, inImageTile, rasTileExtent):
+    
+    pixelSizeAve = scene['pixelSizeAve']
+    pixelSizeBig = scene['pixelSizeBig']
+    shadowDiameter = scene['shadowDiameter']
+    shadowBoostFactor = scene['shadowBoostFactor']
+    scaleDiameters = scene['scaleDiameters']
+    scaleSuffixes = scene['scaleSuffixes']
+    compressOptions = scene['compressOptions']
+    gdalOptions = scene['gdalOptions']
+
+    #The per pixel formulas run through the kernels, unless the raster calculator has been asked for
+    useCalculator = scene['kernelBackend'] == 'calculator'
+    kernelBackend = 'numpy' if useCalculator else scene['kernelBackend']
+    
+    """
+    ###########################################################################
+    Setting it up for the bigger processing
+    """
+
+    print("Initial processing")
+
+    #Combine the bands to determine a total brightness
+    if useCalculator:
+        runAlgorithm("gdal:rastercalculator", {'INPUT_A': inImageTile ,'BAND_A':1,'INPUT_B':inImageTile,'BAND_B':2,'INPUT_C':inImageTile,'BAND_C':3,'INPUT_D':inImageTile,'BAND_D':4,'FORMULA':'(D>128)*(((A.astype(numpy.float64))+(B.astype(numpy.float64))+(C.astype(numpy.float64)))/3)+((D < 129)*(-1))','RTYPE':1,'NO_DATA':-1,'OPTIONS':compressOptions,'EXTRA':'','OUTPUT':processTileDirectory + 'CombinedBands.tif'})
+    else:
+        ContrastKernels.combinedBandsStage(inImageTile, processTileDirectory + 'CombinedBands.tif', compressOptions, kernelBackend)
+
+    #Reduce res for quicker processing
+    runAlgorithm("gdal:translate", {'INPUT':inImageTile,'TARGET_CRS':None,'NODATA':None,'COPY_SUBDATASETS':False,'OPTIONS':compressOptions,'EXTRA':'-r cubic -tr ' + str(pixelSizeBig) + ' ' + str(pixelSizeBig) + ' -b 1','DATA_TYPE':0,'OUTPUT':processTileDirectory + 'ReducedResRed.tif'})
+    runAlgorithm("gdal:translate", {'INPUT':inImageTile,'TARGET_CRS':None,'NODATA':None,'COPY_SUBDATASETS':False,'OPTIONS':compressOptions,'EXTRA':'-r cubic -tr ' + str(pixelSizeBig) + ' ' + str(pixelSizeBig) + ' -b 2','DATA_TYPE':0,'OUTPUT':processTileDirectory + 'ReducedResGreen.tif'})
+    runAlgorithm("gdal:translate", {'INPUT':inImageTile,'TARGET_CRS':None,'NODATA':None,'COPY_SUBDATASETS':False,'OPTIONS':compressOptions,'EXTRA':'-r cubic -tr ' + str(pixelSizeBig) + ' ' + str(pixelSizeBig) + ' -b 3','DATA_TYPE':0,'OUTPUT':processTileDirectory + 'ReducedResBlue.tif'})
+
+    #Calculate the minimum and maximum among all bands
+    runAlgorithm("grass7:r.series", {'input':[processTileDirectory + 'ReducedResBlue.tif',processTileDirectory + 'ReducedResGreen.tif',processTileDirectory + 'ReducedResRed.tif'],'-n':True,'method':[4],'quantile':'','weights':'','output':processTileDirectory + 'TrueMinimum.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+    runAlgorithm("grass7:r.series", {'input':[processTileDirectory + 'ReducedResBlue.tif',processTileDirectory + 'ReducedResGreen.tif',processTileDirectory + 'ReducedResRed.tif'],'-n':True,'method':[6],'quantile':'','weights':'','output':processTileDirectory + 'TrueMaximum.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+
+    #Reduce the resolution for the combined bands, bilinear and the scale parameters are used to prevent values from being 0, which causes glitches in grass tools
+    runAlgorithm("gdal:translate", {'INPUT':processTileDirectory + 'CombinedBands.tif','TARGET_CRS':None,'NODATA':None,'COPY_SUBDATASETS':False,'OPTIONS':compressOptions,'EXTRA':'-r bilinear -tr ' + str(pixelSizeBig) + ' ' + str(pixelSizeBig) + ' -b 1 -scale 0 255 1 255','DATA_TYPE':0,'OUTPUT':processTileDirectory + 'ReducedResCombined.tif'})
+
+
+    """
+    ##########################################################################
+    Find the shadowed areas for later correction
+    """
+
+    #Shadow area A
+    #Grab pixels that are very dark
+    runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'8/(1+1.15^(\"ReducedResCombined@1\"-30))','LAYERS':[processTileDirectory + 'ReducedResCombined.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceA.tif'})
+    #Determine where the bigger areas are
+    runAlgorithm("grass7:r.neighbors", {'input':processTileDirectory + 'ShadowChanceA.tif','selection':processTileDirectory + 'ShadowChanceA.tif','method':15,'size':shadowDiameter - 2,'gauss':None,'quantile':'0.10','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'ShadowChanceASmooth.tif','nprocs':8,'GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+    #Confirming the bigger shadow parts
+    runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'(\"ShadowChanceA@1\"^0.2)  *  (\"ShadowChanceASmooth@1\" ^ 0.7)','LAYERS':[processTileDirectory + 'ShadowChanceASmooth.tif',processTileDirectory + 'ShadowChanceA.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceAMultiply.tif'})
+    #Give approval for the shadow area B to spread 
+    runAlgorithm("grass7:r.neighbors", {'input':processTileDirectory + 'ShadowChanceAMultiply.tif','selection':processTileDirectory + 'ShadowChanceAMultiply.tif','method':0,'size':shadowDiameter,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'ShadowChanceAMultiplyApproval.tif','nprocs':8,'GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+
+    #Shadow area B
+    #Grab pixels that are fairly dark
+    runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'8/(1+1.15^(\"ReducedResCombined@1\"-52))','LAYERS':[processTileDirectory + 'ReducedResCombined.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceB.tif'})
+    #Determine where the bigger areas are
+    runAlgorithm("grass7:r.neighbors", {'input':processTileDirectory + 'ShadowChanceB.tif','selection':processTileDirectory + 'ShadowChanceB.tif','method':15,'size':shadowDiameter,'gauss':None,'quantile':'0.28','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'ShadowChanceBSmooth.tif','nprocs':8,'GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+    #Confirming the bigger shadow parts as approved by shadow area A
+    runAlgorithm("qgis:rastercalculator",{'EXPRESSION':'(\"ShadowChanceB@1\"^0.2)  *  (\"ShadowChanceBSmooth@1\" ^ 0.6) * ((\"ShadowChanceAMultiplyApproval@1\" ^ 0.5) + 0.1)','LAYERS':[processTileDirectory + 'ShadowChanceBSmooth.tif',processTileDirectory + 'ShadowChanceB.tif',processTileDirectory + 'ShadowChanceAMultiplyApproval.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceBMultiply.tif'})
+    #Give approval for the shadow area C to spread 
+    runAlgorithm("grass7:r.neighbors", {'input':processTileDirectory + 'ShadowChanceBMultiply.tif','selection':processTileDirectory + 'ShadowChanceBMultiply.tif','method':15,'size':shadowDiameter + 2,'gauss':None,'quantile':'0.92','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'ShadowChanceBMultiplyApproval.tif','nprocs':8,'GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+
+    #Shadow area C
+    #Grab pixels that are somewhat dark
+    runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'8/(1+1.15^(\"ReducedResCombined@1\"-85))','LAYERS':[processTileDirectory + 'ReducedResCombined.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceC.tif'})
+    #Determine where the bigger areas are
+    runAlgorithm("grass7:r.neighbors", {'input':processTileDirectory + 'ShadowChanceC.tif','selection':processTileDirectory + 'ShadowChanceC.tif','method':15,'size':shadowDiameter,'gauss':None,'quantile':'0.4','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'ShadowChanceCSmooth.tif','nprocs':8,'GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+    #Confirming the bigger shadow parts as approved by shadow area B
+    runAlgorithm("qgis:rastercalculator",{'EXPRESSION':'(\"ShadowChanceC@1\"^0.2)  *  (\"ShadowChanceCSmooth@1\" ^ 0.6) * ((\"ShadowChanceBMultiplyApproval@1\" ^ 0.6)) * ' + str(shadowBoostFactor),'LAYERS':[processTileDirectory + 'ShadowChanceCSmooth.tif',processTileDirectory + 'ShadowChanceC.tif',processTileDirectory + 'ShadowChanceBMultiplyApproval.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':processTileDirectory + 'ShadowChanceCMultiply.tif'})
+    #Bring out to full res
+    runAlgorithm("gdal:warpreproject", {'INPUT':processTileDirectory + 'ShadowChanceCMultiply.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':rasTileExtent,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':processTileDirectory + 'ShadowBoostFinal.tif'})
+
+
+    """
+    ##########################################################################
+    Determining the local minimum and maximum for each of the contrast scales
+    """
+
+    print("Speed up factor engaged")
+    print("(Increase the speed up factor if this part takes too long)")
+
+
+    #Build one multi-radius min/max index for the tile, then each scale only needs a cheap lookup rather than its own neighbourhood pass
+    combinedValues = ContrastKernels.readBand(processTileDirectory + 'ReducedResCombined.tif')
+    minMaxIndex = ContrastKernels.buildMinMaxIndex(combinedValues, max(scaleDiameters))
+    for scaleDiameter, scaleSuffix in zip(scaleDiameters, scaleSuffixes):
+        maximumCombined = ContrastKernels.circularMaximum(minMaxIndex, scaleDiameter, kernelBackend)
+        minimumCombined = ContrastKernels.circularMinimum(minMaxIndex, scaleDiameter, kernelBackend)
+        maximumCombined[numpy.isnan(combinedValues)] = numpy.nan
+        minimumCombined[numpy.isnan(combinedValues)] = numpy.nan
+        ContrastKernels.writeBandLike(maximumCombined, processTileDirectory + 'ReducedResCombined.tif', processTileDirectory + 'MaximumCombined' + scaleSuffix + '.tif', compressOptions)
+        ContrastKernels.writeBandLike(minimumCombined, processTileDirectory + 'ReducedResCombined.tif', processTileDirectory + 'MinimumCombined' + scaleSuffix + '.tif', compressOptions)
+    minMaxIndex = None
+
+    #Smooth off those hard edges
+    for scaleDiameter, scaleSuffix in zip(scaleDiameters, scaleSuffixes):
+        runAlgorithm("grass7:r.neighbors", {'input':processTileDirectory + 'MaximumCombined' + scaleSuffix + '.tif','selection':processTileDirectory + 'MinimumCombined' + scaleSuffix + '.tif','method':0,'size':scaleDiameter,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'MaximumSmooth' + scaleSuffix + '.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+        runAlgorithm("grass7:r.neighbors", {'input':processTileDirectory + 'MinimumCombined' + scaleSuffix + '.tif','selection':processTileDirectory + 'MinimumCombined' + scaleSuffix + '.tif','method':0,'size':scaleDiameter,'gauss':None,'quantile':'','-c':True,'-a':False,'weight':'','output':processTileDirectory + 'MinimumSmooth' + scaleSuffix + '.tif','GRASS_REGION_PARAMETER':None,'GRASS_REGION_CELLSIZE_PARAMETER':0,'GRASS_RASTER_FORMAT_OPT':'','GRASS_RASTER_FORMAT_META':''})
+
+
+"""
+##########################################################
+The non-grass part of a tile, which can run as a task
+"""
+
+def applyDifferences(task, taskScene, taskProcessTileDirectory, taskInImageTileName, taskInImageTile, taskRasTileExtent):
+
+    #The task can run after the loop has moved on to another scene, so everything comes from its own scene
+    inImageName = taskScene['inImageName']
+    otherDirectory = taskScene['otherDirectory']
+    outImageDir = taskScene['outImageDir']
+    pixelSizeX = taskScene['pixelSizeX']
+    pixelSizeY = taskScene['pixelSizeY']
+    pixelSizeAve = taskScene['pixelSizeAve']
+    pixelSizeBig = taskScene['pixelSizeBig']
+    scaleSuffixes = taskScene['scaleSuffixes']
+    toneShiftFactor = taskScene['toneShiftFactor']
+    settingsSuffix = taskScene['settingsSuffix']
+    capDenominator = taskScene['capDenominator']
+    capMinusFactor = taskScene['capMinusFactor']
+    capSubtraction = taskScene['capSubtraction']
+    compressOptions = taskScene['compressOptions']
+    finalCompressOptions = taskScene['finalCompressOptions']
+    gdalOptions = taskScene['gdalOptions']
+    useCalculator = taskScene['kernelBackend'] == 'calculator'
+    kernelBackend = 'numpy' if useCalculator else taskScene['kernelBackend']
+
+    print("Applying the differences for" + taskInImageTile)
+    print("Process dir" + taskProcessTileDirectory)
+
+
+    for scaleNumber, scaleSuffix in enumerate(scaleSuffixes):
+
+        #Scale the amount that the midtone is allowed to be moved, then use the min and max to calculate range and midrange
+        if useCalculator:
+            runAlgorithm("qgis:rastercalculator", {'EXPRESSION':' \"MinimumSmooth' + scaleSuffix + '@1\" ^ ' + str(toneShiftFactor),'LAYERS':[taskProcessTileDirectory + 'MinimumSmooth' + scaleSuffix + '.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'MinimumSmoothScaled' + scaleSuffix + '.tif'})
+            runAlgorithm("qgis:rastercalculator", {'EXPRESSION':' (((abs(\"MaximumSmooth' + scaleSuffix + '@1\"-255))^ '+ str(toneShiftFactor)+ ')*-1)+255 ' ,'LAYERS':[taskProcessTileDirectory + 'MaximumSmooth' + scaleSuffix + '.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'MaximumSmoothScaled' + scaleSuffix + '.tif'})
+            runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'\"MaximumSmoothScaled' + scaleSuffix + '@1\" - \"MinimumSmoothScaled' + scaleSuffix + '@1\"','LAYERS':[taskProcessTileDirectory + 'MaximumSmoothScaled' + scaleSuffix + '.tif',taskProcessTileDirectory + 'MinimumSmoothScaled' + scaleSuffix + '.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'Range' + scaleSuffix + '.tif'})
+            runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'(\"MaximumSmoothScaled' + scaleSuffix + '@1\" + \"MinimumSmoothScaled' + scaleSuffix + '@1\")/2','LAYERS':[taskProcessTileDirectory + 'MaximumSmoothScaled' + scaleSuffix + '.tif',taskProcessTileDirectory + 'MinimumSmoothScaled' + scaleSuffix + '.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'Midrange' + scaleSuffix + '.tif'})
+        else:
+            ContrastKernels.rangeMidrangeStage(taskProcessTileDirectory + 'MinimumSmooth' + scaleSuffix + '.tif', taskProcessTileDirectory + 'MaximumSmooth' + scaleSuffix + '.tif', toneShiftFactor, taskProcessTileDirectory + 'Range' + scaleSuffix + '.tif', taskProcessTileDirectory + 'Midrange' + scaleSuffix + '.tif', compressOptions, kernelBackend)
+
+        #Bring the res back out to full
+        runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'Range' + scaleSuffix + '.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':0,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'RangeResamp' + scaleSuffix + '.tif'})
+        runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'Midrange' + scaleSuffix + '.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':0,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'MidrangeResamp' + scaleSuffix + '.tif'})
+
+        #Look for potential clipping, the full radius gets a wider spread of clipping prevention than the smaller ones
+        clipExpandFactor = 4 if scaleNumber == 0 else 2
+        if useCalculator:
+            runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'(\"TrueMaximum@1\" - \"Midrange' + scaleSuffix + '@1\")*((255/(\"Range' + scaleSuffix + '@1\"+1)))-128','LAYERS':[taskProcessTileDirectory + 'TrueMaximum.tif',taskProcessTileDirectory + 'Midrange' + scaleSuffix + '.tif',taskProcessTileDirectory + 'Range' + scaleSuffix + '.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'WhiteClip' + scaleSuffix + '.tif','OPTIONS':compressOptions})
+            runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'-(\"TrueMinimum@1\" - \"Midrange' + scaleSuffix + '@1\")*((255/(\"Range' + scaleSuffix + '@1\"+1)))-128','LAYERS':[taskProcessTileDirectory + 'TrueMinimum.tif',taskProcessTileDirectory + 'Midrange' + scaleSuffix + '.tif',taskProcessTileDirectory + 'Range' + scaleSuffix + '.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'BlackClip' + scaleSuffix + '.tif','OPTIONS':compressOptions})
+        else:
+            ContrastKernels.clipAmountStage(taskProcessTileDirectory + 'TrueMaximum.tif', taskProcessTileDirectory + 'Midrange' + scaleSuffix + '.tif', taskProcessTileDirectory + 'Range' + scaleSuffix + '.tif', 1, taskProcessTileDirectory + 'WhiteClip' + scaleSuffix + '.tif', compressOptions, kernelBackend)
+            ContrastKernels.clipAmountStage(taskProcessTileDirectory + 'TrueMinimum.tif', taskProcessTileDirectory + 'Midrange' + scaleSuffix + '.tif', taskProcessTileDirectory + 'Range' + scaleSuffix + '.tif', -1, taskProcessTileDirectory + 'BlackClip' + scaleSuffix + '.tif', compressOptions, kernelBackend)
+        runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'WhiteClip' + scaleSuffix + '.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':None,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'WhiteClipByte' + scaleSuffix + '.tif'})
+        runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'BlackClip' + scaleSuffix + '.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':None,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'BlackClipByte' + scaleSuffix + '.tif'})
+        runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'WhiteClipByte' + scaleSuffix + '.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':7,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig * clipExpandFactor,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'WhiteClipByteExpand' + scaleSuffix + '.tif'})
+        runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'BlackClipByte' + scaleSuffix + '.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':7,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig * clipExpandFactor,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'BlackClipByteExpand' + scaleSuffix + '.tif'})
+        runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'WhiteClipByteExpand' + scaleSuffix + '.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'WhiteClipByteExpandSmooth' + scaleSuffix + '.tif'})
+        runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'BlackClipByteExpand' + scaleSuffix + '.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeBig,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':None,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'BlackClipByteExpandSmooth' + scaleSuffix + '.tif'})
+
+        #Use the determined formula to figure out what difference needs to be applied to the pixels to stretch them to 0-255
+        #0.80 is a factor to increase the effect of the full radius and decrease the effect of the smallest radius
+        if scaleNumber == 0:
+            scaleWeighting = ' / 0.80'
+            scaleWeight = 1 / 0.80
+        elif scaleNumber == len(scaleSuffixes) - 1:
+            scaleWeighting = ' * 0.80'
+            scaleWeight = 0.80
+        else:
+            scaleWeighting = ''
+            scaleWeight = 1
+        if useCalculator:
+            runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'((\"CombinedBands@1\" - \"MidrangeResamp' + scaleSuffix + '@1\")*((255/(\"RangeResamp' + scaleSuffix + '@1\"+1)))+128 - \"CombinedBands@1\")' + scaleWeighting,'LAYERS':[taskProcessTileDirectory + 'CombinedBands.tif',taskProcessTileDirectory + 'MidrangeResamp' + scaleSuffix + '.tif',taskProcessTileDirectory + 'RangeResamp' + scaleSuffix + '.tif'],'CELLSIZE':0,'EXTENT':taskRasTileExtent,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'DifferenceToApply' + scaleSuffix + '.tif','OPTIONS': compressOptions})
+        else:
+            ContrastKernels.differenceToApplyStage(taskProcessTileDirectory + 'CombinedBands.tif', taskProcessTileDirectory + 'MidrangeResamp' + scaleSuffix + '.tif', taskProcessTileDirectory + 'RangeResamp' + scaleSuffix + '.tif', scaleWeight, taskProcessTileDirectory + 'DifferenceToApply' + scaleSuffix + '.tif', compressOptions, kernelBackend)
+
+    print("Speed up factor disengaging")
+
+
+    """
+    ###########################################################################
+    Bring together the pixel shift amounts for each of the radii and apply them to the original bands
+    """
+
+    #z=(x+y)*((1)/(abs(x-y)+abs(x+y))) abs(x+y)
+    #The above formula is a three dimensional function that combines values such that there is a penalty for disagreeance 
+    #Since abs(x-y)+abs(x+y) is twice the larger of abs(x) and abs(y), it carries over to any number of scales as mean * abs(sum) / (count * largest abs)
+    if useCalculator:
+        scaleLetters = ['A','B','C','D','E','F'][:len(scaleSuffixes)]
+        scaleSum = '(' + '+'.join([letter + '.astype(numpy.float64)' for letter in scaleLetters]) + ')'
+        scaleLargestAbs = 'numpy.maximum.reduce([' + ','.join(['numpy.abs(' + letter + '.astype(numpy.float64))' for letter in scaleLetters]) + '])'
+        combineParameters = {'FORMULA':'(' + scaleSum + '/' + str(len(scaleLetters)) + ') * numpy.abs(' + scaleSum + ') / numpy.maximum(' + str(len(scaleLetters)) + ' * ' + scaleLargestAbs + ', 0.0001)','RTYPE':5,'NO_DATA':None,'OPTIONS':compressOptions,'EXTRA':'','OUTPUT':taskProcessTileDirectory + 'CombinedDifference.tif'}
+        for letter, scaleSuffix in zip(scaleLetters, scaleSuffixes):
+            combineParameters['INPUT_' + letter] = taskProcessTileDirectory + 'DifferenceToApply' + scaleSuffix + '.tif'
+            combineParameters['BAND_' + letter] = 1
+        runAlgorithm("gdal:rastercalculator", combineParameters)
+
+        #Scale the differencing amounts back as per the formula to cap extreme values
+        runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'(' + str(capDenominator) + '/ ( 1 + (1 - ' + str(capMinusFactor) + ' ) ^ ( \"CombinedDifference@1\" ) ) ) - ' + str(capSubtraction),'LAYERS':[taskInImageTile,taskProcessTileDirectory + 'CombinedDifference.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'ScaledBackDifference.tif','OPTIONS': compressOptions})
+    else:
+        #The kernel does the blend and the cap in one go, so there's no CombinedDifference in between
+        ContrastKernels.combineAndCapStage([taskProcessTileDirectory + 'DifferenceToApply' + scaleSuffix + '.tif' for scaleSuffix in scaleSuffixes], capDenominator, capMinusFactor, capSubtraction, taskProcessTileDirectory + 'ScaledBackDifference.tif', compressOptions, kernelBackend)
+
+
+
+    #Calculate how much to pull back the pixels from clipping, scaled so that adding scales doesn't add extra pull back
+    if useCalculator:
+        whiteClipSum = ' + '.join(['(\"WhiteClipByteExpandSmooth' + scaleSuffix + '@1\" ^ 0.5)' for scaleSuffix in scaleSuffixes])
+        blackClipSum = ' + '.join(['(\"BlackClipByteExpandSmooth' + scaleSuffix + '@1\" ^ 0.5)' for scaleSuffix in scaleSuffixes])
+        clipScaling = str(2 / len(scaleSuffixes))
+        runAlgorithm("qgis:rastercalculator", {'EXPRESSION':' ( 1.004 ^(( ' + whiteClipSum + ' ) * ' + clipScaling + ')) - 1','LAYERS':[taskProcessTileDirectory + 'WhiteClipByteExpandSmooth' + scaleSuffix + '.tif' for scaleSuffix in scaleSuffixes],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'WhiteClipFactor.tif','OPTIONS':compressOptions})
+        runAlgorithm("qgis:rastercalculator", {'EXPRESSION':' ( 1.004 ^(( ' + blackClipSum + ' ) * ' + clipScaling + ')) - 1','LAYERS':[taskProcessTileDirectory + 'BlackClipByteExpandSmooth' + scaleSuffix + '.tif' for scaleSuffix in scaleSuffixes],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'BlackClipFactor.tif','OPTIONS':compressOptions})
+    else:
+        ContrastKernels.clipFactorStage([taskProcessTileDirectory + 'WhiteClipByteExpandSmooth' + scaleSuffix + '.tif' for scaleSuffix in scaleSuffixes], taskProcessTileDirectory + 'WhiteClipFactor.tif', compressOptions, kernelBackend)
+        ContrastKernels.clipFactorStage([taskProcessTileDirectory + 'BlackClipByteExpandSmooth' + scaleSuffix + '.tif' for scaleSuffix in scaleSuffixes], taskProcessTileDirectory + 'BlackClipFactor.tif', compressOptions, kernelBackend)
+    runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'WhiteClipFactor.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':6,'TARGET_EXTENT':taskRasTileExtent,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'WhiteClipFactorResamp.tif'})
+    runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'BlackClipFactor.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':3,'NODATA':None,'TARGET_RESOLUTION':pixelSizeAve,'OPTIONS':compressOptions,'DATA_TYPE':6,'TARGET_EXTENT':taskRasTileExtent,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'BlackClipFactorResamp.tif'})
+
+
+    #Apply the difference to the bands, potentially with clipping prevention
+    if useCalculator:
+        runAlgorithm("gdal:rastercalculator", {'INPUT_A':taskInImageTile,'BAND_A':1,'INPUT_B':taskProcessTileDirectory + 'ScaledBackDifference.tif','BAND_B':1,'INPUT_C':taskProcessTileDirectory + 'WhiteClipFactorResamp.tif','BAND_C':1,'INPUT_D':taskProcessTileDirectory + 'BlackClipFactorResamp.tif','BAND_D':1,'INPUT_E':taskProcessTileDirectory + 'ShadowBoostFinal.tif','BAND_E':1,
+            'FORMULA':'((A.astype(numpy.float64) + B.astype(numpy.float64))*(1- C.astype(numpy.float64) - D.astype(numpy.float64)))+ (255 * (D.astype(numpy.float64))) + (E.astype(numpy.float64))','RTYPE':1,'NO_DATA':-1,'OPTIONS':compressOptions,'EXTRA':'','OUTPUT':taskProcessTileDirectory + 'Band1Diffed.tif'})
+        runAlgorithm("gdal:rastercalculator", {'INPUT_A':taskInImageTile,'BAND_A':2,'INPUT_B':taskProcessTileDirectory + 'ScaledBackDifference.tif','BAND_B':1,'INPUT_C':taskProcessTileDirectory + 'WhiteClipFactorResamp.tif','BAND_C':1,'INPUT_D':taskProcessTileDirectory + 'BlackClipFactorResamp.tif','BAND_D':1,'INPUT_E':taskProcessTileDirectory + 'ShadowBoostFinal.tif','BAND_E':1,
+            'FORMULA':'((A.astype(numpy.float64) + B.astype(numpy.float64))*(1- C.astype(numpy.float64) - D.astype(numpy.float64)))+ (255 * (D.astype(numpy.float64))) + (E.astype(numpy.float64))','RTYPE':1,'NO_DATA':-1,'OPTIONS':compressOptions,'EXTRA':'','OUTPUT':taskProcessTileDirectory + 'Band2Diffed.tif'})
+        runAlgorithm("gdal:rastercalculator", {'INPUT_A':taskInImageTile,'BAND_A':3,'INPUT_B':taskProcessTileDirectory + 'ScaledBackDifference.tif','BAND_B':1,'INPUT_C':taskProcessTileDirectory + 'WhiteClipFactorResamp.tif','BAND_C':1,'INPUT_D':taskProcessTileDirectory + 'BlackClipFactorResamp.tif','BAND_D':1,'INPUT_E':taskProcessTileDirectory + 'ShadowBoostFinal.tif','BAND_E':1,
+            'FORMULA':'((A.astype(numpy.float64) + B.astype(numpy.float64))*(1- C.astype(numpy.float64) - D.astype(numpy.float64)))+ (255 * (D.astype(numpy.float64))) + (E.astype(numpy.float64))','RTYPE':1,'NO_DATA':-1,'OPTIONS':compressOptions,'EXTRA':'','OUTPUT':taskProcessTileDirectory + 'Band3Diffed.tif'})
+    else:
+        for bandNumber in [1, 2, 3]:
+            ContrastKernels.applyDifferenceStage(taskInImageTile, bandNumber, taskProcessTileDirectory + 'ScaledBackDifference.tif', taskProcessTileDirectory + 'WhiteClipFactorResamp.tif', taskProcessTileDirectory + 'BlackClipFactorResamp.tif', taskProcessTileDirectory + 'ShadowBoostFinal.tif', taskProcessTileDirectory + 'Band' + str(bandNumber) + 'Diffed.tif', compressOptions, kernelBackend)
+
+    """
+    ###########################################################################
+    The tiles need a fading alpha band so they sit together nicely
+    """
+
+
+    #Get the full extent of the tile
+    runAlgorithm("native:polygonfromlayerextent", {'INPUT':taskInImageTile,'ROUND_TO':0,'OUTPUT':taskProcessTileDirectory + 'FullExtent.gpkg'})
+
+    #Bring this in so that any border issues are taken away
+    runAlgorithm("native:buffer", {'INPUT':taskProcessTileDirectory + 'FullExtent.gpkg','DISTANCE':pixelSizeAve * (-2),'SEGMENTS':5,'END_CAP_STYLE':0,'JOIN_STYLE':0,'MITER_LIMIT':2,'DISSOLVE':False,'OUTPUT':taskProcessTileDirectory + 'FullExtentIn.gpkg'})
+
+    #Then convert to lines so that
+    runAlgorithm("native:polygonstolines", {'INPUT':taskProcessTileDirectory + 'FullExtentIn.gpkg','OUTPUT':taskProcessTileDirectory + 'FullExtentInLines.gpkg'})
+
+    #A raster is buffered off the lines so that has its values at 255 across most of the raster, but fades down to 0 at the edges
+    runAlgorithm("gdal:rasterize", {'INPUT':taskProcessTileDirectory + 'FullExtentInLines.gpkg','FIELD':'','BURN':1,'UNITS':1,'WIDTH':pixelSizeX,'HEIGHT':pixelSizeY,'EXTENT':taskRasTileExtent,'NODATA':None,'OPTIONS':compressOptions,'DATA_TYPE':0,'INIT':None,'INVERT':False,'EXTRA':'','OUTPUT':taskProcessTileDirectory + 'FullExtentLinesRasterize.tif'})
+    runAlgorithm("gdal:proximity", {'INPUT':taskProcessTileDirectory + 'FullExtentLinesRasterize.tif','BAND':1,'VALUES':'1','UNITS':1,'MAX_DISTANCE':64,'REPLACE':None,'NODATA':64,'OPTIONS':compressOptions,'EXTRA':'','DATA_TYPE':0,'OUTPUT':taskProcessTileDirectory + 'FullExtentLinesRasterizeDistance.tif'})
+    runAlgorithm("qgis:rastercalculator", {'EXPRESSION':'\"FullExtentLinesRasterizeDistance@1\" * 4','LAYERS':[taskProcessTileDirectory + 'FullExtentLinesRasterizeDistance.tif'],'CELLSIZE':0,'EXTENT':None,'CRS':None,'OUTPUT':taskProcessTileDirectory + 'AlphaBand.tif','OPTIONS': compressOptions})
+
+    fullExtentVector = QgsVectorLayer(taskProcessTileDirectory + 'FullExtent.gpkg')
+    QgsProject.instance().addMapLayer(fullExtentVector, False)
+    QgsProject.instance().removeMapLayer(fullExtentVector.id())
+    fullExtentInVector = QgsVectorLayer(taskProcessTileDirectory + 'FullExtentIn.gpkg')
+    QgsProject.instance().addMapLayer(fullExtentInVector, False)
+    QgsProject.instance().removeMapLayer(fullExtentInVector.id())
+
+    """
+    ###########################################################################
+    Bring all the bands together
+    """
+
+    print("Final value clipping and exporting...")
+
+    #Clip values to within 0 and 255
+    runAlgorithm("gdal:warpreproject", {'INPUT':taskProcessTileDirectory + 'AlphaBand.tif','SOURCE_CRS':None,'TARGET_CRS':None,'RESAMPLING':0,'NODATA':None,'TARGET_RESOLUTION':None,'OPTIONS':compressOptions,'DATA_TYPE':1,'TARGET_EXTENT':taskRasTileExtent,'TARGET_EXTENT_CRS':None,'MULTITHREADING':True,'EXTRA':gdalOptions,'OUTPUT':taskProcessTileDirectory + 'AlphaBandByte.tif'})
+
+    #Bring the bands together
+    runAlgorithm("gdal:buildvirtualraster", {'INPUT':[taskProcessTileDirectory + 'Band1Diffed.tif',taskProcessTileDirectory + 'Band2Diffed.tif',taskProcessTileDirectory + 'Band3Diffed.tif',taskProcessTileDirectory + 'AlphaBandByte.tif'],'RESOLUTION':2,'SEPARATE':True,'PROJ_DIFFERENCE':True,'ADD_ALPHA':False,'ASSIGN_CRS':None,'RESAMPLING':0,'SRC_NODATA':'','EXTRA':'','OUTPUT':taskProcessTileDirectory + 'Band123A.vrt'})
+
+    #Determine where must be clipped to, given the bigger pixels won't line up with the smaller pixels
+    runAlgorithm("native:polygonfromlayerextent", {'INPUT':taskProcessTileDirectory + 'ReducedResRed.tif','ROUND_TO':0,'OUTPUT':taskProcessTileDirectory + 'ReducedResExtent.gpkg'})
+    runAlgorithm("native:buffer", {'INPUT':taskProcessTileDirectory + 'ReducedResExtent.gpkg','DISTANCE':(pixelSizeBig + (pixelSizeAve * 0.8)) * -1,'SEGMENTS':5,'END_CAP_STYLE':0,'JOIN_STYLE':0,'MITER_LIMIT':2,'DISSOLVE':False,'OUTPUT':taskProcessTileDirectory + 'ReducedResExtentIn.gpkg'})
+
+
+    #Clip to vrt to export a final tif
+    runAlgorithm("gdal:cliprasterbymasklayer", {'INPUT':taskProcessTileDirectory + 'Band123A.vrt','MASK':taskProcessTileDirectory + 'FullExtentIn.gpkg','SOURCE_CRS':None,'TARGET_CRS':None,'NODATA':None,
+    'ALPHA_BAND':False,'CROP_TO_CUTLINE':True,'KEEP_RESOLUTION':False,'SET_RESOLUTION':False,'X_RESOLUTION':None,'Y_RESOLUTION':None,'MULTITHREADING':True,'OPTIONS':finalCompressOptions,'DATA_TYPE':1,
+    'EXTRA':'-co \"PHOTOMETRIC=RGB\" -srcalpha -dstalpha ' + gdalOptions,'OUTPUT':outImageDir + taskInImageTileName + 'ClippedFinalTile' + settingsSuffix + '.tif'})
+    print("Final tile export done")
+
+    """
+    ###########################################################################
+    Debug writing and temp file clean up
+    """
+
+    #Make sure that there aren't too many processes piling up
+    debugText = open(otherDirectory + inImageName + "Debug.txt","a+")
+    debugText.write(datetime.now().strftime("%Y%m%d %H%M%S") + ": Ok " + taskInImageTileName + ' is done. Currently there are ' + str(QgsApplication.taskManager().countActiveTasks()) + ' tasks running. Free memory is ' + str(round(psutil.virtual_memory().free / 1000000000,1)) + 'gb. \n')
+    debugText.close()
+
+    #Let go of any layers still holding the files open
+    releaseLayers()
+
+    #Clean up the files so we don't run out of hard drive space
+    time.sleep(0.1)
+    processFiles = glob.glob(taskProcessTileDirectory + '*')
+    for f in processFiles:
+        try:
+            os.remove(f)
+        except BaseException as e:
+            e = e
+
+    confirmationText = open(otherDirectory + 'ConfirmationFiles/' + taskInImageTileName + "Confirmation.txt","w+")
+    confirmationText.write(taskInImageTileName + ' confirmed complete')
+    confirmationText.close()
+
+
+"""
+##########################################################
+A whole tile in one go, for the warm workers
+"""
+
+def processWholeTile(scene, inImageTile):
+    inImageTile = inImageTile.replace('\\','/')
+    inImageTileName = tileName(inImageTile)
+    processTileDirectory, rasTileExtent = prepareTile(scene, inImageTile)
+    sharpenTile(scene, processTileDirectory, inImageTile, rasTileExtent)
+    applyDifferences(None, scene, processTileDirectory, inImageTileName, inImageTile, rasTileExtent)
@@ -0,0 +1,387 @@
+import json, os, sys, time, uuid, threading, socket, glob, random, shutil, subprocess, tempfile
+
+
+"""
+##########################################################
+A tile queue on shared storage, so several nodes can work through the same tiles
+"""
+
+#Jobs are claimed with lease files that are created exclusively, so only one node can win each job
+#A lease file is never rewritten, it's renewed through a file named after its lease id, so a renewal can only ever extend its own lease
+#A lease that isn't renewed in time (e.g the node died) is taken over by the next node that asks
+#Every node's clock is assumed to be roughly in sync, well within the lease time
+#Each run has an id that the coordinator keeps alive in run.json, and workers only ever take jobs from the live run
+
+def queueFolder(queueDirectory, name):
+    return queueDirectory.rstrip('/\\') + '/' + name + '/'
+
+def defaultWorkerName():
+    return socket.gethostname() + '_' + str(os.getpid())
+
+#Write to a temporary file then swap it in, so other nodes never read half a file
+def writeJson(path, contents):
+    tempPath = path + '.' + uuid.uuid4().hex + '.tmp'
+    with open(tempPath, 'w') as tempFile:
+        json.dump(contents, tempFile)
+    os.replace(tempPath, path)
+
+def readJson(path):
+    try:
+        with open(path, 'r') as jsonFile:
+            return json.load(jsonFile)
+    except (OSError, ValueError):
+        return None
+
+
+"""
+##########################################################
+Starting a run, so nothing is picked up from an earlier one
+"""
+
+def runPath(queueDirectory):
+    return queueDirectory.rstrip('/\\') + '/run.json'
+
+def clearJobs(queueDirectory):
+    if os.path.exists(queueDirectory.rstrip('/\\') + '/ready.json'):
+        os.remove(queueDirectory.rstrip('/\\') + '/ready.json')
+    for name in ['jobs', 'leases', 'attempts', 'done']:
+        if os.path.exists(queueFolder(queueDirectory, name)):
+            shutil.rmtree(queueFolder(queueDirectory, name))
+        os.makedirs(queueFolder(queueDirectory, name))
+
+#The coordinator calls this as soon as it starts, before the tiling, and keeps the run alive until the returned event is set
+#Ids start with the time so that a newer run always sorts after an older one
+def startRun(queueDirectory, leaseSeconds):
+    runId = time.strftime('%Y%m%d%H%M%S') + '_' + uuid.uuid4().hex[:8]
+    clearJobs(queueDirectory)
+    writeJson(runPath(queueDirectory), {'runId':runId, 'started':time.time(), 'expires':time.time() + leaseSeconds})
+    stopRun = threading.Event()
+    def heartbeat():
+        while not stopRun.wait(leaseSeconds / 3):
+            run = readJson(runPath(queueDirectory))
+            if run is None or run['runId'] != runId:
+                return
+            run['expires'] = time.time() + leaseSeconds
+            writeJson(runPath(queueDirectory), run)
+    threading.Thread(target = heartbeat, daemon = True).start()
+    return runId, stopRun
+
+#The run whose coordinator is still checking in, or None if there isn't one
+def liveRunId(queueDirectory):
+    run = readJson(runPath(queueDirectory))
+    if run is None or run['expires'] < time.time():
+        return None
+    return run['runId']
+
+
+"""
+##########################################################
+Publishing and tracking the jobs
+"""
+
+#Write each job and finally the list of job ids that workers wait for, tagged with the run they belong to
+def publishJobs(queueDirectory, jobs, runId):
+    clearJobs(queueDirectory)
+    for job in jobs:
+        writeJson(queueFolder(queueDirectory, 'jobs') + job['jobId'] + '.json', job)
+    writeJson(queueDirectory.rstrip('/\\') + '/ready.json', {'runId':runId, 'jobIds':[job['jobId'] for job in jobs], 'published':time.time()})
+
+#The job ids are only handed out for the run that's asked for, anything left from another run is ignored
+def publishedJobIds(queueDirectory, runId):
+    ready = readJson(queueDirectory.rstrip('/\\') + '/ready.json')
+    if ready is None or ready.get('runId') != runId:
+        return None
+    return ready['jobIds']
+
+def queueProgress(queueDirectory, runId):
+    jobIds = publishedJobIds(queueDirectory, runId)
+    if jobIds is None:
+        return 0, None
+    doneCount = len([jobId for jobId in jobIds if os.path.exists(queueFolder(queueDirectory, 'done') + jobId + '.json')])
+    return doneCount, len(jobIds)
+
+def allJobsDone(queueDirectory, runId):
+    doneCount, totalCount = queueProgress(queueDirectory, runId)
+    return totalCount is not None and doneCount >= totalCount
+
+
+"""
+##########################################################
+Claiming, renewing and releasing leases
+"""
+
+def tryCreateLease(leasePath, lease):
+    try:
+        leaseHandle = os.open(leasePath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(leaseHandle, 'w') as leaseFile:
+        json.dump(lease, leaseFile)
+    return True
+
+def renewalPath(queueDirectory, lease):
+    return queueFolder(queueDirectory, 'leases') + lease['jobId'] + '.' + lease['leaseId'] + '.renewed'
+
+def leaseExpired(queueDirectory, leasePath, graceSeconds):
+    existingLease = readJson(leasePath)
+    if existingLease is not None:
+        renewal = readJson(renewalPath(queueDirectory, existingLease))
+        return max(existingLease['expires'], renewal['expires'] if renewal is not None else 0) < time.time()
+    #Unreadable leases are only treated as stale once they're clearly old, in case they're mid-write
+    try:
+        return os.path.getmtime(leasePath) + graceSeconds < time.time()
+    except OSError:
+        return True
+
+#Each attempt is its own file named after the lease it was made under, so the same attempt is never counted twice
+def recordAttempt(queueDirectory, jobId, leaseId, workerName, error):
+    writeJson(queueFolder(queueDirectory, 'attempts') + jobId + '.' + leaseId + '.json', {'worker':workerName, 'error':str(error), 'failed':time.time()})
+    return len(glob.glob(queueFolder(queueDirectory, 'attempts') + jobId + '.*.json'))
+
+def markJobDone(queueDirectory, jobId, status, workerName, result):
+    writeJson(queueFolder(queueDirectory, 'done') + jobId + '.json', {'status':status, 'worker':workerName, 'finished':time.time(), 'result':result})
+
+#Try each unfinished job in turn, taking over any lease that has expired, and return the lease that was won
+#A lease that expired counts as an attempt, as its node most likely died on the job, and once the attempts are used up the job is failed instead
+#A failed job's lease comes back with 'failed' set, so the caller can record it, but it isn't held and there's nothing to release
+def claimJob(queueDirectory, workerName, leaseSeconds, runId, maxAttempts):
+    jobIds = publishedJobIds(queueDirectory, runId)
+    if jobIds is None:
+        return None
+    for jobId in jobIds:
+        if os.path.exists(queueFolder(queueDirectory, 'done') + jobId + '.json'):
+            continue
+        leasePath = queueFolder(queueDirectory, 'leases') + jobId + '.lease'
+        lease = {'jobId':jobId, 'worker':workerName, 'leaseId':uuid.uuid4().hex, 'expires':time.time() + leaseSeconds}
+        if not tryCreateLease(leasePath, lease):
+            if not leaseExpired(queueDirectory, leasePath, leaseSeconds):
+                continue
+            #Only one node can rename the stale lease away, and that node then gets the first go at the new one
+            stalePath = leasePath + '.' + lease['leaseId'] + '.stale'
+            try:
+                os.rename(leasePath, stalePath)
+            except OSError:
+                continue
+            staleLease = readJson(stalePath)
+            staleStillExpired = leaseExpired(queueDirectory, stalePath, leaseSeconds)
+            os.remove(stalePath)
+            #It was renewed just in time, so hand it straight back to its node
+            if not staleStillExpired:
+                if staleLease is not None:
+                    tryCreateLease(leasePath, staleLease)
+                continue
+            if staleLease is None:
+                staleLease = {'jobId':jobId, 'leaseId':lease['leaseId'], 'worker':'unknown'}
+            elif os.path.exists(renewalPath(queueDirectory, staleLease)):
+                os.remove(renewalPath(queueDirectory, staleLease))
+            if recordAttempt(queueDirectory, jobId, staleLease['leaseId'], staleLease['worker'], 'The lease expired') >= maxAttempts:
+                markJobDone(queueDirectory, jobId, 'failed', staleLease['worker'], 'The lease expired on its last attempt')
+                lease['job'] = readJson(queueFolder(queueDirectory, 'jobs') + jobId + '.json')
+                lease['runId'] = runId
+                lease['failed'] = True
+                return lease
+            lease['expires'] = time.time() + leaseSeconds
+            if not tryCreateLease(leasePath, lease):
+                continue
+        #Recheck now that the lease is held, in case another node finished it in the meantime
+        if os.path.exists(queueFolder(queueDirectory, 'done') + jobId + '.json'):
+            releaseLease(queueDirectory, lease)
+            continue
+        lease['job'] = readJson(queueFolder(queueDirectory, 'jobs') + jobId + '.json')
+        lease['runId'] = runId
+        lease['failed'] = False
+        return lease
+    return None
+
+def ownsLease(queueDirectory, lease):
+    existingLease = readJson(queueFolder(queueDirectory, 'leases') + lease['jobId'] + '.lease')
+    return existingLease is not None and existingLease['leaseId'] == lease['leaseId'] and existingLease['worker'] == lease['worker']
+
+#The lease is checked again once the renewal is written, as a node taking it over in between would have renamed it away first
+#Once that second check passes, any node that tries to take it over sees the renewal and hands it back
+def renewLease(queueDirectory, lease, leaseSeconds):
+    if not ownsLease(queueDirectory, lease):
+        return False
+    writeJson(renewalPath(queueDirectory, lease), {'expires':time.time() + leaseSeconds})
+    return ownsLease(queueDirectory, lease)
+
+def releaseLease(queueDirectory, lease):
+    if ownsLease(queueDirectory, lease):
+        try:
+            os.remove(queueFolder(queueDirectory, 'leases') + lease['jobId'] + '.lease')
+        except OSError:
+            pass
+    if os.path.exists(renewalPath(queueDirectory, lease)):
+        try:
+            os.remove(renewalPath(queueDirectory, lease))
+        except OSError:
+            pass
+
+#Keep renewing the lease in the background while the job runs, set the returned event to stop
+def startHeartbeat(queueDirectory, lease, leaseSeconds):
+    stopHeartbeat = threading.Event()
+    def heartbeat():
+        while not stopHeartbeat.wait(leaseSeconds / 3):
+            if not renewLease(queueDirectory, lease, leaseSeconds):
+                return
+    threading.Thread(target = heartbeat, daemon = True).start()
+    return stopHeartbeat
+
+#Once a new run has started, a lease from the old one mustn't mark off the new run's job of the same name
+def leaseInCurrentRun(queueDirectory, lease):
+    return publishedJobIds(queueDirectory, lease['runId']) is not None
+
+#Renewing the lease first makes sure it's still this node's, and that nobody can take it over before it's marked done
+#Returns False if the lease was lost (e.g the node stalled past its lease), then the job belongs to whichever node took it over and this result is thrown away
+def completeJob(queueDirectory, lease, leaseSeconds, result = None):
+    if not leaseInCurrentRun(queueDirectory, lease) or not renewLease(queueDirectory, lease, leaseSeconds):
+        releaseLease(queueDirectory, lease)
+        return False
+    markJobDone(queueDirectory, lease['jobId'], 'done', lease['worker'], result)
+    releaseLease(queueDirectory, lease)
+    return True
+
+#Returns True if the job is still in the queue (put back, or already taken over by another node), or False once it has used up its attempts
+def failJob(queueDirectory, lease, error, maxAttempts):
+    if not leaseInCurrentRun(queueDirectory, lease):
+        return False
+    #The node that took the lease over has already counted this attempt
+    if not ownsLease(queueDirectory, lease):
+        releaseLease(queueDirectory, lease)
+        return True
+    if recordAttempt(queueDirectory, lease['jobId'], lease['leaseId'], lease['worker'], error) >= maxAttempts:
+        markJobDone(queueDirectory, lease['jobId'], 'failed', lease['worker'], str(error))
+        releaseLease(queueDirectory, lease)
+        return False
+    releaseLease(queueDirectory, lease)
+    return True
+
+#Wait for a live run, then hand out its leases until every job is done, waiting while the other nodes hold what's left
+#None is handed out whenever there's nothing to claim, before each wait, so the caller can get on with other things (e.g merges) in the meantime
+#A finished or abandoned run that was already there is never joined, and a coordinator that restarts is followed onto its new run
+def claimJobs(queueDirectory, workerName, leaseSeconds, maxAttempts, pollSeconds = 5):
+    runId = None
+    while runId is None or not allJobsDone(queueDirectory, runId):
+        currentRunId = liveRunId(queueDirectory)
+        if currentRunId is not None:
+            runId = currentRunId
+        lease = None
+        if runId is not None:
+            lease = claimJob(queueDirectory, workerName, leaseSeconds, runId, maxAttempts)
+        yield lease
+        if lease is None:
+            time.sleep(pollSeconds)
+
+
+"""
+##########################################################
+Checking it locally: python TileQueue.py selftest [numberOfWorkers] [numberOfJobs]
+Launches worker processes against a temp directory, with one worker dying mid-job, one job failing once and one job that takes down every worker that runs it
+One worker also stalls past its lease, so its job is taken over and the stalled worker's result has to be thrown away
+The workers start while an abandoned run is still in the folder, before the coordinator's run has started, like they would on site
+"""
+
+def selfTestJob(queueDirectory, lease, stopHeartbeat, leaseSeconds):
+    job = lease['job']
+    markerPath = queueDirectory + 'results/' + job['jobId']
+    if job['behaviour'] == 'crash' and not os.path.exists(markerPath + '.crashed'):
+        open(markerPath + '.crashed', 'w').close()
+        os._exit(1)
+    if job['behaviour'] == 'flaky' and not os.path.exists(markerPath + '.flaked'):
+        open(markerPath + '.flaked', 'w').close()
+        raise RuntimeError('A flaky job failing on its first go')
+    if job['behaviour'] == 'killer':
+        open(markerPath + '.killed' + lease['leaseId'], 'w').close()
+        os._exit(1)
+    if job['behaviour'] == 'stalled' and not os.path.exists(markerPath + '.stalled'):
+        open(markerPath + '.stalled', 'w').close()
+        stopHeartbeat.set()
+        time.sleep(leaseSeconds * 2.5)
+    if job['behaviour'] == 'stale':
+        open(markerPath + '.stale', 'w').close()
+    time.sleep(random.uniform(0.05, 0.3))
+    with open(markerPath + '.txt', 'a') as resultFile:
+        resultFile.write(lease['worker'] + '\n')
+
+def selfTestWorker(queueDirectory, workerName, leaseSeconds):
+    for lease in claimJobs(queueDirectory, workerName, leaseSeconds, selfTestAttempts, pollSeconds = 0.2):
+        if lease is None or lease['failed']:
+            continue
+        stopHeartbeat = startHeartbeat(queueDirectory, lease, leaseSeconds)
+        try:
+            selfTestJob(queueDirectory, lease, stopHeartbeat, leaseSeconds)
+            if not completeJob(queueDirectory, lease, leaseSeconds):
+                open(queueDirectory + 'results/' + lease['jobId'] + '.discarded', 'w').close()
+        except Exception as e:
+            failJob(queueDirectory, lease, e, selfTestAttempts)
+        finally:
+            stopHeartbeat.set()
+
+#The killer job should take down this many workers before it's given up on, so there needs to be at least one more worker than this plus the crash and the stall
+selfTestAttempts = 2
+
+def selfTest(numberOfWorkers, numberOfJobs):
+    queueDirectory = tempfile.mkdtemp(prefix = 'TileQueueTest').replace('\\', '/') + '/'
+    os.mkdir(queueDirectory + 'results/')
+    leaseSeconds = 2
+    jobs = [{'jobId':'Tile' + str(jobNumber), 'behaviour':'normal'} for jobNumber in range(numberOfJobs)]
+    jobs[0]['behaviour'] = 'crash'
+    jobs[1]['behaviour'] = 'flaky'
+    jobs[2]['behaviour'] = 'killer'
+    jobs[3]['behaviour'] = 'stalled'
+    
+    #An earlier run that was left half done, its coordinator is long gone
+    staleJobs = [{'jobId':'OldTile' + str(jobNumber), 'behaviour':'stale'} for jobNumber in range(4)]
+    publishJobs(queueDirectory, staleJobs, 'OldRun')
+    writeJson(queueFolder(queueDirectory, 'done') + 'OldTile0.json', {'status':'done'})
+    writeJson(runPath(queueDirectory), {'runId':'OldRun', 'started':time.time() - 100, 'expires':time.time() - 50})
+    
+    startTime = time.time()
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker', queueDirectory, 'Worker' + str(workerNumber), str(leaseSeconds)]) for workerNumber in range(numberOfWorkers)]
+    
+    #The coordinator starts its run, takes a while tiling, then publishes
+    time.sleep(1)
+    runId, stopRun = startRun(queueDirectory, leaseSeconds)
+    time.sleep(1)
+    publishJobs(queueDirectory, jobs, runId)
+    problems = []
+    if any(worker.poll() is not None for worker in workers):
+        problems.append('A worker gave up before the run was published')
+    for worker in workers:
+        worker.wait()
+    stopRun.set()
+    if len(glob.glob(queueDirectory + 'results/*.stale')) > 0:
+        problems.append('Jobs from the abandoned run were picked up')
+    for job in jobs:
+        doneRecord = readJson(queueFolder(queueDirectory, 'done') + job['jobId'] + '.json')
+        if job['behaviour'] == 'killer':
+            if doneRecord is None or doneRecord['status'] != 'failed':
+                problems.append(job['jobId'] + ' kept taking down workers but was never failed')
+            elif len(glob.glob(queueDirectory + 'results/' + job['jobId'] + '.killed*')) != selfTestAttempts:
+                problems.append(job['jobId'] + ' was handed out ' + str(len(glob.glob(queueDirectory + 'results/' + job['jobId'] + '.killed*'))) + ' times rather than ' + str(selfTestAttempts))
+        elif doneRecord is None or doneRecord['status'] != 'done':
+            problems.append(job['jobId'] + ' was not completed')
+        elif not os.path.exists(queueDirectory + 'results/' + job['jobId'] + '.txt'):
+            problems.append(job['jobId'] + ' was marked done without any output')
+    stalledTakenOver = len(glob.glob(queueFolder(queueDirectory, 'attempts') + jobs[3]['jobId'] + '.*.json')) > 0
+    if stalledTakenOver != os.path.exists(queueDirectory + 'results/' + jobs[3]['jobId'] + '.discarded'):
+        problems.append(jobs[3]['jobId'] + (' was completed by the worker that lost its lease' if stalledTakenOver else ' was thrown away while its worker still held the lease'))
+    elif not stalledTakenOver:
+        problems.append(jobs[3]['jobId'] + ' was never taken over from the stalled worker, there were too few workers left')
+    if len(glob.glob(queueFolder(queueDirectory, 'leases') + '*')) > 0:
+        problems.append('Leases were left behind')
+    print(str(numberOfJobs) + ' jobs across ' + str(numberOfWorkers) + ' workers took ' + str(round(time.time() - startTime, 1)) + ' seconds')
+    for problem in problems:
+        print(problem)
+    shutil.rmtree(queueDirectory)
+    print('Self test ' + ('failed' if problems else 'passed'))
+    return len(problems) == 0
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        selfTestWorker(sys.argv[2], sys.argv[3], float(sys.argv[4]))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'selftest':
+        passed = selfTest(int(sys.argv[2]) if len(sys.argv) > 2 else 6, int(sys.argv[3]) if len(sys.argv) > 3 else 40)
+        sys.exit(0 if passed else 1)
+    else:
+        print('Usage: python TileQueue.py selftest [numberOfWorkers] [numberOfJobs]')
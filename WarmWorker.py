@@ -0,0 +1,246 @@
+import os, sys, time, secrets
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+
+
+"""
+##########################################################
+A long running worker that keeps QGIS, processing and grass warm, and takes whole tiles over a local socket
+"""
+
+#Start one per core you want to use from the OSGeo4W shell (so the QGIS python libraries can be found), e.g
+#python-qgis WarmWorker.py serve 6001
+#Then list the ports in warmWorkerPorts in GeoTIFFContrastOptimiser.py, and the tiles get sent to these rather than processed within QGIS
+#Startup is paid once per worker, rather than the algorithm lookup and context setup being paid for every processing call
+
+#The messages are pickled, so anything that can connect with the key can run code inside the worker
+#There's no built in key for that reason, either one is given or a random one is kept in a file that only this user can read
+keyFilePath = os.path.join(os.path.expanduser('~'), '.GeoTIFFContrastOptimiserWorkerKey')
+publicAuthKey = 'GeoTIFFContrastOptimiser'
+
+#Numbers that are kept per tile and as a running total, so the overhead of each call can be compared against the algorithms' own work
+#Lookups, parameter checks and layer loading (prepare and post processing) are the per call overhead, algorithmSeconds is the run itself
+def emptyTimings():
+    return {'tiles':0, 'calls':0, 'lookupSeconds':0.0, 'checkSeconds':0.0, 'layerSeconds':0.0, 'algorithmSeconds':0.0, 'queueSeconds':0.0, 'tileSeconds':0.0}
+
+def callOverheadSeconds(timings):
+    return timings['lookupSeconds'] + timings['checkSeconds'] + timings['layerSeconds']
+
+
+"""
+##########################################################
+The key the workers and QGIS share
+"""
+
+#Made the first time it's asked for, on Windows the file is kept private by the home folder's permissions rather than its mode
+def readKeyFile():
+    if not os.path.exists(keyFilePath):
+        try:
+            keyHandle = os.open(keyFilePath, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+            with os.fdopen(keyHandle, 'w') as keyFile:
+                keyFile.write(secrets.token_hex(32))
+        except FileExistsError:
+            pass
+    if os.name != 'nt' and os.stat(keyFilePath).st_mode & 0o077:
+        raise PermissionError(keyFilePath + ' can be read by other users, so it can\'t be trusted as the worker key. Remove it or chmod 600 it')
+    with open(keyFilePath, 'r') as keyFile:
+        return keyFile.read().strip()
+
+#An empty key means the key file, and the old built in key is refused since anyone with the code knows it
+def resolveAuthKey(authKey = ''):
+    if authKey == publicAuthKey:
+        raise ValueError("'" + publicAuthKey + "' is public, so it can't be used as the worker key. Set your own, or leave it empty to use the random one in " + keyFilePath)
+    if authKey == '':
+        authKey = readKeyFile()
+    if authKey == '':
+        raise ValueError(keyFilePath + ' is empty, remove it so a new key can be made')
+    return authKey
+
+
+"""
+##########################################################
+Starting QGIS once, and running algorithms from a cache
+"""
+
+def startQgis():
+    startupStart = time.time()
+    from qgis.core import QgsApplication
+    qgisApplication = QgsApplication([], False)
+    qgisApplication.initQgis()
+
+    #Processing is a plugin, so it has to be found and started by hand outside of the QGIS window
+    pluginDirectory = os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins')
+    if pluginDirectory not in sys.path: sys.path.append(pluginDirectory)
+    from processing.core.Processing import Processing
+    Processing.initialize()
+
+    #Newer versions of QGIS have grass as its own provider plugin
+    if QgsApplication.processingRegistry().providerById('grass7') is None:
+        try:
+            from grassprovider.Grass7AlgorithmProvider import Grass7AlgorithmProvider
+            QgsApplication.processingRegistry().addProvider(Grass7AlgorithmProvider())
+        except BaseException as e:
+            print("Couldn't start the grass provider, grass tools will fail")
+            print(e)
+
+    return qgisApplication, time.time() - startupStart
+
+#Keep each algorithm and one processing context, so later calls skip straight to running
+#The steps processing.run goes through are done one by one here, so each can be timed on its own
+def makeCachedRunner(timings):
+    from qgis.core import QgsApplication, QgsProcessingFeedback, QgsProcessingException
+    from processing.tools import dataobjects
+
+    feedback = QgsProcessingFeedback()
+    context = dataobjects.createContext(feedback)
+    cachedAlgorithms = {}
+
+    def cachedRun(algorithmId, parameters):
+        lookupStart = time.time()
+        if algorithmId not in cachedAlgorithms:
+            cachedAlgorithms[algorithmId] = QgsApplication.processingRegistry().createAlgorithmById(algorithmId)
+        #Each run gets its own copy of the algorithm, the same as processing.run makes
+        algorithm = cachedAlgorithms[algorithmId].create()
+        checkStart = time.time()
+        parametersOk, message = algorithm.checkParameterValues(parameters, context)
+        if not parametersOk:
+            raise QgsProcessingException(message)
+        prepareStart = time.time()
+        if not algorithm.prepare(parameters, context, feedback):
+            raise QgsProcessingException(algorithmId + " couldn't be prepared")
+        runStart = time.time()
+        results = algorithm.runPrepared(parameters, context, feedback)
+        postStart = time.time()
+        results.update(algorithm.postProcess(context, feedback))
+        postEnd = time.time()
+        timings['lookupSeconds'] = timings['lookupSeconds'] + checkStart - lookupStart
+        timings['checkSeconds'] = timings['checkSeconds'] + prepareStart - checkStart
+        timings['layerSeconds'] = timings['layerSeconds'] + runStart - prepareStart + postEnd - postStart
+        timings['algorithmSeconds'] = timings['algorithmSeconds'] + postStart - runStart
+        timings['calls'] = timings['calls'] + 1
+        return results
+
+    #The layers the algorithms loaded are kept in the context, they need letting go of before the tile's files are deleted
+    def releaseLayers():
+        context.temporaryLayerStore().removeAllMapLayers()
+        context.setLayersToLoadOnCompletion({})
+
+    return cachedRun, releaseLayers
+
+
+"""
+##########################################################
+Serving tiles
+"""
+
+def serve(port, authKey = ''):
+    #Check the key before paying for QGIS to start
+    authKey = resolveAuthKey(authKey)
+    qgisApplication, startupSeconds = startQgis()
+    print("QGIS took " + str(round(startupSeconds, 2)) + " seconds to start")
+
+    import TilePipeline
+    tileTimings = emptyTimings()
+    totalTimings = emptyTimings()
+    TilePipeline.algorithmRunner, TilePipeline.layerReleaser = makeCachedRunner(tileTimings)
+
+    listener = Listener(('localhost', port), authkey = authKey.encode())
+    print("Waiting for tiles on port " + str(port))
+    keepServing = True
+    while keepServing:
+        connection = listener.accept()
+        try:
+            while True:
+                try:
+                    message = connection.recv()
+                except EOFError:
+                    break
+
+                if message['type'] == 'stop':
+                    connection.send({'status':'stopping'})
+                    keepServing = False
+                    break
+
+                if message['type'] == 'stats':
+                    connection.send({'status':'stats', 'startupSeconds':startupSeconds, 'timings':totalTimings})
+                    continue
+
+                #A tile, the time it sat waiting to be picked up is the first part of the dispatch overhead
+                tileStart = time.time()
+                for timingName in tileTimings:
+                    tileTimings[timingName] = 0
+                tileTimings['tiles'] = 1
+                tileTimings['queueSeconds'] = tileStart - message['sentAt']
+                try:
+                    TilePipeline.processWholeTile(message['scene'], message['inImageTile'])
+                    reply = {'status':'done'}
+                except BaseException as e:
+                    TilePipeline.releaseLayers()
+                    reply = {'status':'failed', 'error':str(e)}
+                tileTimings['tileSeconds'] = time.time() - tileStart
+                for timingName in tileTimings:
+                    totalTimings[timingName] = totalTimings[timingName] + tileTimings[timingName]
+                reply['timings'] = dict(tileTimings)
+                reply['startupSeconds'] = startupSeconds
+                connection.send(reply)
+        finally:
+            connection.close()
+
+    listener.close()
+    qgisApplication.exitQgis()
+
+
+"""
+##########################################################
+Sending tiles to a worker, from within QGIS
+"""
+
+#What sendTile raises when the worker itself is gone, hung or won't talk, rather than the tile failing on it
+#Other OSErrors (e.g a key file that can't be read) are left to fail the tile, as a different worker wouldn't help
+connectionErrors = (ConnectionError, EOFError, AuthenticationError, TimeoutError)
+
+#Send a tile and wait for it to be done, the returned timings have the rest of the tile's work and the dispatch filled in
+#A worker that hasn't replied within timeoutSeconds is taken to be hung
+def sendTile(port, scene, inImageTile, authKey = '', timeoutSeconds = 3600):
+    #Tasks can't be sent across, and the workers don't need them
+    sceneToSend = {key:value for key, value in scene.items() if key != 'mergeTask'}
+    sendStart = time.time()
+    connection = Client(('localhost', port), authkey = resolveAuthKey(authKey).encode())
+    try:
+        connection.send({'type':'tile', 'scene':sceneToSend, 'inImageTile':inImageTile, 'sentAt':sendStart})
+        if not connection.poll(timeoutSeconds):
+            raise TimeoutError('The warm worker on port ' + str(port) + " didn't reply within " + str(timeoutSeconds) + ' seconds')
+        reply = connection.recv()
+    finally:
+        connection.close()
+    timings = reply['timings']
+
+    #The tile's own work that isn't a processing call (kernels, the min/max index, reading and writing files), then getting the tile there and back
+    timings['roundTripSeconds'] = time.time() - sendStart
+    timings['otherWorkSeconds'] = timings['tileSeconds'] - timings['algorithmSeconds'] - callOverheadSeconds(timings)
+    timings['dispatchSeconds'] = timings['roundTripSeconds'] - timings['tileSeconds']
+    if reply['status'] != 'done':
+        raise RuntimeError('The warm worker on port ' + str(port) + ' failed: ' + reply['error'])
+    return timings
+
+def describeTimings(timings):
+    return (str(timings['calls']) + ' calls spent ' + str(round(timings['algorithmSeconds'], 2)) + ' seconds in the algorithms, with ' + str(round(callOverheadSeconds(timings), 3)) + ' seconds of per call overhead ('
+        + str(round(timings['lookupSeconds'], 3)) + ' on lookups, ' + str(round(timings['checkSeconds'], 3)) + ' on parameter checks, ' + str(round(timings['layerSeconds'], 3)) + ' loading layers). '
+        + 'The rest of the tile took ' + str(round(timings['otherWorkSeconds'], 2)) + ' seconds, and getting it to and from the worker took ' + str(round(timings['dispatchSeconds'], 3)) + ' seconds (' + str(round(timings['queueSeconds'], 3)) + ' waiting to start)')
+
+def sendMessage(port, message, authKey = ''):
+    connection = Client(('localhost', port), authkey = resolveAuthKey(authKey).encode())
+    try:
+        connection.send(message)
+        return connection.recv()
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == 'serve':
+        serve(int(sys.argv[2]), sys.argv[3] if len(sys.argv) > 3 else '')
+    elif len(sys.argv) > 2 and sys.argv[1] in ['stats', 'stop']:
+        print(sendMessage(int(sys.argv[2]), {'type':sys.argv[1]}, sys.argv[3] if len(sys.argv) > 3 else ''))
+    else:
+        print('Usage: python-qgis WarmWorker.py serve|stats|stop port [authKey]')